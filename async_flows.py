@@ -0,0 +1,472 @@
+"""
+Async order-process flows over the Chrome DevTools protocol.
+
+The helpers of TestOrderPlacementProcess block a thread on every WebDriver command.
+The flows here talk to the browser over Selenium's CDP websocket with trio instead,
+so one process drives many tabs at once. Every flow gets its own tab in its own
+browser context (its own cookies, hence its own cart) and its own timeout, and
+cancelling the run cancels every flow still in progress and closes its tab.
+
+Usage:
+    results = run_concurrently(driver, {
+        f"guest-{n}": functools.partial(guest_checkout, items=[("Overnight Duffle", 1)]) for n in range(4)
+    })
+    python async_flows.py --tabs 4
+"""
+import argparse
+import functools
+import json
+import logging
+import math
+import sys
+import threading
+import time
+import urllib.request
+from collections import namedtuple
+from contextlib import asynccontextmanager
+from urllib.parse import quote_plus
+
+from selenium.webdriver.common.by import By
+
+import config
+from cart_page import READ_CART_SCRIPT, SUBMIT_CART_FORM_SCRIPT
+from form_fill import BULK_FILL_SCRIPT, _field_specs
+from instrumentation import RECORDER
+from product_index import PRODUCT_INDEX, READ_RESULTS_SCRIPT, ProductIndexError, option_selector, pick_result
+from scenarios import load_order_details
+from waits import IDLE_OBSERVER_SCRIPT
+
+
+DEFAULT_FLOW_TIMEOUT = 60
+
+FlowResult = namedtuple("FlowResult", "name outcome duration error")
+
+# Resolves once an element matching the selector is present (and visible, if asked for).
+WAIT_FOR_ELEMENT_SCRIPT = """
+var selector = arguments[0], visible = arguments[1];
+function isVisible(element) {
+    var style = window.getComputedStyle(element);
+    return style.display !== 'none' && style.visibility !== 'hidden' && element.getClientRects().length > 0;
+}
+return new Promise(function (resolve) {
+    (function poll() {
+        var found = Array.prototype.some.call(document.querySelectorAll(selector), function (element) {
+            return !visible || isVisible(element);
+        });
+        if (found) { resolve(true); } else { setTimeout(poll, 50); }
+    })();
+});
+"""
+
+# Resolves once the expression (substituted for %s) is truthy.
+WAIT_UNTIL_SCRIPT = """
+return new Promise(function (resolve) {
+    (function poll() {
+        var value = (%s);
+        if (value) { resolve(value); } else { setTimeout(poll, 50); }
+    })();
+});
+"""
+
+# Resolves once the storefront is idle, see waits.py.
+WAIT_FOR_IDLE_SCRIPT = IDLE_OBSERVER_SCRIPT + """
+var quietMs = arguments[0];
+return new Promise(function (resolve) { window.__magentoIdle.whenIdle(quietMs, resolve); });
+"""
+
+# Clicks the first visible element matching the selector.
+CLICK_SCRIPT = """
+var elements = document.querySelectorAll(arguments[0]);
+for (var i = 0; i < elements.length; i++) {
+    var style = window.getComputedStyle(elements[i]);
+    if (style.display !== 'none' && style.visibility !== 'hidden' && elements[i].getClientRects().length > 0) {
+        elements[i].click();
+        return true;
+    }
+}
+return false;
+"""
+
+SUBMIT_FORM_SCRIPT = """
+var form = document.querySelector(arguments[0]);
+if (!form) { return false; }
+if (form.requestSubmit) { form.requestSubmit(); } else { form.submit(); }
+return true;
+"""
+
+# The DevTools errors of a script whose document was replaced while it ran.
+NAVIGATION_ERRORS = ("Execution context was destroyed", "Cannot find context with specified id",
+                     "Inspected target navigated or closed")
+
+READ_SKU_SCRIPT = """
+var sku = document.querySelector('[itemprop="sku"]');
+return sku ? sku.textContent.trim() : null;
+"""
+
+# The index crawls missing products with the WebDriver session, one at a time.
+_LOOKUP_LOCK = threading.Lock()
+
+COUNT_VISIBLE_SCRIPT = """
+return Array.prototype.filter.call(document.querySelectorAll(arguments[0]), function (element) {
+    return element.getClientRects().length > 0;
+}).length;
+"""
+
+
+class AsyncFlowError(Exception):
+    """Raised when a step of an async flow cannot be completed."""
+
+
+def cdp_endpoint(driver):
+    """
+    Find the DevTools websocket of a browser session.
+
+    Returns:
+        tuple: (browser websocket URL, major browser version).
+
+    Raises:
+        AsyncFlowError: If the session does not expose a DevTools endpoint.
+    """
+    version = str(driver.caps.get("browserVersion", "")).split(".")[0]
+    if driver.caps.get("se:cdp"):
+        return driver.caps["se:cdp"], version
+    debugger_address = driver.caps.get("goog:chromeOptions", {}).get("debuggerAddress")
+    if not debugger_address:
+        raise AsyncFlowError("The browser session exposes no DevTools endpoint.")
+    with urllib.request.urlopen(f"http://{debugger_address}/json/version", timeout=10) as response:
+        return json.load(response)["webSocketDebuggerUrl"], version
+
+
+class AsyncTab:
+    """One tab of an async flow. Scripts use the execute_script calling convention."""
+
+    def __init__(self, session, devtools, driver=None):
+        self.session = session
+        self.devtools = devtools
+        # The WebDriver session of the browser, for the product index crawler.
+        self.driver = driver
+
+    async def call(self, script, *args):
+        """Run a script taking `arguments` and returning a value (or a promise of one)."""
+        expression = f"(function () {{ {script} }}).apply(null, {json.dumps(args)})"
+        result, exception = await self.session.execute(self.devtools.runtime.evaluate(
+            expression=expression, return_by_value=True, await_promise=True))
+        if exception:
+            raise AsyncFlowError(exception.exception.description if exception.exception else exception.text)
+        return result.value
+
+    async def call_until_done(self, script, *args):
+        """Like call(), but run the script again in the new document when a navigation interrupts it."""
+        import trio
+        from selenium.webdriver.common.bidi.cdp import BrowserError
+
+        while True:
+            try:
+                return await self.call(script, *args)
+            except BrowserError as e:
+                if not any(message in str(e) for message in NAVIGATION_ERRORS):
+                    raise
+                logging.debug(f"Page changed while waiting: {e}")
+                await trio.sleep(0.05)
+
+    async def navigate(self, url):
+        await self.session.execute(self.devtools.page.navigate(url=url))
+        await self.wait_idle()
+
+    async def wait_idle(self, quiet_ms=150):
+        """Wait until the storefront is idle, as waits.wait_for_magento_idle does."""
+        await self.call_until_done(WAIT_FOR_IDLE_SCRIPT, quiet_ms)
+
+    async def wait_for(self, selector, visible=True):
+        await self.call_until_done(WAIT_FOR_ELEMENT_SCRIPT, selector, visible)
+
+    async def wait_until(self, expression):
+        return await self.call_until_done(WAIT_UNTIL_SCRIPT % expression)
+
+    async def click(self, selector):
+        await self.wait_for(selector)
+        if not await self.call(CLICK_SCRIPT, selector):
+            raise AsyncFlowError(f"No visible element to click for '{selector}'.")
+
+    async def submit(self, selector):
+        await self.wait_for(selector, visible=False)
+        if not await self.call(SUBMIT_FORM_SCRIPT, selector):
+            raise AsyncFlowError(f"No form to submit for '{selector}'.")
+
+    async def fill(self, fields):
+        """Fill fields given as {key: ((by, locator), value)} in one script, as form_fill.bulk_fill does."""
+        return await self.call(BULK_FILL_SCRIPT, _field_specs(fields))
+
+    async def count(self, selector):
+        return await self.call(COUNT_VISIBLE_SCRIPT, selector)
+
+
+@asynccontextmanager
+async def open_tab(connection, devtools, driver=None):
+    """Open a tab in a new browser context, and dispose of both when the block exits."""
+    import trio
+
+    context_id = await connection.execute(devtools.target.create_browser_context())
+    try:
+        target_id = await connection.execute(devtools.target.create_target(url="about:blank",
+                                                                            browser_context_id=context_id))
+        async with connection.open_session(target_id) as session:
+            await session.execute(devtools.page.enable())
+            await session.execute(devtools.page.add_script_to_evaluate_on_new_document(source=IDLE_OBSERVER_SCRIPT))
+            yield AsyncTab(session, devtools, driver)
+    finally:
+        # Clean up even when the flow was cancelled, but don't let a stuck browser hold the run.
+        with trio.move_on_after(5) as cleanup:
+            cleanup.shield = True
+            try:
+                await connection.execute(devtools.target.dispose_browser_context(context_id))
+            except Exception as e:
+                logging.warning(f"Failed to dispose of browser context {context_id}: {e}")
+
+
+def _lookup_product(driver, item_name):
+    with _LOOKUP_LOCK:
+        return PRODUCT_INDEX.lookup(driver, item_name)
+
+
+async def open_product(tab, item_name, size=None, color=None):
+    """
+    Open a product page from the product index and select its swatches by id, as
+    TestOrderPlacementProcess.open_product does.
+
+    Returns:
+        bool: True if the product page is open with the swatches selected, False otherwise.
+    """
+    import trio
+
+    if tab.driver is None or item_name in PRODUCT_INDEX.failed:
+        return False
+    try:
+        # A missing product is crawled with the blocking WebDriver session, outside the event loop.
+        product = await trio.to_thread.run_sync(_lookup_product, tab.driver, item_name)
+    except ProductIndexError as e:
+        logging.warning(e)
+        return False
+    await tab.navigate(config.url(product.path))
+    if await tab.call(READ_SKU_SCRIPT) != product.sku:
+        PRODUCT_INDEX.invalidate(item_name)
+        return False
+    for code, value in (("size", size), ("color", color)):
+        if not value:
+            continue
+        attribute = product.attributes.get(code, {})
+        option_id = attribute.get("options", {}).get(str(value))
+        if option_id is not None:
+            selector = option_selector(attribute["attribute_id"], option_id)
+            with trio.move_on_after(10):
+                await tab.click(selector)
+                continue
+        PRODUCT_INDEX.invalidate(item_name)
+        return False
+    return True
+
+
+async def search_item(tab, item_name):
+    """Search for a product and open the result named exactly like it."""
+    await tab.navigate(config.url(f"catalogsearch/result/?q={quote_plus(item_name)}"))
+    results = await tab.call(READ_RESULTS_SCRIPT)
+    try:
+        result = pick_result(item_name, results)
+    except ProductIndexError as e:
+        raise AsyncFlowError(str(e))
+    await tab.navigate(result["href"])
+
+
+async def add_item_to_cart(tab, item_name, quantity, size=None, color=None):
+    """Open a product, from the product index or the search, pick its options and add it to the cart."""
+    if config.PRODUCT_NAVIGATION == "index" and await open_product(tab, item_name, size, color):
+        size = color = None
+    else:
+        await search_item(tab, item_name)
+    await tab.wait_for("#product-addtocart-button")
+    if size:
+        await tab.click(f".swatch-option.text[option-label='{size}']")
+    if color:
+        await tab.click(f".swatch-option.color[option-label='{color}']")
+    await tab.fill({"qty": ((By.ID, "qty"), quantity)})
+    await tab.click("#product-addtocart-button")
+    await tab.wait_for(".message.success")
+    await tab.wait_idle()
+
+
+async def go_to_checkout(tab):
+    """Open the minicart and proceed to checkout."""
+    await tab.wait_idle()
+    await tab.wait_for(".counter-number", visible=False)
+    await tab.click("a.action.showcart")
+    await tab.click("#top-cart-btn-checkout")
+    await tab.wait_for("#co-shipping-method-form", visible=False)
+    await tab.wait_idle()
+
+
+async def fill_order_details_for_no_login_user(tab, details=None, country="RO", region="279"):
+    """Fill the guest email and shipping address, country and region included."""
+    details = dict(details) if details is not None else load_order_details()
+    if "customer-email" in details:
+        details["customer-email"] = config.guest_email(details["customer-email"])
+    await tab.wait_for("input[name='firstname']")
+    fields = {key: ((By.ID, key) if key == "customer-email" else (By.NAME, key), value)
+              for key, value in details.items()}
+    fields["country_id"] = ((By.NAME, "country_id"), country)
+    fields["region_id"] = ((By.NAME, "region_id"), region)
+    results = await tab.fill(fields)
+    if not results["region_id"]["ok"] and results["country_id"]["ok"]:
+        # The regions of the new country may be loaded asynchronously
+        await tab.wait_idle()
+        results.update(await tab.fill({"region_id": fields["region_id"]}))
+    failed = {key: result for key, result in results.items() if not result["ok"]}
+    if failed:
+        raise AsyncFlowError(f"Order details not filled: {failed}")
+
+
+async def submit_shipping_method(tab, select_rate=True):
+    await tab.wait_idle()
+    if select_rate:
+        await tab.click("input[type='radio']")
+        await tab.wait_idle()
+    await tab.submit("#co-shipping-method-form")
+    await tab.wait_for("#co-payment-form", visible=False)
+
+
+async def apply_discount_code(tab, code="20poff"):
+    """Apply a discount code on the payment step, replacing any code already applied."""
+    await tab.wait_idle()
+    await tab.click("#block-discount-heading")
+    if await tab.count("button.action-cancel"):
+        await tab.click("button.action-cancel")
+        await tab.wait_for("button.action-apply")
+    await tab.fill({"discount-code": ((By.ID, "discount-code"), code)})
+    await tab.click("button.action-apply")
+    await tab.wait_for("button.action-cancel")
+    await tab.wait_idle()
+
+
+async def place_order(tab):
+    await tab.submit("#co-payment-form")
+    await tab.click("button[title='Place Order']")
+    await tab.wait_until("location.href.indexOf('checkout/onepage/success') !== -1")
+
+
+async def delete_all_cart_items(tab):
+    """
+    Empty the cart with a single submit of the cart form, as cart_page.clear_cart does.
+
+    Returns:
+        int: The number of line items removed.
+    """
+    await tab.navigate(config.url("checkout/cart/"))
+    items = await tab.call(READ_CART_SCRIPT)
+    if not items:
+        return 0
+    if not await tab.call(SUBMIT_CART_FORM_SCRIPT, "empty_cart", []):
+        raise AsyncFlowError("The cart form is not on the cart page.")
+    await tab.wait_for(".cart-empty")
+    await tab.wait_idle()
+    return len(items)
+
+
+async def guest_checkout(tab, items, details=None, country="RO", region="279", discount_code=None):
+    """A whole guest checkout: fill the cart, check out and place the order."""
+    await tab.navigate(config.url())
+    for item in items:
+        await add_item_to_cart(tab, *item)
+    await go_to_checkout(tab)
+    await fill_order_details_for_no_login_user(tab, details, country, region)
+    await submit_shipping_method(tab)
+    if discount_code:
+        await apply_discount_code(tab, discount_code)
+    await place_order(tab)
+
+
+async def _run_flow(connection, devtools, driver, name, flow, flow_timeout, results):
+    import trio
+
+    started = time.perf_counter()
+    outcome, error = "cancelled", None
+    try:
+        with trio.fail_after(flow_timeout):
+            async with open_tab(connection, devtools, driver) as tab:
+                await flow(tab)
+        outcome = "passed"
+    except trio.TooSlowError:
+        outcome, error = "timeout", f"Did not finish within {flow_timeout} seconds."
+    except Exception as e:
+        outcome, error = "failed", f"{type(e).__name__}: {e}"
+    finally:
+        duration = time.perf_counter() - started
+        results[name] = FlowResult(name, outcome, duration, error)
+        RECORDER.record(f"flow: {name}", "flow", started, duration, 0, 0.0, outcome=outcome)
+        if error:
+            logging.error(f"Async flow {name} {outcome}: {error}")
+
+
+async def run_flows(driver, flows, flow_timeout=DEFAULT_FLOW_TIMEOUT, timeout=None):
+    """
+    Run async flows concurrently, each in its own tab, on the browser of a WebDriver session.
+
+    Args:
+        driver (WebDriver): The session whose browser runs the flows.
+        flows (dict): {name: async callable taking an AsyncTab}.
+        flow_timeout (float): Seconds after which a single flow is cancelled.
+        timeout (float): Seconds after which the whole run is cancelled, None for no limit.
+
+    Returns:
+        dict: {name: FlowResult}, outcome being "passed", "failed", "timeout" or "cancelled".
+    """
+    import trio
+    from selenium.webdriver.common.bidi import cdp
+
+    ws_url, version = cdp_endpoint(driver)
+    devtools = cdp.import_devtools(version)
+    results = {name: FlowResult(name, "cancelled", 0.0, None) for name in flows}
+    async with cdp.open_cdp(ws_url) as connection:
+        with trio.move_on_after(math.inf if timeout is None else timeout):
+            async with trio.open_nursery() as nursery:
+                for name, flow in flows.items():
+                    nursery.start_soon(_run_flow, connection, devtools, driver, name, flow, flow_timeout, results)
+    return results
+
+
+def run_concurrently(driver, flows, flow_timeout=DEFAULT_FLOW_TIMEOUT, timeout=None):
+    """Blocking entry point of run_flows(), for the unittest suite and scripts."""
+    import trio
+
+    return trio.run(run_flows, driver, flows, flow_timeout, timeout)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run concurrent guest checkouts in the tabs of one browser.")
+    parser.add_argument("--tabs", type=int, default=4, help="Number of concurrent checkouts.")
+    parser.add_argument("--flow-timeout", type=float, default=DEFAULT_FLOW_TIMEOUT)
+    parser.add_argument("--remote", action="store_true", help="Run against MAGENTO_BASE_URL instead of the local stand-in.")
+    args = parser.parse_args(argv)
+
+    if not args.remote:
+        import storefront_stub
+        config.STOREFRONT = "local"
+        storefront_stub.start_local_storefront()
+
+    from session_pool import quit_quietly, start_chrome
+
+    driver = start_chrome()
+    try:
+        started = time.perf_counter()
+        flows = {f"guest-checkout-{n}": functools.partial(guest_checkout, items=[("Overnight Duffle", 1)])
+                 for n in range(args.tabs)}
+        results = run_concurrently(driver, flows, args.flow_timeout)
+        elapsed = time.perf_counter() - started
+    finally:
+        quit_quietly(driver)
+    for result in results.values():
+        print(f"{result.name:<30} {result.outcome:<10} {result.duration:>7.3f}s {result.error or ''}")
+    print(f"{len(results)} flow(s) in {elapsed:.3f}s")
+    return 0 if all(result.outcome == "passed" for result in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
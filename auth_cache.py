@@ -0,0 +1,138 @@
+"""
+Cache of authenticated storefront sessions.
+
+A worker submits the login form once, the session cookies are persisted to disk and
+later browser sessions get them injected through CDP, so logged-in tests start
+already authenticated. Cached sessions expire with their cookies or after
+MAX_AGE_SECONDS, and a session the storefront no longer accepts is dropped so the
+caller falls back to a real login.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+
+import config
+
+
+CACHE_DIR = os.environ.get("ORDER_AUTH_CACHE_DIR", ".auth_cache")
+MAX_AGE_SECONDS = int(os.environ.get("ORDER_AUTH_CACHE_MAX_AGE", "1800"))
+
+# Magento resets the browser's customer section cache when this cookie does not match
+# it; leaving it out makes a fresh browser load the sections of the injected session.
+SKIPPED_COOKIES = {"mage-cache-sessid"}
+
+_memory_cache = {}
+
+
+def cache_path(email):
+    """Return the cache file of an account for the current worker and storefront."""
+    key = hashlib.sha1(f"{config.BASE_URL}|{email}".encode("utf-8")).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"worker{config.WORKER_ID}-{key}.json")
+
+
+def save_session(driver, email):
+    """
+    Persist the cookies of a browser session that just logged in.
+
+    Args:
+        driver (WebDriver): The logged-in browser session.
+        email (str): The account the session is logged in with.
+    """
+    entry = {
+        "base_url": config.BASE_URL,
+        "email": email,
+        "saved_at": time.time(),
+        "cookies": [cookie for cookie in driver.get_cookies() if cookie["name"] not in SKIPPED_COOKIES],
+    }
+    _memory_cache[email] = entry
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(cache_path(email), "w") as cache_file:
+            json.dump(entry, cache_file)
+        logging.info(f"Cached the session of {email}.")
+    except OSError as e:
+        logging.warning(f"Failed to write the session cache: {e}")
+
+
+def load_session(email):
+    """
+    Load a cached session that is still valid.
+
+    Returns:
+        list: The cookies of the session, or None if there is no usable cached session.
+    """
+    entry = _memory_cache.get(email)
+    if entry is None:
+        try:
+            with open(cache_path(email), "r") as cache_file:
+                entry = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+
+    now = time.time()
+    if entry.get("base_url") != config.BASE_URL or now - entry.get("saved_at", 0) > MAX_AGE_SECONDS:
+        invalidate(email)
+        return None
+    if any(cookie.get("expiry") is not None and cookie["expiry"] <= now for cookie in entry["cookies"]):
+        invalidate(email)
+        return None
+    _memory_cache[email] = entry
+    return entry["cookies"]
+
+
+def invalidate(email):
+    """Forget the cached session of an account, e.g. after it logged out."""
+    _memory_cache.pop(email, None)
+    try:
+        os.remove(cache_path(email))
+    except OSError:
+        pass
+
+
+def inject_cookies(driver, cookies):
+    """Set cookies in the browser without navigating to the storefront first."""
+    driver.execute_cdp_cmd("Network.setCookies", {"cookies": [
+        {
+            "name": cookie["name"],
+            "value": cookie["value"],
+            "domain": cookie["domain"],
+            "path": cookie.get("path", "/"),
+            "secure": cookie.get("secure", False),
+            "httpOnly": cookie.get("httpOnly", False),
+            **({"expires": cookie["expiry"]} if "expiry" in cookie else {}),
+            **({"sameSite": cookie["sameSite"]} if cookie.get("sameSite") in ("Strict", "Lax", "None") else {}),
+        }
+        for cookie in cookies
+    ]})
+
+
+def restore_session(driver, email):
+    """
+    Start a browser session already logged in with a cached session.
+
+    The cookies are injected and the account dashboard is opened: Magento redirects
+    unauthenticated visitors to the login page, which tells a stale session apart in
+    the same page load a real login would have needed anyway.
+
+    Returns:
+        bool: True if the browser is now logged in, False if a real login is needed.
+    """
+    cookies = load_session(email)
+    if not cookies:
+        return False
+    try:
+        inject_cookies(driver, cookies)
+        driver.get(config.url("customer/account/"))
+    except Exception as e:
+        logging.warning(f"Failed to restore the cached session of {email}: {e}")
+        invalidate(email)
+        return False
+    if "customer/account/login" in driver.current_url:
+        logging.info(f"Cached session of {email} is stale, logging in again.")
+        invalidate(email)
+        driver.delete_all_cookies()
+        return False
+    logging.info(f"Restored the cached session of {email}.")
+    return True
@@ -0,0 +1,231 @@
+"""
+Benchmark of the checkout flows.
+
+Runs the guest checkout, logged-in checkout and cart deletion flows N times, reports
+p50/p95/max per step and per flow plus the startup time of a browser (on an empty
+profile and on a clone of the warm-start template, each alone and with its first
+storefront page) and of a browser context, and compares them with a stored baseline. The
+run fails when a step got slower than the baseline by more than the threshold. By
+default it runs against the local stand-in storefront so the numbers are reproducible.
+
+Usage:
+    python benchmark.py --runs 5
+    python benchmark.py --runs 5 --update-baseline
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+import unittest
+
+import config
+from stats import percentile
+
+
+FLOWS = ["test_buy_item_no_login", "test_buy_item_login", "test_delete_cart_items"]
+BASELINE_FILE = "benchmark_baseline.json"
+
+# Differences below this many seconds are noise, whatever the relative change.
+MIN_REGRESSION_SECONDS = 0.05
+
+# Report entries that time one operation instead of the steps of a flow.
+# The *_first_page entries time a session's start plus the load of the storefront's home page.
+STARTUP_ENTRIES = ("browser_startup", "browser_first_page", "browser_warm_startup", "browser_warm_first_page",
+                   "context_startup")
+
+
+def summarize(values):
+    return {"p50": percentile(values, 50), "p95": percentile(values, 95), "max": max(values), "runs": len(values)}
+
+
+def time_first_page(start_session, runs):
+    """
+    Time starting a browser session, and loading the storefront's home page in it.
+
+    Returns:
+        tuple: The seconds to start each session, and the seconds to start it and load its first page.
+    """
+    from session_pool import quit_quietly
+
+    startups, first_pages = [], []
+    for _ in range(runs):
+        started = time.perf_counter()
+        driver = start_session()
+        startups.append(time.perf_counter() - started)
+        try:
+            driver.get(config.url())
+            first_pages.append(time.perf_counter() - started)
+        finally:
+            quit_quietly(driver)
+    return startups, first_pages
+
+
+def measure_browser_startup(runs):
+    """Time starting a new browser session on an empty profile, outside of the pool, and its first page."""
+    from session_pool import start_chrome
+
+    return time_first_page(start_chrome, runs)
+
+
+def measure_warm_startup(runs):
+    """
+    Time starting a session on a clone of browser_warmup's profile template, and its
+    first page, which the template's cache and settled profile make faster.
+
+    With ORDER_WARM_START=on the start itself is hidden from the tests (the spare starts
+    while the previous test runs), the first page is what they still wait for.
+    """
+    from browser_warmup import Warmer, build_profile_template
+
+    # The template is built once per machine, that is not part of a session's start.
+    build_profile_template()
+    warmer = Warmer(spares=0)
+    try:
+        return time_first_page(warmer.start_session, runs)
+    finally:
+        warmer.close()
+
+
+def measure_context_startup(runs):
+    """Time opening (and disposing of) a browser context in one already running session."""
+    from session_pool import close_context, open_context, quit_quietly, start_chrome
+
+    durations = []
+    driver = start_chrome()
+    try:
+        for _ in range(runs):
+            started = time.perf_counter()
+            if not open_context(driver):
+                return []
+            durations.append(time.perf_counter() - started)
+            close_context(driver)
+    finally:
+        quit_quietly(driver)
+    return durations
+
+
+def run_flows(runs, flows=FLOWS):
+    """
+    Run each flow `runs` times and collect the duration of the flow and of its steps.
+
+    Returns:
+        tuple: ({flow: {"total": [seconds], step: [seconds]}}, [failed flow runs])
+    """
+    import test_order_process
+    from instrumentation import RECORDER
+
+    samples = {flow: {"total": []} for flow in flows}
+    failures = []
+    for _ in range(runs):
+        for flow in flows:
+            first_event = len(RECORDER.events)
+            result = unittest.TestResult()
+            test_order_process.TestOrderPlacementProcess(flow).run(result)
+            if not result.wasSuccessful():
+                failures.append((flow, (result.errors + result.failures)[0][1]))
+                continue
+            step_totals = {}
+            for event in RECORDER.events[first_event:]:
+                if event["kind"] == "test":
+                    samples[flow]["total"].append(event["duration"])
+                elif event["kind"] == "step":
+                    step_totals[event["name"]] = step_totals.get(event["name"], 0.0) + event["duration"]
+            for name, duration in step_totals.items():
+                samples[flow].setdefault(name, []).append(duration)
+    return samples, failures
+
+
+def build_report(samples, startup):
+    """
+    Summarize the flows step by step, and the startup timings.
+
+    Args:
+        samples (dict): The step durations of every flow, from run_flows().
+        startup (dict): The durations of every entry of STARTUP_ENTRIES that was measured.
+    """
+    report = {name: summarize(startup[name]) for name in STARTUP_ENTRIES if startup.get(name)}
+    for flow, steps in samples.items():
+        report[flow] = {name: summarize(values) for name, values in steps.items() if values}
+    return report
+
+
+def compare(report, baseline, threshold):
+    """
+    Compare a report with the baseline.
+
+    Returns:
+        list: Human-readable descriptions of the steps whose p50 regressed beyond the threshold.
+    """
+    regressions = []
+    for flow, steps in report.items():
+        if flow in STARTUP_ENTRIES:
+            steps, base_steps = {"startup": steps}, {"startup": baseline.get(flow)}
+        else:
+            base_steps = baseline.get(flow, {})
+        for name, stats in steps.items():
+            base = base_steps.get(name)
+            if not base:
+                continue
+            delta = stats["p50"] - base["p50"]
+            if delta > MIN_REGRESSION_SECONDS and stats["p50"] > base["p50"] * (1 + threshold):
+                regressions.append(f"{flow} / {name}: p50 {stats['p50']:.3f}s vs baseline {base['p50']:.3f}s "
+                                   f"(+{delta / base['p50'] * 100:.0f}%)")
+    return regressions
+
+
+def print_report(report, stream=sys.stdout):
+    stream.write(f"{'flow / step':<60} {'p50':>8} {'p95':>8} {'max':>8}\n")
+    for flow, steps in report.items():
+        if flow in STARTUP_ENTRIES:
+            steps = {"": steps}
+        for name, stats in sorted(steps.items(), key=lambda item: item[0] != "total"):
+            label = f"{flow} / {name}" if name else flow
+            stream.write(f"{label:<60} {stats['p50']:>7.3f}s {stats['p95']:>7.3f}s {stats['max']:>7.3f}s\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the checkout flows against a baseline.")
+    parser.add_argument("--runs", type=int, default=5, help="Number of runs of every flow.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative p50 regression per step.")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--update-baseline", action="store_true", help="Store this run as the new baseline.")
+    parser.add_argument("--remote", action="store_true", help="Benchmark MAGENTO_BASE_URL instead of the local stand-in.")
+    args = parser.parse_args(argv)
+
+    if not args.remote:
+        import storefront_stub
+        config.STOREFRONT = "local"
+        storefront_stub.start_local_storefront()
+
+    startup = {}
+    startup["browser_startup"], startup["browser_first_page"] = measure_browser_startup(args.runs)
+    startup["browser_warm_startup"], startup["browser_warm_first_page"] = measure_warm_startup(args.runs)
+    startup["context_startup"] = measure_context_startup(args.runs)
+    samples, failures = run_flows(args.runs)
+    report = build_report(samples, startup)
+    print_report(report)
+    for flow, detail in failures:
+        logging.error(f"{flow} failed during the benchmark:\n{detail}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(report, baseline_file, indent=2)
+        print(f"Baseline written to {args.baseline}")
+        return 1 if failures else 0
+
+    try:
+        with open(args.baseline, "r") as baseline_file:
+            baseline = json.load(baseline_file)
+    except (OSError, ValueError):
+        print(f"No baseline at {args.baseline}, run with --update-baseline to create one.")
+        return 1 if failures else 0
+
+    regressions = compare(report, baseline, args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions or failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,373 @@
+"""
+Resource usage of the browser sessions, and recycling of the sessions that outgrow it.
+
+Pooled sessions run hundreds of Magento checkouts in the same browser, and the
+checkout scripts leave memory and DOM nodes behind. Every session started by
+start_chrome() is monitored:
+
+- a background thread reads the resident memory and CPU time of the session's
+  chromedriver and all its Chrome processes from /proc every ORDER_RESOURCE_INTERVAL
+  seconds, without a WebDriver command (RSS is summed per process, so memory the
+  processes share is counted more than once: an upper bound);
+- at the end of every test the tab's JS heap and DOM node count are read through
+  CDP Performance.getMetrics, and the figures are attributed to the test;
+- the top-level steps of every session that succeeded are timed against the fastest
+  earlier run of the same step in that session, which shows a browser that is
+  getting slower (nested steps and waits, and failed attempts that ran into their
+  timeouts, are left out).
+
+SessionPool.release() quits a session instead of keeping it when it crosses one of the
+thresholds (ORDER_BROWSER_MAX_RSS_MB, ORDER_BROWSER_MAX_HEAP_MB,
+ORDER_BROWSER_MAX_NODES, ORDER_BROWSER_MAX_SLOWDOWN). When the run ends the peak and
+growth per test of every session, and the peak memory of all sessions together, are
+logged and written to browser_resources.worker<N>.json, to size the number of workers
+a machine can take. ORDER_RESOURCE_MONITOR=off turns the monitoring off.
+"""
+import atexit
+import collections
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+
+import config
+from instrumentation import RECORDER
+
+
+REPORT_FILE = f"browser_resources.worker{config.WORKER_ID}.json"
+SAMPLE_INTERVAL = float(os.environ.get("ORDER_RESOURCE_INTERVAL", "2"))
+
+# Recycling thresholds; 0 turns a threshold off.
+MAX_RSS_MB = float(os.environ.get("ORDER_BROWSER_MAX_RSS_MB", "2048"))
+MAX_HEAP_MB = float(os.environ.get("ORDER_BROWSER_MAX_HEAP_MB", "512"))
+MAX_NODES = int(os.environ.get("ORDER_BROWSER_MAX_NODES", "100000"))
+MAX_SLOWDOWN = float(os.environ.get("ORDER_BROWSER_MAX_SLOWDOWN", "2.0"))
+
+# Steps compared with the fastest run of the same step in the session before a slowdown is judged.
+SLOWDOWN_WINDOW = 20
+SLOWDOWN_MIN_STEPS = 10
+
+PROC = "/proc"
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+MB = 1024 * 1024
+
+
+def read_processes():
+    """
+    Read the parent, RSS and CPU time of every process.
+
+    Returns:
+        dict: (ppid, rss_bytes, cpu_seconds) per pid, empty where /proc is unavailable.
+    """
+    processes = {}
+    try:
+        pids = [name for name in os.listdir(PROC) if name.isdigit()]
+    except OSError:
+        return processes
+    for pid in pids:
+        try:
+            with open(f"{PROC}/{pid}/stat", "r") as stat_file:
+                stat = stat_file.read()
+        except OSError:
+            continue
+        # The command name is in parentheses and may contain spaces; the fields after it are fixed.
+        fields = stat[stat.rfind(")") + 2:].split()
+        ppid, utime, stime, rss_pages = int(fields[1]), int(fields[11]), int(fields[12]), int(fields[21])
+        processes[int(pid)] = (ppid, rss_pages * PAGE_SIZE, (utime + stime) / CLOCK_TICKS)
+    return processes
+
+
+def process_tree(root, processes):
+    """The pids of a process and all its descendants."""
+    children = collections.defaultdict(list)
+    for pid, (ppid, _, _) in processes.items():
+        children[ppid].append(pid)
+    tree, pending = [], [root]
+    while pending:
+        pid = pending.pop()
+        if pid in processes:
+            tree.append(pid)
+            pending.extend(children[pid])
+    return tree
+
+
+def total_memory_mb():
+    """The machine's memory, from /proc/meminfo, or None."""
+    try:
+        with open(f"{PROC}/meminfo", "r") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemTotal:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class SessionResources:
+    """The resource figures of one browser session."""
+
+    def __init__(self, number, pid):
+        self.number = number
+        self.pid = pid
+        self.rss_mb = 0.0
+        self.cpu_percent = 0.0
+        self.peak_rss_mb = 0.0
+        self.test_peak_rss_mb = 0.0
+        self.heap_mb = None
+        self.nodes = None
+        self.peak_heap_mb = 0.0
+        self.peak_nodes = 0
+        self.tests = []
+        self._cpu = None
+        self._baselines = {}
+        self._ratios = collections.deque(maxlen=SLOWDOWN_WINDOW)
+
+    def sample(self, processes, now):
+        tree = process_tree(self.pid, processes)
+        if not tree:
+            return
+        self.rss_mb = sum(processes[pid][1] for pid in tree) / MB
+        cpu = sum(processes[pid][2] for pid in tree)
+        if self._cpu is not None and now > self._cpu[1]:
+            self.cpu_percent = max(0.0, cpu - self._cpu[0]) / (now - self._cpu[1]) * 100
+        self._cpu = (cpu, now)
+        self.peak_rss_mb = max(self.peak_rss_mb, self.rss_mb)
+        self.test_peak_rss_mb = max(self.test_peak_rss_mb, self.rss_mb)
+
+    def add_step(self, name, duration):
+        baseline = min(self._baselines.get(name, duration), duration)
+        self._baselines[name] = baseline
+        if baseline > 0:
+            self._ratios.append(duration / baseline)
+
+    def slowdown(self):
+        """The median ratio of the recent steps to their fastest run, or None with too few steps."""
+        if len(self._ratios) < SLOWDOWN_MIN_STEPS:
+            return None
+        return statistics.median(self._ratios)
+
+    def recycle_reason(self):
+        """The threshold the session crossed, as a (kind, reason) pair, or None."""
+        slowdown = self.slowdown()
+        checks = [
+            ("rss", MAX_RSS_MB, self.rss_mb, f"{self.rss_mb:.0f} MB resident"),
+            ("heap", MAX_HEAP_MB, self.heap_mb, f"{self.heap_mb or 0:.0f} MB of JS heap"),
+            ("nodes", MAX_NODES, self.nodes, f"{self.nodes} DOM nodes"),
+            ("slowdown", MAX_SLOWDOWN, slowdown, f"steps {slowdown or 0:.1f}x slower than their fastest run"),
+        ]
+        return next(((kind, reason) for kind, limit, value, reason in checks
+                     if limit and value is not None and value > limit), None)
+
+    def growth_per_test(self, field):
+        """The least-squares slope of a per-test figure over the session's tests."""
+        points = [(index, test[field]) for index, test in enumerate(self.tests) if test[field] is not None]
+        if len(points) < 2:
+            return None
+        mean_x = statistics.fmean(x for x, _ in points)
+        mean_y = statistics.fmean(y for _, y in points)
+        spread = sum((x - mean_x) ** 2 for x, _ in points)
+        return sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+
+    def summary(self):
+        return {
+            "tests": len(self.tests),
+            "peak_rss_mb": round(self.peak_rss_mb, 1),
+            "peak_heap_mb": round(self.peak_heap_mb, 1),
+            "peak_nodes": self.peak_nodes,
+            "rss_mb_per_test": _rounded(self.growth_per_test("rss_mb")),
+            "heap_mb_per_test": _rounded(self.growth_per_test("heap_mb")),
+            "nodes_per_test": _rounded(self.growth_per_test("nodes")),
+            "slowdown": _rounded(self.slowdown()),
+            "per_test": self.tests,
+        }
+
+
+def _rounded(value):
+    return None if value is None else round(value, 3)
+
+
+class ResourceMonitor:
+    """The monitored sessions of the run and the thread sampling them."""
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.sessions = {}
+        self.finished = []
+        self.peak_total_rss_mb = 0.0
+        self.recycled = collections.Counter()
+        self._started = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register(self, driver):
+        process = getattr(getattr(driver, "service", None), "process", None)
+        if process is None:
+            return
+        with self._lock:
+            self._started += 1
+            self.sessions[id(driver)] = SessionResources(self._started, process.pid)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample_loop, name="browser-resources", daemon=True)
+                self._thread.start()
+
+    def unregister(self, driver):
+        with self._lock:
+            session = self.sessions.pop(id(driver), None)
+            if session is not None:
+                self.finished.append(session)
+
+    def session(self, driver):
+        with self._lock:
+            return self.sessions.get(id(driver))
+
+    def _sample_loop(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        """Read the processes of every session, and the memory of all of them together."""
+        processes = read_processes()
+        now = time.monotonic()
+        with self._lock:
+            sessions = list(self.sessions.values())
+        for session in sessions:
+            session.sample(processes, now)
+        self.peak_total_rss_mb = max(self.peak_total_rss_mb, sum(session.rss_mb for session in sessions))
+
+    def bind(self, driver):
+        """Attribute the steps of the current thread to a session, from the start of a test."""
+        self._local.driver = driver
+        session = self.session(driver)
+        if session is not None:
+            session.test_peak_rss_mb = session.rss_mb
+
+    def step_finished(self, event):
+        """Recorder listener: time every successful top-level step against its fastest run in the session."""
+        if event["kind"] != "step" or event["depth"] or event.get("failed"):
+            return
+        driver = getattr(self._local, "driver", None)
+        session = self.session(driver) if driver is not None else None
+        if session is not None:
+            session.add_step(event["name"], event["duration"])
+
+    def read_page_metrics(self, driver, session):
+        try:
+            driver.execute_cdp_cmd("Performance.enable", {})
+            metrics = {metric["name"]: metric["value"]
+                       for metric in driver.execute_cdp_cmd("Performance.getMetrics", {})["metrics"]}
+        except Exception as e:
+            logging.debug(f"Could not read the page metrics: {e}")
+            return
+        session.heap_mb = metrics.get("JSHeapUsedSize", 0) / MB
+        session.nodes = int(metrics.get("Nodes", 0))
+        session.peak_heap_mb = max(session.peak_heap_mb, session.heap_mb)
+        session.peak_nodes = max(session.peak_nodes, session.nodes)
+
+    def report_test(self, test_id, driver):
+        session = self.session(driver)
+        if session is None:
+            return None
+        self.read_page_metrics(driver, session)
+        session.sample(read_processes(), time.monotonic())
+        entry = {
+            "test": test_id,
+            "rss_mb": round(session.rss_mb, 1),
+            "peak_rss_mb": round(session.test_peak_rss_mb, 1),
+            "cpu_percent": round(session.cpu_percent, 1),
+            "heap_mb": _rounded(session.heap_mb),
+            "nodes": session.nodes,
+        }
+        session.tests.append(entry)
+        self._local.driver = None
+        return entry
+
+    def report(self):
+        with self._lock:
+            sessions = self.finished + list(self.sessions.values())
+        per_session = {f"session {session.number}": session.summary() for session in sessions if session.tests}
+        peak_session = max((session.peak_rss_mb for session in sessions), default=0.0)
+        memory = total_memory_mb()
+        report = {
+            "sessions": per_session,
+            "peak_session_rss_mb": round(peak_session, 1),
+            "peak_total_rss_mb": round(self.peak_total_rss_mb, 1),
+            "recycled": dict(self.recycled),
+            "machine_memory_mb": _rounded(memory),
+        }
+        if memory and peak_session:
+            # Sessions that fit in 80% of the machine's memory at the peak a session reached.
+            report["sessions_per_machine"] = int(memory * 0.8 // peak_session)
+        return report
+
+    def close(self):
+        """Stop sampling, log the peaks and write the report of the run."""
+        self._stop.set()
+        if not any(session.tests for session in self.finished + list(self.sessions.values())):
+            return
+        report = self.report()
+        logging.info(f"Browser resources: peak {report['peak_session_rss_mb']} MB per session, "
+                     f"{report['peak_total_rss_mb']} MB for all sessions, {sum(self.recycled.values())} recycled"
+                     + (f", about {report['sessions_per_machine']} sessions fit this machine"
+                        if "sessions_per_machine" in report else "") + ".")
+        try:
+            with open(REPORT_FILE, "w") as report_file:
+                json.dump(report, report_file, indent=2, sort_keys=True)
+        except OSError as e:
+            logging.warning(f"Failed to write {REPORT_FILE}: {e}")
+
+
+MONITOR = ResourceMonitor()
+
+
+def attach(driver):
+    """Start monitoring a new session."""
+    if config.RESOURCE_MONITOR == "on":
+        MONITOR.register(driver)
+    return driver
+
+
+def detach(driver):
+    """Stop monitoring a session that quits."""
+    if config.RESOURCE_MONITOR == "on":
+        MONITOR.unregister(driver)
+
+
+def bind(driver):
+    """Attribute the steps of the current thread to the session it acquired."""
+    if config.RESOURCE_MONITOR == "on":
+        MONITOR.bind(driver)
+
+
+def report_test(test_id, driver):
+    """Read the page metrics of the test's session and attribute the figures to the test."""
+    if config.RESOURCE_MONITOR != "on":
+        return None
+    return MONITOR.report_test(test_id, driver)
+
+
+def recycle_reason(driver):
+    """
+    Check a session against the recycling thresholds.
+
+    Returns:
+        str: Why the session should be quit, or None to keep it.
+    """
+    if config.RESOURCE_MONITOR != "on":
+        return None
+    session = MONITOR.session(driver)
+    check = session.recycle_reason() if session is not None else None
+    if check is None:
+        return None
+    kind, reason = check
+    MONITOR.recycled[kind] += 1
+    return reason
+
+
+if config.RESOURCE_MONITOR == "on":
+    RECORDER.listeners.append(MONITOR.step_finished)
+    atexit.register(MONITOR.close)
@@ -0,0 +1,308 @@
+"""
+Warm browser starts.
+
+A cold start runs chromedriver, starts Chrome and creates an empty profile, and the
+first page then loads every static asset of the storefront over the network. With
+ORDER_WARM_START=on, sessions are started ahead of demand instead:
+
+- A profile template is built once (and rebuilt daily) by a browser that visits the
+  storefront to fill its disk cache, accepts the consent banner and stores the
+  suite's preferences. It is kept in .profile_template/.
+- Every session gets its own copy of the template, made with a copy-on-write clone
+  (cp --reflink on Linux, clonefile on macOS) where the filesystem supports it.
+- Sessions are started in background threads, only when the session pool is about
+  to start one: for its first test, and whenever it quits a session (crashed,
+  recycled) with no idle session left. ORDER_WARM_SESSIONS at most, never more than
+  the tests left to run; while the pool reuses its sessions no spare is started.
+
+The time a test waited for a warm session and the time cold starts took are recorded
+and reported when the run ends.
+"""
+import atexit
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import config
+from instrumentation import RECORDER
+
+
+TEMPLATE_DIR = os.environ.get("ORDER_PROFILE_TEMPLATE", ".profile_template")
+TEMPLATE_MAX_AGE_SECONDS = 24 * 3600
+SPARE_SESSIONS = int(os.environ.get("ORDER_WARM_SESSIONS", "2"))
+
+# Pages whose static assets (RequireJS bundles, Knockout templates, styles) go into the template's cache.
+WARM_UP_PATHS = ["", "checkout/cart/", "customer/account/login/"]
+
+# Clicks the "accept" button of the consent banners the demo storefront may show.
+ACCEPT_CONSENT_SCRIPT = """
+var button = document.querySelector('.fc-cta-consent, #onetrust-accept-btn-handler, button[aria-label="Consent"]');
+if (button) { button.click(); return true; }
+return false;
+"""
+
+# Preferences stored in the template: no password, autofill or translation prompts.
+PROFILE_PREFS = {
+    "credentials_enable_service": False,
+    "profile.password_manager_enabled": False,
+    "autofill.profile_enabled": False,
+    "autofill.credit_card_enabled": False,
+    "translate": {"enabled": False},
+}
+
+# Files a running Chrome keeps in its profile; they must not be copied into a clone.
+LOCK_FILES = ("SingletonLock", "SingletonSocket", "SingletonCookie", "lockfile")
+
+MARKER_FILE = "order_template.json"
+
+
+def template_is_fresh(path=TEMPLATE_DIR):
+    try:
+        with open(os.path.join(path, MARKER_FILE), "r") as marker_file:
+            marker = json.load(marker_file)
+    except (OSError, ValueError):
+        return False
+    return marker.get("base_url") == config.BASE_URL and time.time() - marker.get("built", 0) < TEMPLATE_MAX_AGE_SECONDS
+
+
+def build_profile_template(path=TEMPLATE_DIR):
+    """
+    Build the profile template, unless a fresh one exists.
+
+    The template is built in a temporary directory and renamed into place, so parallel
+    workers racing to build it never see a half-built template.
+
+    Returns:
+        str: The template directory, or None if it could not be built.
+    """
+    from session_pool import build_chrome_options, quit_quietly, start_chrome
+
+    if template_is_fresh(path):
+        return path
+    building = tempfile.mkdtemp(prefix="order-template-", dir=os.path.dirname(os.path.abspath(path)))
+    profile = os.path.join(building, "profile")
+
+    def options():
+        chrome_options = build_chrome_options()
+        chrome_options.add_argument(f"--user-data-dir={profile}")
+        chrome_options.add_experimental_option("prefs", PROFILE_PREFS)
+        return chrome_options
+
+    try:
+        driver = start_chrome(options)
+        try:
+            for page in WARM_UP_PATHS:
+                driver.get(config.url(page))
+                if driver.execute_script(ACCEPT_CONSENT_SCRIPT):
+                    logging.info("Consent banner accepted in the profile template.")
+        finally:
+            quit_quietly(driver)
+        with open(os.path.join(profile, MARKER_FILE), "w") as marker_file:
+            json.dump({"base_url": config.BASE_URL, "built": time.time()}, marker_file)
+        old = f"{path}.old-{os.getpid()}"
+        if os.path.exists(path):
+            os.rename(path, old)
+        os.rename(profile, path)
+        shutil.rmtree(old, ignore_errors=True)
+        logging.info(f"Profile template built in {path}.")
+        return path
+    except Exception as e:
+        logging.warning(f"Failed to build the profile template, starting with empty profiles: {e}")
+        return path if template_is_fresh(path) else None
+    finally:
+        shutil.rmtree(building, ignore_errors=True)
+
+
+def clone_profile(template, destination):
+    """
+    Copy a profile directory, as a copy-on-write clone where the filesystem supports it.
+
+    Args:
+        template (str): The template profile.
+        destination (str): The profile to create; it must not exist yet.
+    """
+    if sys.platform == "darwin":
+        command = ["cp", "-c", "-R", template, destination]
+    elif sys.platform.startswith("linux"):
+        command = ["cp", "-a", "--reflink=auto", template, destination]
+    else:
+        command = None
+    try:
+        if command is None:
+            raise OSError("no copy-on-write copy on this platform")
+        subprocess.run(command, check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logging.debug(f"Copy-on-write clone unavailable, copying the profile: {e}")
+        shutil.rmtree(destination, ignore_errors=True)
+        shutil.copytree(template, destination, symlinks=True, ignore=shutil.ignore_patterns(*LOCK_FILES))
+    for name in LOCK_FILES:
+        try:
+            os.unlink(os.path.join(destination, name))
+        except OSError:
+            pass
+    return destination
+
+
+class Warmer:
+    """
+    Starts browser sessions in the background so that tests take them ready-made.
+
+    expect() tells the warmer how many tests are queued, acquired() counts them down as
+    they take a session from the pool, and need() asks for the session the pool will
+    start on its next acquire. The warmer keeps as many sessions started (or starting)
+    as were asked for, never more than `spares` or the tests left to run.
+    """
+
+    def __init__(self, spares=SPARE_SESSIONS, template=TEMPLATE_DIR):
+        self.spares = spares
+        self.template = template
+        self.remaining = None
+        self.needed = 0
+        self.cold_starts = []
+        self.warm_waits = []
+        self._ready = []
+        self._starting = 0
+        self._template_ready = None
+        self._template_lock = threading.Lock()
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def expect(self, tests):
+        """Announce the number of queued tests and start the session of the first one."""
+        with self._condition:
+            self.remaining = tests
+            self.needed = max(self.needed, 1 if tests else 0)
+        self._refill()
+
+    def acquired(self):
+        """Count down the tests left: one took a session from the pool, new or reused."""
+        with self._condition:
+            if self.remaining:
+                self.remaining -= 1
+
+    def need(self):
+        """Start a spare for the pool, which has no idle session left to hand out."""
+        with self._condition:
+            self.needed += 1
+        self._refill()
+
+    def _wanted(self):
+        limit = min(self.spares, self.needed)
+        if self.remaining is not None:
+            limit = min(limit, self.remaining)
+        return 0 if self._closed else limit - len(self._ready) - self._starting
+
+    def _refill(self):
+        with self._condition:
+            wanted = self._wanted()
+            self._starting += max(wanted, 0)
+        for _ in range(wanted):
+            threading.Thread(target=self._start_spare, name="browser-warmup", daemon=True).start()
+
+    def _profile_template(self):
+        with self._template_lock:
+            if self._template_ready is None:
+                self._template_ready = build_profile_template(self.template) or ""
+            return self._template_ready
+
+    def start_session(self):
+        """Start a session on a clone of the profile template (or an empty profile), timing the cold start."""
+        from session_pool import build_chrome_options, start_chrome
+
+        started = time.perf_counter()
+        template = self._profile_template()
+        profile = None
+        if template:
+            profile = clone_profile(template, os.path.join(tempfile.mkdtemp(prefix="order-profile-"), "profile"))
+
+        def options():
+            chrome_options = build_chrome_options()
+            if profile:
+                chrome_options.add_argument(f"--user-data-dir={profile}")
+            return chrome_options
+
+        driver = start_chrome(options)
+        driver.profile_dir = profile
+        duration = time.perf_counter() - started
+        self.cold_starts.append(duration)
+        RECORDER.record("browser start", "startup", started, duration, 0, 0.0, mode="cold")
+        return driver
+
+    def _start_spare(self):
+        driver = None
+        try:
+            driver = self.start_session()
+        except Exception as e:
+            logging.warning(f"Failed to start a spare browser session: {e}")
+        with self._condition:
+            self._starting -= 1
+            if driver is not None:
+                self._ready.append(driver)
+            self._condition.notify_all()
+            closed = self._closed
+        if closed and driver is not None:
+            self._quit(driver)
+
+    def wait_ready(self, timeout=None):
+        """
+        Wait until a spare session is ready, or no spare is being started.
+
+        Returns:
+            bool: True if a spare is ready to be taken.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._ready or not self._starting, timeout=timeout)
+            return bool(self._ready)
+
+    def take(self):
+        """
+        Hand out a started session: a ready spare, one about to be ready, or a cold start.
+
+        Returns:
+            WebDriver: A new browser session.
+        """
+        started = time.perf_counter()
+        self.wait_ready()
+        with self._condition:
+            driver = self._ready.pop(0) if self._ready else None
+            if self.needed:
+                self.needed -= 1
+        if driver is None:
+            driver = self.start_session()
+        else:
+            waited = time.perf_counter() - started
+            self.warm_waits.append(waited)
+            RECORDER.record("browser start", "startup", started, waited, 0, 0.0, mode="warm")
+        self._refill()
+        return driver
+
+    def _quit(self, driver):
+        from session_pool import quit_quietly
+
+        quit_quietly(driver)
+
+    def close(self):
+        """Quit the spare sessions nobody took and report cold vs warm starts."""
+        with self._condition:
+            self._closed = True
+            spares, self._ready = self._ready, []
+        for driver in spares:
+            self._quit(driver)
+        logging.info(self.report())
+
+    def report(self):
+        def average(values):
+            return f"{sum(values) / len(values):.3f}s" if values else "n/a"
+
+        return (f"Browser startup: {len(self.warm_waits)} warm start(s) waited {average(self.warm_waits)} on average, "
+                f"{len(self.cold_starts)} cold start(s) took {average(self.cold_starts)} on average.")
+
+
+WARMER = Warmer()
+atexit.register(WARMER.close)
@@ -0,0 +1,142 @@
+"""
+Read and change the shopping cart page in a constant number of round trips.
+
+The cart page is read once into a CartIndex (every line item with its position,
+item id, name, quantity and options), and removals are done with a single submit
+of the cart form: "empty_cart" clears the whole cart, a quantity of 0 removes a line
+item. Deleting any number of items therefore costs one page load, not one per item.
+"""
+import logging
+from collections import namedtuple
+
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+
+from instrumentation import WebDriverWait
+
+
+CartItem = namedtuple("CartItem", "index item_id name qty options")
+
+READ_CART_SCRIPT = """
+var rows = document.querySelectorAll('#shopping-cart-table tbody.cart.item');
+return Array.prototype.map.call(rows, function (row, index) {
+    var qty = row.querySelector('input[data-role="cart-item-qty"], input.qty');
+    var match = qty ? /^cart\\[(\\d+)\\]\\[qty\\]$/.exec(qty.name) : null;
+    var name = row.querySelector('.product-item-name');
+    return {
+        index: index,
+        item_id: match ? match[1] : null,
+        name: name ? name.textContent.trim() : '',
+        qty: qty ? Number(qty.value) : 0,
+        options: Array.prototype.map.call(row.querySelectorAll('.item-options dd'), function (dd) {
+            return dd.textContent.trim();
+        })
+    };
+});
+"""
+
+# Submits the cart form once. Items whose id is listed get a quantity of 0, which the
+# cart update removes. The form is submitted directly, bypassing the client-side
+# validation that rejects a quantity of 0.
+SUBMIT_CART_FORM_SCRIPT = """
+var action = arguments[0], removeIds = arguments[1];
+var form = document.getElementById('form-validate');
+if (!form) { return false; }
+removeIds.forEach(function (id) {
+    var qty = form.querySelector('input[name="cart[' + id + '][qty]"]');
+    if (qty) { qty.value = '0'; }
+});
+var input = document.createElement('input');
+input.type = 'hidden';
+input.name = 'update_cart_action';
+input.value = action;
+form.appendChild(input);
+form.submit();
+return true;
+"""
+
+
+class CartPageError(Exception):
+    """Raised when the cart page cannot be read or updated."""
+
+
+class CartIndex:
+    """The line items of the cart page, indexed by position, item id and product name."""
+
+    def __init__(self, items):
+        self.items = items
+        self.by_id = {item.item_id: item for item in items}
+        self.by_name = {}
+        for item in items:
+            self.by_name.setdefault(item.name, []).append(item)
+
+    def __len__(self):
+        return len(self.items)
+
+    def at(self, index):
+        """The line item at a position of the cart table (negative positions count from the end)."""
+        try:
+            return self.items[index]
+        except IndexError:
+            raise CartPageError(f"The cart has no item at index {index}, it has {len(self.items)}.")
+
+    def named(self, name):
+        """Every line item of a product, in cart order (a product may be in the cart with several options)."""
+        if name not in self.by_name:
+            raise CartPageError(f"No item named '{name}' in the cart.")
+        return self.by_name[name]
+
+
+def read_cart(driver):
+    """
+    Read every line item of the cart page in one script execution.
+
+    Returns:
+        CartIndex: The line items of the cart page currently open.
+    """
+    return CartIndex([CartItem(row["index"], row["item_id"], row["name"], row["qty"], tuple(row["options"]))
+                      for row in driver.execute_script(READ_CART_SCRIPT)])
+
+
+def _submit(driver, action, remove_ids=()):
+    if not driver.execute_script(SUBMIT_CART_FORM_SCRIPT, action, list(remove_ids)):
+        raise CartPageError("The cart form is not on the current page.")
+
+
+def remove_items(driver, items, timeout=20):
+    """
+    Remove line items of the open cart page with a single cart update.
+
+    Args:
+        driver (WebDriver): The session, on the cart page.
+        items (list): The CartItems to remove.
+
+    Returns:
+        int: The number of line items removed.
+    """
+    if not items:
+        return 0
+    if any(item.item_id is None for item in items):
+        raise CartPageError("The cart page shows no item id for some of the items to remove.")
+    _submit(driver, "update_qty", [item.item_id for item in items])
+    # The removed rows only disappear once the updated cart page has loaded.
+    WebDriverWait(driver, timeout).until(
+        EC.invisibility_of_element_located((By.NAME, f"cart[{items[0].item_id}][qty]"))
+    )
+    logging.info(f"Removed {len(items)} line item(s) from the cart.")
+    return len(items)
+
+
+def clear_cart(driver, timeout=20):
+    """
+    Empty the cart of the open cart page with a single submit, and confirm it is empty.
+
+    Returns:
+        int: The number of line items removed.
+    """
+    cart = read_cart(driver)
+    if not cart.items:
+        return 0
+    _submit(driver, "empty_cart")
+    WebDriverWait(driver, timeout).until(EC.presence_of_element_located((By.CLASS_NAME, "cart-empty")))
+    return len(cart.items)
@@ -0,0 +1,216 @@
+"""
+Fill carts through Magento's REST API instead of the storefront UI.
+
+Adding a line item through the UI costs a search, a results page, a product page and
+an add-to-cart round trip. Tests that only need a filled cart as a precondition seed
+it here with one HTTP request per line item, and the browser session picks the cart up.
+"""
+import json
+import logging
+import urllib.error
+import urllib.request
+from urllib.parse import quote
+
+import config
+
+
+# SKUs of the Luma sample products used by the suite. The cart takes the SKU of the
+# simple product, which for configurable products is "<sku>-<size>-<color>".
+PRODUCT_SKUS = {
+    "Proteus Fitness Jackshirt": "MJ12",
+    "Overnight Duffle": "24-WB07",
+    "Ina Compression Short": "WSH11",
+    "Beaumont Summit Kit": "MJ01",
+    "Joust Duffle Bag": "24-MB01",
+    "Radiant Tee": "WS12",
+}
+
+# Reloads Magento's cached minicart data so the page reflects a cart changed behind its back.
+HAS_CUSTOMER_DATA_SCRIPT = """
+return !!(window.require && window.require.defined && window.require.defined('Magento_Customer/js/customer-data'));
+"""
+RELOAD_CART_SECTION_SCRIPT = """
+var done = arguments[arguments.length - 1];
+window.require(['Magento_Customer/js/customer-data'], function (customerData) {
+    customerData.reload(['cart'], true).always(function () { done(true); });
+});
+"""
+
+
+class CartSeedingError(Exception):
+    """Raised when a cart cannot be filled through the API."""
+
+
+def item_sku(item_name, size=None, color=None):
+    """
+    Build the SKU of the simple product for a line item.
+
+    Args:
+        item_name (str): The product name, as passed to add_item_to_cart.
+        size (str): The size option, if the product has one.
+        color (str): The color option, if the product has one.
+
+    Returns:
+        str: The SKU to add to the cart.
+
+    Raises:
+        CartSeedingError: If the product's SKU is not known.
+    """
+    if item_name not in PRODUCT_SKUS:
+        raise CartSeedingError(f"No SKU known for product '{item_name}'.")
+    return "-".join(str(part) for part in (PRODUCT_SKUS[item_name], size, color) if part)
+
+
+def rest_call(method, path, payload=None, token=None, timeout=20):
+    """
+    Call the storefront's REST API.
+
+    Args:
+        method (str): The HTTP method.
+        path (str): The path below /rest/V1/, e.g. "guest-carts".
+        payload (dict): The JSON body, if any.
+        token (str): A customer token sent as a Bearer token.
+
+    Returns:
+        The decoded JSON response.
+
+    Raises:
+        CartSeedingError: If the request fails.
+    """
+    headers = {"Content-Type": "application/json", "Accept": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    request = urllib.request.Request(config.url(f"rest/V1/{path}"), data=data, headers=headers, method=method)
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read() or b"null")
+    except urllib.error.HTTPError as e:
+        raise CartSeedingError(f"{method} {path} failed with HTTP {e.code}: {e.read()[:200]!r}")
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        raise CartSeedingError(f"{method} {path} failed: {e}")
+
+
+def customer_token(email, password):
+    """Get a customer API token for an account."""
+    return rest_call("POST", "integration/customer/token", {"username": email, "password": password})
+
+
+def ensure_customer(email, password, name):
+    """
+    Create a customer account unless it can already log in.
+
+    Args:
+        email (str): The account's email.
+        password (str): The account's password.
+        name (str): The display name, "Firstname Lastname".
+
+    Raises:
+        CartSeedingError: If the account can neither log in nor be created.
+    """
+    try:
+        customer_token(email, password)
+        return
+    except CartSeedingError:
+        pass
+    firstname, _, lastname = name.partition(" ")
+    rest_call("POST", "customers", {"customer": {"email": email, "firstname": firstname, "lastname": lastname},
+                                    "password": password})
+    logging.info(f"Created the customer account {email}.")
+
+
+def item_skus(items):
+    """
+    The SKUs of (item_name, quantity, size, color) line items.
+
+    Raises:
+        CartSeedingError: If the SKU of any of the items is not known.
+    """
+    return [item_sku(item_name, *options) for item_name, quantity, *options in items]
+
+
+def add_items(cart_path, cart_id, items, token=None):
+    """
+    Add (item_name, quantity, size, color) line items to a cart.
+
+    Every SKU is resolved before the first request, so an unknown product leaves the
+    cart untouched instead of half filled.
+    """
+    for (item_name, quantity, *options), sku in zip(items, item_skus(items)):
+        rest_call("POST", f"{cart_path}/items", {"cartItem": {"sku": sku, "qty": int(quantity), "quote_id": cart_id}},
+                  token=token)
+        logging.info(f"Seeded {quantity} x {sku} into the cart.")
+
+
+def seed_customer_cart(items, account=None):
+    """
+    Fill the active cart of a customer account.
+
+    Magento loads the customer's active cart into any browser session logged in with
+    that account, so the browser picks the seeded cart up on its next page load.
+
+    Args:
+        items (list): (item_name, quantity, size, color) tuples, size and color being optional.
+        account (tuple): (email, password, name), defaults to the worker's account.
+
+    Returns:
+        The customer's cart id.
+    """
+    email, password, _ = account or config.customer_account()
+    token = customer_token(email, password)
+    cart_id = rest_call("POST", "carts/mine", token=token)
+    add_items("carts/mine", cart_id, items, token)
+    return cart_id
+
+
+def replace_customer_cart(items, account=None):
+    """
+    Make the active cart of a customer account hold exactly the given line items.
+
+    The items already in the cart are removed first, one request per line item.
+
+    Returns:
+        The customer's cart id.
+    """
+    # Unknown products fail before the items already in the cart are removed.
+    item_skus(items)
+    email, password, _ = account or config.customer_account()
+    token = customer_token(email, password)
+    cart_id = rest_call("POST", "carts/mine", token=token)
+    for item in rest_call("GET", "carts/mine/items", token=token):
+        rest_call("DELETE", f"carts/mine/items/{item['item_id']}", token=token)
+    add_items("carts/mine", cart_id, items, token)
+    return cart_id
+
+
+def seed_guest_cart(driver, items):
+    """
+    Fill a new guest cart and attach it to the browser session.
+
+    Magento binds guest carts to the session cookie, which the REST API cannot set, so
+    this only works against the local stand-in storefront.
+
+    Args:
+        driver (WebDriver): The browser session that should own the cart.
+        items (list): (item_name, quantity, size, color) tuples, size and color being optional.
+
+    Returns:
+        The masked id of the guest cart.
+
+    Raises:
+        CartSeedingError: If the storefront is not the local stand-in.
+    """
+    if config.STOREFRONT != "local":
+        raise CartSeedingError("Guest carts can only be seeded into the browser on the local storefront.")
+    cart_id = rest_call("POST", "guest-carts")
+    add_items(f"guest-carts/{cart_id}", cart_id, items)
+    driver.get(config.url(f"stub/guest-cart/adopt?cart_id={quote(cart_id)}&return=/"))
+    return cart_id
+
+
+def refresh_minicart(driver):
+    """Make the current page pick up a cart that was changed through the API."""
+    if driver.execute_script(HAS_CUSTOMER_DATA_SCRIPT):
+        driver.execute_async_script(RELOAD_CART_SECTION_SCRIPT)
+    else:
+        driver.refresh()
@@ -0,0 +1,173 @@
+"""
+Step checkpoints for long checkout flows.
+
+A flow is a list of named steps. After every step that succeeds, a checkpoint of the
+browser is taken: its cookies (which carry the storefront session, and with it the
+server-side cart), Magento's customer section cache in localStorage (the minicart
+and checkout data) and the current URL. When a step fails, the browser is put back
+at the last checkpoint and only that step is retried, up to ORDER_STEP_RETRIES
+times, instead of rerunning the login, the cart filling and the checkout navigation
+from scratch.
+
+Restoring a checkpoint puts the browser back where it was; it cannot undo what a
+failed step already changed on the storefront, so steps that are retried should be
+safe to repeat (navigations, form fills, submits that fail as a whole).
+
+The time saved by resuming, i.e. the time the steps before the checkpoint took, is
+recorded as a "resume" event and logged per flow.
+"""
+import json
+import logging
+import os
+import time
+from collections import namedtuple
+
+import config
+from auth_cache import inject_cookies
+from instrumentation import RECORDER
+
+MAX_STEP_RETRIES = int(os.environ.get("ORDER_STEP_RETRIES", "1"))
+
+# The localStorage keys holding Magento's customer section cache.
+STORAGE_KEYS = ("mage-cache-storage", "mage-cache-storage-section-invalidation", "mage-cache-timeout")
+
+READ_STORAGE_SCRIPT = """
+var keys = arguments[0], storage = {};
+keys.forEach(function (key) {
+    var value = window.localStorage.getItem(key);
+    if (value !== null) { storage[key] = value; }
+});
+return storage;
+"""
+
+# Registered for the next document only: writes the checkpoint's section cache before
+# Magento's scripts read it.
+RESTORE_STORAGE_SCRIPT = """
+(function (origin, storage, keys) {
+    if (window.location.origin !== origin) { return; }
+    keys.forEach(function (key) {
+        if (Object.prototype.hasOwnProperty.call(storage, key)) {
+            window.localStorage.setItem(key, storage[key]);
+        } else {
+            window.localStorage.removeItem(key);
+        }
+    });
+})(%s, %s, %s);
+"""
+
+Checkpoint = namedtuple("Checkpoint", "step url cookies storage elapsed")
+
+
+class StepFailed(AssertionError):
+    """Raised when a step returned False on its last attempt; unittest reports it as a failure."""
+
+
+def take_checkpoint(driver, step, elapsed):
+    """
+    Capture the state of the browser after a step.
+
+    Args:
+        step (str): The step that just succeeded.
+        elapsed (float): Seconds the flow has run so far, i.e. the time resuming here saves.
+
+    Returns:
+        Checkpoint: The cookies, section cache and URL of the browser.
+    """
+    url = driver.current_url
+    storage = driver.execute_script(READ_STORAGE_SCRIPT, list(STORAGE_KEYS)) if url.startswith(config.BASE_URL) else {}
+    return Checkpoint(step, url, driver.get_cookies(), storage, elapsed)
+
+
+def restore_checkpoint(driver, checkpoint):
+    """
+    Put the browser back at a checkpoint: its cookies, its section cache and its page.
+
+    The cookies are replaced through CDP and the section cache is written by a script
+    that runs before the page's own scripts, so restoring costs one page load.
+    """
+    driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+    if checkpoint.cookies:
+        inject_cookies(driver, checkpoint.cookies)
+    script = RESTORE_STORAGE_SCRIPT % (json.dumps(config.BASE_URL), json.dumps(checkpoint.storage),
+                                       json.dumps(list(STORAGE_KEYS)))
+    identifier = driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": script})["identifier"]
+    try:
+        driver.get(checkpoint.url)
+    finally:
+        driver.execute_cdp_cmd("Page.removeScriptToEvaluateOnNewDocument", {"identifier": identifier})
+
+
+class StepFlow:
+    """
+    Runs named steps in order, checkpointing after each and resuming failed steps.
+
+    A step is a callable that fails by raising or by returning False (any other return
+    value, None included, counts as success). Steps are given as (name, callable) pairs,
+    or as (name, callable, retries) to override the retries of a step that is not safe
+    to repeat.
+    """
+
+    def __init__(self, driver, name, retries=MAX_STEP_RETRIES):
+        self.driver = driver
+        self.name = name
+        self.retries = retries
+        self.checkpoint = None
+        self.resumes = 0
+        self.time_saved = 0.0
+
+    def _resume(self, step_name):
+        started = time.perf_counter()
+        if self.checkpoint is None:
+            # Nothing succeeded yet: retry from where the flow started.
+            self.driver.get(config.url())
+            saved = 0.0
+        else:
+            restore_checkpoint(self.driver, self.checkpoint)
+            saved = self.checkpoint.elapsed
+        duration = time.perf_counter() - started
+        self.resumes += 1
+        self.time_saved += max(saved - duration, 0.0)
+        RECORDER.record(f"resume {step_name}", "resume", started, duration, 0, 0.0, flow=self.name,
+                        checkpoint=self.checkpoint.step if self.checkpoint else None, saved=saved)
+        logging.warning(f"{self.name}: retrying step '{step_name}' from checkpoint "
+                        f"'{self.checkpoint.step if self.checkpoint else 'start'}', {saved:.1f}s of steps skipped.")
+
+    def run(self, steps):
+        """
+        Run the steps of the flow.
+
+        Args:
+            steps (list): (name, callable) or (name, callable, retries) tuples, run in order.
+
+        Raises:
+            StepFailed: If a step returned False on its last attempt.
+            Exception: What the failing step raised on its last attempt.
+        """
+        started = time.perf_counter()
+        for step_name, action, *step_retries in steps:
+            retries = step_retries[0] if step_retries else self.retries
+            for attempt in range(retries + 1):
+                if attempt:
+                    self._resume(step_name)
+                last_attempt = attempt == retries
+                try:
+                    if action() is False:
+                        raise StepFailed(f"Step '{step_name}' of {self.name} failed.")
+                    break
+                except StepFailed:
+                    if last_attempt:
+                        logging.error(f"{self.name}: step '{step_name}' failed after {attempt + 1} attempt(s).")
+                        self.report()
+                        raise
+                except Exception as e:
+                    if last_attempt:
+                        self.report()
+                        raise
+                    logging.warning(f"{self.name}: step '{step_name}' raised {type(e).__name__}: {e}")
+            self.checkpoint = take_checkpoint(self.driver, step_name, time.perf_counter() - started)
+        self.report()
+
+    def report(self):
+        if self.resumes:
+            logging.info(f"{self.name}: resumed {self.resumes} time(s) from a checkpoint, "
+                         f"saving {self.time_saved:.1f}s over rerunning the flow.")
@@ -0,0 +1,151 @@
+import os
+
+
+# Storefront the suite runs against. Set ORDER_STOREFRONT=local to start the bundled
+# stand-in storefront (storefront_stub.py) instead of using MAGENTO_BASE_URL.
+STOREFRONT = os.environ.get("ORDER_STOREFRONT", "remote")
+BASE_URL = os.environ.get("MAGENTO_BASE_URL", "https://magento.softwaretestingboard.com").rstrip("/")
+
+# How tests that only need a filled cart get one: "api" seeds it through the REST API
+# (cart_seeding.py), "ui" adds every item through the storefront pages.
+CART_SEEDING = os.environ.get("ORDER_CART_SEEDING", "api")
+
+# Browser profile: "off" for a regular Chrome, "on" for the headless, request-blocking
+# fast profile (fast_profile.py), "measure" to record the full profile's traffic baseline.
+FAST_PROFILE = os.environ.get("ORDER_FAST_PROFILE", "off")
+
+# Order scenario matrix to run on top of the suite, e.g. ORDER_SCENARIOS=order_scenarios.csv
+# (see scenarios.py). Empty runs no scenarios.
+SCENARIOS_FILE = os.environ.get("ORDER_SCENARIOS", "")
+
+# How the scenario matrix runs: "separate" makes every scenario its own test, "shared"
+# runs the steps the scenarios have in common once (scenario_engine.py).
+SCENARIO_PREFIXES = os.environ.get("ORDER_SCENARIO_PREFIXES", "separate")
+
+# How tests are isolated from each other: "session" resets the pooled browser session
+# between tests, "context" gives every test a fresh browser context (own cookies and
+# storage) inside the long-lived browser.
+ISOLATION = os.environ.get("ORDER_ISOLATION", "session")
+
+# Failure forensics (forensics.py): "on" keeps a ring buffer of recent commands, browser
+# events and steps, written out with a screenshot and the DOM when a test fails.
+FORENSICS = os.environ.get("ORDER_FORENSICS", "on")
+# Browser network and console events go into the forensics buffer when the fast profile's
+# network filter runs anyway; "on" starts a filter for them in every session and tab.
+FORENSICS_NETWORK = os.environ.get("ORDER_FORENSICS_NETWORK", "off")
+
+# Browser startup: "on" starts sessions ahead of demand on copies of a pre-warmed
+# profile template (browser_warmup.py), "off" starts every session from scratch.
+WARM_START = os.environ.get("ORDER_WARM_START", "off")
+
+# Storefront traffic: "record" stores every response through a local proxy, "replay"
+# serves the stored responses without the network (replay_proxy.py), "off" talks to
+# the storefront directly.
+REPLAY = os.environ.get("ORDER_REPLAY", "off")
+
+# Page performance (page_performance.py): "on" reads the browser's performance data of
+# every page the suite visits and checks it against page_budgets.json.
+PAGE_PERF = os.environ.get("ORDER_PAGE_PERF", "on")
+
+# Browser resources (browser_resources.py): "on" samples the memory and CPU of every
+# session and recycles the sessions that cross the thresholds.
+RESOURCE_MONITOR = os.environ.get("ORDER_RESOURCE_MONITOR", "on")
+
+# How add_item_to_cart reaches a product: "index" opens its page from the product index
+# (product_index.py) and selects swatches by id, "search" goes through the search box.
+PRODUCT_NAVIGATION = os.environ.get("ORDER_PRODUCT_NAVIGATION", "index")
+
+# Index of the worker process running the suite (0 when running serially).
+WORKER_ID = int(os.environ.get("ORDER_WORKER_ID", "0"))
+
+# Customer accounts available to the suite, as "email:password:Display Name" entries
+# separated by ";". Each parallel worker logs in with its own account so the workers
+# don't share (and overwrite) one customer cart.
+DEFAULT_ACCOUNTS = "test123@yahoo.com:Test123!:Test Testing"
+
+
+def url(path=""):
+    """
+    Build an absolute storefront URL.
+
+    Args:
+        path (str): The path relative to the storefront root, e.g. "checkout/cart/".
+
+    Returns:
+        str: The URL under the current BASE_URL.
+    """
+    return f"{BASE_URL}/{path.lstrip('/')}"
+
+
+def load_accounts(spec=None):
+    """
+    Parse the customer accounts setting.
+
+    Args:
+        spec (str): The accounts setting, defaults to the ORDER_TEST_ACCOUNTS environment variable.
+
+    Returns:
+        list: (email, password, display name) tuples.
+    """
+    spec = spec or os.environ.get("ORDER_TEST_ACCOUNTS", DEFAULT_ACCOUNTS)
+    accounts = []
+    for entry in spec.split(";"):
+        if entry.strip():
+            email, password, name = entry.strip().split(":", 2)
+            accounts.append((email, password, name))
+    return accounts
+
+
+def customer_account(worker_id=WORKER_ID):
+    """
+    Pick the customer account used by a worker.
+
+    Returns:
+        tuple: The (email, password, display name) of the worker's account.
+
+    Raises:
+        RuntimeError: If there are fewer accounts than workers, since workers sharing an
+            account would share its cart.
+    """
+    accounts = load_accounts()
+    if worker_id >= len(accounts):
+        raise RuntimeError(f"Worker {worker_id} has no customer account of its own, add more accounts to "
+                           f"ORDER_TEST_ACCOUNTS or run through parallel_runner.py, which creates them.")
+    return accounts[worker_id]
+
+
+def worker_accounts(workers, spec=None):
+    """
+    Extend the accounts setting to one account per worker.
+
+    The missing accounts are derived from the first one with plus-addressing, like
+    guest_email, and share its password and name.
+
+    Args:
+        workers (int): The number of workers.
+        spec (str): The accounts setting, defaults to the ORDER_TEST_ACCOUNTS environment variable.
+
+    Returns:
+        list: (email, password, display name) tuples, at least one per worker.
+    """
+    accounts = load_accounts(spec)
+    email, password, name = accounts[0]
+    for worker_id in range(len(accounts), workers):
+        accounts.append((guest_email(email, worker_id), password, name))
+    return accounts
+
+
+def guest_email(email, worker_id=WORKER_ID):
+    """
+    Give each worker its own guest checkout address using plus-addressing.
+
+    Args:
+        email (str): The guest email from the order details.
+
+    Returns:
+        str: The email unchanged for worker 0, "name+w<worker>@domain" otherwise.
+    """
+    if worker_id == 0 or "@" not in email:
+        return email
+    name, domain = email.split("@", 1)
+    return f"{name}+w{worker_id}@{domain}"
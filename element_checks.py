@@ -0,0 +1,130 @@
+"""
+Manifest-driven element existence checks.
+
+locator_manifest.json lists, for every page, the locators that are expected on it
+and what is expected of them: "present", "visible", "hidden" (present but not
+displayed) or "absent". Each page is checked with a single browser-side query that
+evaluates all its locators at once, and pages are checked concurrently on sessions
+from the shared pool.
+"""
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from waits import wait_for_magento_idle
+
+
+MANIFEST_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "locator_manifest.json")
+CONCURRENCY = int(os.environ.get("ORDER_MANIFEST_CONCURRENCY", "3"))
+
+EXPECTATIONS = ("present", "visible", "hidden", "absent")
+
+# Evaluates every locator of a page and returns [{count, visible}] in the same order.
+CHECK_LOCATORS_SCRIPT = """
+function find(by, value) {
+    if (by === 'id') { var element = document.getElementById(value); return element ? [element] : []; }
+    if (by === 'name') { return Array.prototype.slice.call(document.getElementsByName(value)); }
+    if (by === 'class name') { return Array.prototype.slice.call(document.getElementsByClassName(value)); }
+    if (by === 'tag name') { return Array.prototype.slice.call(document.getElementsByTagName(value)); }
+    if (by === 'link text') {
+        return Array.prototype.filter.call(document.links, function (a) { return a.textContent.trim() === value; });
+    }
+    if (by === 'xpath') {
+        var snapshot = document.evaluate(value, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        var nodes = [];
+        for (var i = 0; i < snapshot.snapshotLength; i++) { nodes.push(snapshot.snapshotItem(i)); }
+        return nodes;
+    }
+    return Array.prototype.slice.call(document.querySelectorAll(value));
+}
+function isVisible(element) {
+    var style = window.getComputedStyle(element);
+    return style.display !== 'none' && style.visibility !== 'hidden' && element.getClientRects().length > 0;
+}
+return arguments[0].map(function (locator) {
+    try {
+        var elements = find(locator.by, locator.value);
+        return {count: elements.length, visible: elements.some(isVisible)};
+    } catch (e) {
+        return {count: 0, visible: false, error: String(e)};
+    }
+});
+"""
+
+
+def load_manifest(path=MANIFEST_FILE):
+    """
+    Load and validate the locator manifest.
+
+    Returns:
+        dict: {page name: {"path": str, "locators": [{"name", "by", "value", "expect"}]}}.
+    """
+    with open(path, "r") as manifest_file:
+        manifest = json.load(manifest_file)
+    for page, spec in manifest.items():
+        for entry in spec["locators"]:
+            if entry.get("expect", "present") not in EXPECTATIONS:
+                raise ValueError(f"{page} / {entry['name']}: unknown expectation '{entry['expect']}'")
+    return manifest
+
+
+def query_locators(driver, locators):
+    """Evaluate many locators on the current page in one round trip."""
+    return driver.execute_script(CHECK_LOCATORS_SCRIPT, [{"by": entry["by"], "value": entry["value"]}
+                                                         for entry in locators])
+
+
+def evaluate(entry, result):
+    """
+    Check one manifest entry against its query result.
+
+    Returns:
+        tuple: (bool passed, str description of what was found).
+    """
+    expect = entry.get("expect", "present")
+    if result.get("error"):
+        return False, f"locator failed: {result['error']}"
+    found = f"{result['count']} element(s) found, {'visible' if result['visible'] else 'none visible'}"
+    passed = {
+        "present": result["count"] > 0,
+        "visible": result["visible"],
+        "hidden": result["count"] > 0 and not result["visible"],
+        "absent": result["count"] == 0,
+    }[expect]
+    return passed, found
+
+
+def check_page(pool, page, spec):
+    """
+    Open a page on a pooled session and evaluate all of its locators.
+
+    Returns:
+        list: (entry, result) pairs in manifest order.
+    """
+    driver = pool.acquire()
+    failed = False
+    try:
+        driver.get(config.url(spec["path"]))
+        wait_for_magento_idle(driver)
+        return list(zip(spec["locators"], query_locators(driver, spec["locators"])))
+    except Exception as e:
+        failed = True
+        logging.error(f"Failed to check page '{page}': {e}")
+        return [(entry, {"count": 0, "visible": False, "error": str(e)}) for entry in spec["locators"]]
+    finally:
+        pool.release(driver, discard=failed)
+
+
+def check_manifest(pool, manifest=None, concurrency=CONCURRENCY):
+    """
+    Check every page of the manifest, several pages at a time.
+
+    Returns:
+        dict: {page name: [(entry, result)]}.
+    """
+    manifest = manifest or load_manifest()
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(manifest)))) as executor:
+        futures = {page: executor.submit(check_page, pool, page, spec) for page, spec in manifest.items()}
+        return {page: future.result() for page, future in futures.items()}
@@ -0,0 +1,311 @@
+"""
+"Fast profile" for the suite's browsers.
+
+With ORDER_FAST_PROFILE=on, Chrome runs headless with animations disabled, and a
+CDP Fetch interceptor fails the requests the flows don't need (images, media and
+fonts, plus ad and tracking scripts) unless they match the allow-list. The requests
+and bytes each test downloads are recorded. A run with ORDER_FAST_PROFILE=measure
+records the same numbers without blocking anything and stores them as the baseline,
+so fast runs can report the requests and bytes they saved per test.
+"""
+import fnmatch
+import json
+import logging
+import os
+import threading
+from contextlib import asynccontextmanager
+
+import config
+import forensics
+
+
+BLOCKED_RESOURCE_TYPES = ["Image", "Media", "Font"]
+
+BLOCKED_URL_PATTERNS = [
+    "*google-analytics.com/*",
+    "*googletagmanager.com/*",
+    "*doubleclick.net/*",
+    "*googlesyndication.com/*",
+    "*googleadservices.com/*",
+    "*adservice.google.*",
+    "*connect.facebook.net/*",
+    "*hotjar.com/*",
+    "*clarity.ms/*",
+    "*cdn.mxpnl.com/*",
+    "*.ads.*",
+]
+
+# Requests that are let through even though they match a blocked type or pattern.
+ALLOWED_URL_PATTERNS = [
+    "*/static/*/Magento_Checkout/*",
+    "*/static/*/Magento_Ui/*",
+    "*/static/*/requirejs/*",
+] + [pattern for pattern in os.environ.get("ORDER_FAST_PROFILE_ALLOW", "").split(",") if pattern]
+
+# Registered for every new document: turns off CSS transitions/animations and jQuery effects.
+DISABLE_ANIMATIONS_SCRIPT = """
+(function () {
+    var css = '*, *::before, *::after { transition: none !important; animation: none !important; '
+            + 'scroll-behavior: auto !important; caret-color: transparent !important; }';
+    function addStyle() {
+        var style = document.createElement('style');
+        style.textContent = css;
+        (document.head || document.documentElement).appendChild(style);
+    }
+    if (document.documentElement) { addStyle(); } else { document.addEventListener('DOMContentLoaded', addStyle); }
+    window.addEventListener('load', function () {
+        if (window.jQuery) { window.jQuery.fx.off = true; }
+        if (window.require) { window.require(['jquery'], function ($) { $.fx.off = true; }); }
+    });
+})();
+"""
+
+# The baseline is recorded by a serial measure run; each worker of a fast run writes its own report.
+BASELINE_FILE = "fast_profile_baseline.json"
+REPORT_FILE = f"fast_profile_report.worker{config.WORKER_ID}.json"
+
+
+def add_fast_options(options):
+    """Add the fast profile's command line switches to a ChromeOptions."""
+    options.add_argument("--headless=new")
+    options.add_argument("--window-size=1366,900")
+    options.add_argument("--disable-extensions")
+    options.add_argument("--disable-background-networking")
+    options.add_argument("--disable-component-update")
+    options.add_argument("--disable-default-apps")
+    options.add_argument("--disable-features=Translate,OptimizationHints,MediaRouter")
+    options.add_argument("--force-prefers-reduced-motion")
+    options.add_argument("--mute-audio")
+    return options
+
+
+def is_allowed(url):
+    return any(fnmatch.fnmatch(url, pattern) for pattern in ALLOWED_URL_PATTERNS)
+
+
+class NetworkFilter:
+    """
+    Intercepts and counts the browser's network traffic over a CDP connection.
+
+    The CDP connection is served by trio in a background thread. Only requests of a
+    blocked resource type or URL pattern are paused by the browser, so the storefront's
+    documents, scripts and API calls never wait on the interceptor.
+
+    The filter watches the session's first tab, or the tab of target_id (e.g. the tab of
+    a browser context opened by session_pool.open_context()).
+    """
+
+    def __init__(self, driver, block=True, on_event=None, target_id=None):
+        self.driver = driver
+        self.target_id = target_id
+        self.block = block
+        self.on_event = on_event
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = None
+        self._token = None
+        self._scope = None
+        self.take_stats()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._serve, name="network-filter", daemon=True)
+        self._thread.start()
+        if not self._ready.wait(10):
+            logging.warning("Network filter did not start in time, requests are not filtered.")
+        return self
+
+    def stop(self):
+        import trio
+
+        if self._token is not None and self._scope is not None:
+            try:
+                trio.from_thread.run_sync(self._scope.cancel, trio_token=self._token)
+            except (RuntimeError, trio.RunFinishedError):
+                pass
+        if self._thread is not None:
+            self._thread.join(5)
+
+    def take_stats(self):
+        """
+        Return the traffic counted since the last call and start counting again.
+
+        Returns:
+            dict: requests, bytes, blocked_requests and blocked_by_type.
+        """
+        with self._lock:
+            stats = getattr(self, "_stats", None)
+            self._stats = {"requests": 0, "bytes": 0, "blocked_requests": 0, "blocked_by_type": {}}
+        return stats
+
+    def _serve(self):
+        import trio
+
+        try:
+            trio.run(self._run)
+        except Exception as e:
+            logging.debug(f"Network filter stopped: {e}")
+        finally:
+            self._ready.set()
+
+    async def _run(self):
+        import trio
+
+        self._token = trio.lowlevel.current_trio_token()
+        with trio.CancelScope() as scope:
+            self._scope = scope
+            async with self._connect() as (session, devtools):
+                await session.execute(devtools.network.enable())
+                if self.on_event is not None:
+                    await session.execute(devtools.runtime.enable())
+                if self.block:
+                    patterns = [devtools.fetch.RequestPattern(url_pattern="*", resource_type=devtools.network.ResourceType(kind))
+                                for kind in BLOCKED_RESOURCE_TYPES]
+                    patterns += [devtools.fetch.RequestPattern(url_pattern=pattern) for pattern in BLOCKED_URL_PATTERNS]
+                    await session.execute(devtools.fetch.enable(patterns=patterns))
+                self._ready.set()
+                async with trio.open_nursery() as nursery:
+                    nursery.start_soon(self._count, session, devtools)
+                    if self.on_event is not None:
+                        nursery.start_soon(self._observe, session, devtools)
+                    if self.block:
+                        nursery.start_soon(self._intercept, session, devtools)
+
+    @asynccontextmanager
+    async def _connect(self):
+        if self.target_id is None:
+            async with self.driver.bidi_connection() as connection:
+                yield connection.session, connection.devtools
+            return
+        from selenium.webdriver.common.bidi import cdp
+        from async_flows import cdp_endpoint
+
+        ws_url, version = cdp_endpoint(self.driver)
+        devtools = cdp.import_devtools(version)
+        async with cdp.open_cdp(ws_url) as connection:
+            async with connection.open_session(self.target_id) as session:
+                yield session, devtools
+
+    async def _count(self, session, devtools):
+        async for event in session.listen(devtools.network.RequestWillBeSent, devtools.network.LoadingFinished,
+                                          buffer_size=1000):
+            with self._lock:
+                if isinstance(event, devtools.network.RequestWillBeSent):
+                    self._stats["requests"] += 1
+                else:
+                    self._stats["bytes"] += int(event.encoded_data_length)
+            if self.on_event is not None and isinstance(event, devtools.network.RequestWillBeSent):
+                self.on_event(event)
+
+    async def _observe(self, session, devtools):
+        async for event in session.listen(devtools.network.ResponseReceived, devtools.network.LoadingFailed,
+                                          devtools.runtime.ConsoleAPICalled, devtools.runtime.ExceptionThrown,
+                                          buffer_size=1000):
+            self.on_event(event)
+
+    async def _intercept(self, session, devtools):
+        async for event in session.listen(devtools.fetch.RequestPaused, buffer_size=1000):
+            if is_allowed(event.request.url):
+                await session.execute(devtools.fetch.continue_request(event.request_id))
+                continue
+            await session.execute(devtools.fetch.fail_request(event.request_id, devtools.network.ErrorReason.BLOCKED_BY_CLIENT))
+            kind = event.resource_type.value
+            with self._lock:
+                self._stats["blocked_requests"] += 1
+                self._stats["blocked_by_type"][kind] = self._stats["blocked_by_type"].get(kind, 0) + 1
+
+
+def prepare_driver(driver):
+    """
+    Apply the fast profile to a freshly started browser session.
+
+    The network filter also feeds the browser's network and console events to the
+    failure forensics buffer; with ORDER_FORENSICS_NETWORK=on it runs for them alone,
+    without blocking anything, when the fast profile is off.
+
+    Returns:
+        WebDriver: The same session, with a network_filter attribute when counting is on.
+    """
+    prepare_tab(driver)
+    driver.network_filter = _start_filter(driver)
+    return driver
+
+
+def _start_filter(driver, target_id=None):
+    filtering = config.FAST_PROFILE in ("on", "measure")
+    on_event = forensics.record_browser_event if config.FORENSICS == "on" else None
+    if on_event is not None and not filtering and config.FORENSICS_NETWORK != "on":
+        on_event = None
+    if filtering or on_event is not None:
+        return NetworkFilter(driver, block=config.FAST_PROFILE == "on", on_event=on_event, target_id=target_id).start()
+    return None
+
+
+def prepare_tab(driver, target_id=None):
+    """
+    Apply the per-tab part of the fast profile to the session's current tab.
+
+    Args:
+        target_id (str): The DevTools target of a tab opened after the session started.
+            It gets its own network filter (driver.tab_filter), as the session's filter
+            only sees the first tab.
+    """
+    if config.FAST_PROFILE == "on":
+        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": DISABLE_ANIMATIONS_SCRIPT})
+    if target_id is not None:
+        driver.tab_filter = _start_filter(driver, target_id)
+
+
+def release_tab(driver):
+    """Stop the network filter of a tab set up by prepare_tab(), before the tab is closed."""
+    tab_filter = getattr(driver, "tab_filter", None)
+    driver.tab_filter = None
+    if tab_filter is not None:
+        tab_filter.stop()
+
+
+def _load_json(path):
+    try:
+        with open(path, "r") as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_json(path, data):
+    try:
+        with open(path, "w") as json_file:
+            json.dump(data, json_file, indent=2, sort_keys=True)
+    except OSError as e:
+        logging.warning(f"Failed to write {path}: {e}")
+
+
+def report_test(test_id, driver):
+    """
+    Record the traffic of a finished test.
+
+    In measure mode the numbers become the test's baseline. In fast mode they are
+    compared with the baseline, logged and written to the run's report file.
+    """
+    network_filter = getattr(driver, "tab_filter", None) or getattr(driver, "network_filter", None)
+    if network_filter is None or config.FAST_PROFILE == "off":
+        return None
+    stats = network_filter.take_stats()
+    if config.FAST_PROFILE == "measure":
+        baseline = _load_json(BASELINE_FILE)
+        baseline[test_id] = stats
+        _save_json(BASELINE_FILE, baseline)
+        return stats
+
+    full = _load_json(BASELINE_FILE).get(test_id)
+    if full:
+        stats["requests_saved"] = full["requests"] - stats["requests"]
+        stats["bytes_saved"] = full["bytes"] - stats["bytes"]
+        saved = f", saved {stats['requests_saved']} requests / {stats['bytes_saved'] / 1024:.0f} KB vs the full profile"
+    else:
+        saved = " (no full-profile baseline, run once with ORDER_FAST_PROFILE=measure)"
+    logging.info(f"{test_id}: {stats['requests']} requests, {stats['bytes'] / 1024:.0f} KB downloaded, "
+                 f"{stats['blocked_requests']} blocked{saved}")
+    report = _load_json(REPORT_FILE)
+    report[test_id] = stats
+    _save_json(REPORT_FILE, report)
+    return stats
@@ -0,0 +1,212 @@
+"""
+Failure forensics.
+
+While the suite runs, a bounded in-memory ring buffer keeps the most recent WebDriver
+commands, browser network and console events, step and wait timings and warnings
+logged by the helpers. Recording an entry is a deque append, nothing touches the disk
+or the browser. Only when a test fails are its entries written out, together with a
+screenshot and the DOM of the page, under forensics/<time>-<test id>/.
+
+ORDER_FORENSICS=off turns the capture off. ORDER_FORENSICS_EVENTS and
+ORDER_FORENSICS_MAX_KB bound the buffer by number of entries and by size. Network and
+console events are taken from the fast profile's network filter when it runs
+(ORDER_FAST_PROFILE=on|measure); ORDER_FORENSICS_NETWORK=on starts a filter for them
+otherwise.
+"""
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+
+import config
+from instrumentation import RECORDER
+
+
+FORENSICS_DIR = os.environ.get("ORDER_FORENSICS_DIR", "forensics")
+MAX_EVENTS = int(os.environ.get("ORDER_FORENSICS_EVENTS", "2000"))
+MAX_BYTES = int(os.environ.get("ORDER_FORENSICS_MAX_KB", "1024")) * 1024
+
+# Longer values (URLs, scripts, page text) are clipped before they are buffered.
+MAX_VALUE_CHARS = 300
+
+# Parameters of these commands are typed text, only their length is kept.
+MASKED_COMMANDS = {"sendKeysToElement", "sendKeysToActiveElement"}
+
+
+def _clip(value):
+    if isinstance(value, str):
+        return value if len(value) <= MAX_VALUE_CHARS else value[:MAX_VALUE_CHARS] + "..."
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    return _clip(json.dumps(value, default=str))
+
+
+class FlightRecorder:
+    """A ring buffer of recent entries, bounded by count and by (approximate) size."""
+
+    def __init__(self, max_events=MAX_EVENTS, max_bytes=MAX_BYTES):
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.dropped = 0
+        self._entries = deque()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, kind, **fields):
+        entry = {"time": time.time(), "kind": kind, "test": RECORDER.current_test()}
+        entry.update((key, _clip(value)) for key, value in fields.items())
+        size = 64 + sum(len(value) if isinstance(value, str) else 8 for value in entry.values())
+        with self._lock:
+            self._entries.append((entry, size))
+            self._bytes += size
+            while len(self._entries) > self.max_events or self._bytes > self.max_bytes:
+                _, dropped_size = self._entries.popleft()
+                self._bytes -= dropped_size
+                self.dropped += 1
+
+    def snapshot(self, test_id=None):
+        """The buffered entries, oldest first, optionally only those of one test."""
+        with self._lock:
+            entries = [entry for entry, _ in self._entries]
+        return [entry for entry in entries if test_id is None or entry["test"] == test_id]
+
+    def size(self):
+        with self._lock:
+            return len(self._entries), self._bytes
+
+
+FORENSICS = FlightRecorder()
+
+
+class BufferLogFilter(logging.Filter):
+    """
+    Copies the warnings and errors the helpers log into the ring buffer.
+
+    It is installed as a filter of the root logger rather than as a handler, so it
+    doesn't change where log records are printed. It never drops a record.
+    """
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            FORENSICS.add("log", level=record.levelname, message=record.getMessage())
+        return True
+
+
+def record_step(event):
+    """Recorder listener buffering the timed steps and waits."""
+    if event["kind"] in ("step", "wait"):
+        FORENSICS.add(event["kind"], name=event["name"], duration=round(event["duration"], 4),
+                      commands=event["commands"])
+
+
+def record_browser_event(event):
+    """Buffer a CDP network or console event, called from the network filter's thread."""
+    name = type(event).__name__
+    if name == "RequestWillBeSent":
+        FORENSICS.add("network", event=name, method=event.request.method, url=event.request.url)
+    elif name == "ResponseReceived":
+        FORENSICS.add("network", event=name, status=event.response.status, url=event.response.url)
+    elif name == "LoadingFailed":
+        FORENSICS.add("network", event=name, error=event.error_text, blocked=event.blocked_reason is not None)
+    elif name == "ConsoleAPICalled":
+        FORENSICS.add("console", level=event.type_, message=" ".join(
+            str(arg.value if arg.value is not None else arg.description) for arg in event.args))
+    elif name == "ExceptionThrown":
+        details = event.exception_details
+        FORENSICS.add("console", level="exception", message=(
+            details.exception.description if details.exception else details.text))
+
+
+def attach(driver):
+    """Buffer every WebDriver command the session sends, with its duration and error."""
+    if config.FORENSICS != "on" or getattr(driver, "_forensics", False):
+        return driver
+    execute = driver.execute
+
+    @functools.wraps(execute)
+    def recorded_execute(command, params=None):
+        started = time.perf_counter()
+        error = None
+        try:
+            return execute(command, params)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            if command in MASKED_COMMANDS:
+                params = {"text_length": len((params or {}).get("text", ""))}
+            FORENSICS.add("command", command=command, params=params or {},
+                          duration=round(time.perf_counter() - started, 4), error=error)
+
+    driver.execute = recorded_execute
+    driver._forensics = True
+    return driver
+
+
+def has_failed(test):
+    """
+    Tell, from tearDown, whether the running test (or one of its subtests) has failed so far.
+    """
+    outcome = getattr(test, "_outcome", None)
+    if outcome is None:
+        return False
+    if not getattr(outcome, "success", True):
+        return True
+    # Before Python 3.11 the errors stay on the outcome until the test ends, (test, None) marking a passed subtest.
+    if any(exc_info is not None for _, exc_info in getattr(outcome, "errors", [])):
+        return True
+    # From Python 3.11 they go to the result as they happen.
+    result = getattr(outcome, "result", None)
+    if result is None:
+        return False
+    for failed, _ in result.errors + result.failures:
+        if failed is test or getattr(failed, "test_case", None) is test:
+            return True
+    return False
+
+
+def dump(driver, test_id, directory=FORENSICS_DIR):
+    """
+    Write the buffered entries of a test, a screenshot and the DOM of the current page.
+
+    Returns:
+        str: The directory the files were written to, or None if capture is off.
+    """
+    if config.FORENSICS != "on":
+        return None
+    entries = FORENSICS.snapshot(test_id)
+    path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{re.sub(r'[^A-Za-z0-9_.-]+', '_', test_id)}")
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError as e:
+        logging.warning(f"Failed to write forensics for {test_id}: {e}")
+        return None
+
+    page = {}
+    try:
+        page["url"] = driver.current_url
+        page["title"] = driver.title
+        with open(os.path.join(path, "dom.html"), "w", encoding="utf-8") as dom_file:
+            dom_file.write(driver.page_source)
+        driver.save_screenshot(os.path.join(path, "screenshot.png"))
+    except Exception as e:
+        page["error"] = f"Could not capture the page: {e}"
+
+    try:
+        with open(os.path.join(path, "events.json"), "w") as events_file:
+            json.dump({"test": test_id, "page": page, "dropped_entries": FORENSICS.dropped, "entries": entries},
+                      events_file, indent=1)
+    except OSError as e:
+        logging.warning(f"Failed to write forensics for {test_id}: {e}")
+        return None
+    logging.error(f"{test_id} failed, forensics written to {path}")
+    return path
+
+
+if config.FORENSICS == "on":
+    RECORDER.listeners.append(record_step)
+    logging.getLogger().addFilter(BufferLogFilter())
@@ -0,0 +1,117 @@
+"""
+Fill and read back whole forms in a single WebDriver round trip.
+
+Filling a field through WebDriver costs a find_element, a clear and a keystroke-by-
+keystroke send_keys, each a separate HTTP call to chromedriver. bulk_fill sets every
+field of a form in one script execution instead, firing the input/change/keyup events
+Knockout listens to, and reports per field whether it worked.
+"""
+from selenium.webdriver.common.by import By
+
+
+# The locator strategies the scripts resolve, with locate().
+SUPPORTED_LOCATORS = (By.ID, By.NAME, By.XPATH, By.CSS_SELECTOR, By.CLASS_NAME)
+
+LOCATE_SCRIPT = """
+function locate(by, value) {
+    if (by === 'id') { return document.getElementById(value); }
+    if (by === 'name') { return document.querySelector('[name="' + value.replace(/"/g, '\\\\"') + '"]'); }
+    if (by === 'xpath') {
+        return document.evaluate(value, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    }
+    return document.querySelector(by === 'class name' ? '.' + value : value);
+}
+"""
+
+BULK_FILL_SCRIPT = LOCATE_SCRIPT + """
+var fields = arguments[0];
+function fire(element, type) { element.dispatchEvent(new Event(type, {bubbles: true})); }
+var results = {};
+fields.forEach(function (field) {
+    var element = locate(field.by, field.locator);
+    if (!element) { results[field.key] = {ok: false, error: 'element not found'}; return; }
+    if (element.disabled || element.readOnly) { results[field.key] = {ok: false, error: 'element is not editable'}; return; }
+    if (element.tagName === 'SELECT') {
+        var option = Array.prototype.find.call(element.options, function (o) { return o.value === field.value; });
+        if (!option) { results[field.key] = {ok: false, error: 'option ' + field.value + ' not available'}; return; }
+        element.value = field.value;
+        fire(element, 'change');
+    } else {
+        // Use the prototype's setter so frameworks that wrap the value property see the change.
+        var prototype = element.tagName === 'TEXTAREA' ? HTMLTextAreaElement.prototype : HTMLInputElement.prototype;
+        Object.getOwnPropertyDescriptor(prototype, 'value').set.call(element, field.value);
+        fire(element, 'input');
+        fire(element, 'keyup');
+        fire(element, 'change');
+    }
+    results[field.key] = {ok: element.value === field.value, value: element.value};
+});
+return results;
+"""
+
+READ_VALUES_SCRIPT = LOCATE_SCRIPT + """
+var fields = arguments[0];
+var values = {};
+fields.forEach(function (field) {
+    var element = locate(field.by, field.locator);
+    values[field.key] = element ? element.value : null;
+});
+return values;
+"""
+
+
+def _check_locators(fields, purpose):
+    for locator, _ in fields.values():
+        if locator[0] not in SUPPORTED_LOCATORS:
+            raise ValueError(f"Unsupported locator strategy for {purpose}: {locator[0]}")
+
+
+def _field_specs(fields):
+    """Turn {key: ((by, locator), value)} into the argument list of the scripts."""
+    return [{"key": key, "by": locator[0], "locator": locator[1], "value": str(value)}
+            for key, (locator, value) in fields.items()]
+
+
+def bulk_fill(driver, fields):
+    """
+    Set many form fields, text inputs and selects alike, in one script execution.
+
+    Fields are set in order, so a country select placed before its region select
+    gets the region options loaded before the region is chosen.
+
+    Args:
+        driver (WebDriver): The browser session.
+        fields (dict): {key: ((By strategy, locator value), value)}.
+
+    Returns:
+        dict: {key: {"ok": bool, "value": str} or {"ok": False, "error": str}}.
+    """
+    _check_locators(fields, "bulk fill")
+    return driver.execute_script(BULK_FILL_SCRIPT, _field_specs(fields))
+
+
+def read_values(driver, fields):
+    """
+    Read the current value of many fields in one script execution.
+
+    Args:
+        fields (dict): {key: ((By strategy, locator value), expected value)}, located
+            like bulk_fill locates them.
+
+    Returns:
+        dict: {key: value, or None if the field is missing}.
+    """
+    _check_locators(fields, "reading values")
+    return driver.execute_script(READ_VALUES_SCRIPT, _field_specs(fields))
+
+
+def verify_values(driver, fields):
+    """
+    Check that the fields hold the expected values, in one round trip.
+
+    Returns:
+        dict: {key: (expected, actual)} for every field whose value differs.
+    """
+    values = read_values(driver, fields)
+    return {key: (str(expected), values.get(key)) for key, (_, expected) in fields.items()
+            if values.get(key) != str(expected)}
@@ -0,0 +1,242 @@
+"""
+Hot-path timing for the order-process helpers.
+
+Every helper decorated with @timed_step, every `with step(...)` block and every
+WebDriverWait records its wall time, the number of WebDriver commands it sent and
+the time it spent waiting, attributed to the test that was running. At the end of
+the run the events are exported as JSON and as a Chrome trace (open it in
+chrome://tracing or https://ui.perfetto.dev).
+"""
+import atexit
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from selenium.webdriver.support.ui import WebDriverWait as SeleniumWebDriverWait
+
+import config
+
+
+TIMINGS_DIR = os.environ.get("ORDER_TIMINGS_DIR", "timings")
+
+
+class Recorder:
+    """
+    Collects timed events. Command and wait-time counters are kept per thread.
+
+    Listeners are called with every event as it is recorded.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.listeners = []
+        self.started = time.time()
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.test_id = None
+
+    def _state(self):
+        state = self._local
+        if not hasattr(state, "commands"):
+            state.commands = 0
+            state.wait_time = 0.0
+            state.test_id = None
+            state.depth = 0
+        return state
+
+    def current_test(self):
+        return self._state().test_id or self.test_id
+
+    def count_command(self):
+        self._state().commands += 1
+
+    def add_wait_time(self, seconds):
+        self._state().wait_time += seconds
+
+    def counters(self):
+        state = self._state()
+        return state.commands, state.wait_time
+
+    def record(self, name, kind, started, duration, commands, wait_time, **args):
+        event = {
+            "name": name,
+            "kind": kind,
+            "test": self.current_test(),
+            "start": started - self.origin,
+            "duration": duration,
+            "commands": commands,
+            "wait_time": wait_time,
+            "thread": threading.get_ident(),
+            **args,
+        }
+        with self._lock:
+            self.events.append(event)
+        for listener in self.listeners:
+            listener(event)
+        return event
+
+    def export(self, directory=TIMINGS_DIR):
+        """
+        Write the events of the run as <run>.json and <run>.trace.json (Chrome trace format).
+
+        Returns:
+            tuple: The paths of the two files, or None if nothing was recorded.
+        """
+        with self._lock:
+            events = list(self.events)
+        if not events:
+            return None
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+        base = os.path.join(directory, f"run-{stamp}-worker{config.WORKER_ID}")
+        trace = {"traceEvents": [
+            {
+                "name": event["name"],
+                "cat": event["kind"],
+                "ph": "X",
+                "ts": round(event["start"] * 1e6),
+                "dur": round(event["duration"] * 1e6),
+                "pid": config.WORKER_ID,
+                "tid": event["thread"],
+                "args": {key: value for key, value in event.items() if key not in ("name", "kind", "start", "duration", "thread")},
+            }
+            for event in events
+        ], "displayTimeUnit": "ms"}
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with open(f"{base}.json", "w") as json_file:
+                json.dump({"started": self.started, "worker": config.WORKER_ID, "events": events}, json_file, indent=1)
+            with open(f"{base}.trace.json", "w") as trace_file:
+                json.dump(trace, trace_file)
+        except OSError as e:
+            logging.warning(f"Failed to export timings: {e}")
+            return None
+        logging.info(f"Timings written to {base}.json and {base}.trace.json")
+        return f"{base}.json", f"{base}.trace.json"
+
+
+RECORDER = Recorder()
+atexit.register(RECORDER.export)
+
+
+@contextmanager
+def measure(name, kind="step", recorder=RECORDER, **args):
+    """
+    Time a block and record it as an event of the given kind.
+
+    Steps and waits carry their depth: the number of steps and waits they run in, 0 for
+    the top-level steps of a test. A block that raised is recorded with failed=True; the
+    block gets the event's arguments, to add its own.
+    """
+    commands, wait_time = recorder.counters()
+    state = recorder._state()
+    if kind != "test":
+        args["depth"] = state.depth
+        state.depth += 1
+    started = time.perf_counter()
+    try:
+        yield args
+    except BaseException:
+        args["failed"] = True
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        if kind != "test":
+            state.depth -= 1
+        end_commands, end_wait_time = recorder.counters()
+        recorder.record(name, kind, started, duration, end_commands - commands, end_wait_time - wait_time, **args)
+
+
+def step(name, **args):
+    """Time a named step of a flow, e.g. `with step("submit_shipping_method"):`."""
+    return measure(name, "step", **args)
+
+
+def timed_step(func):
+    """Decorator recording every call of a helper as a step named after it; returning False fails the step."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with measure(func.__name__, "step") as event:
+            result = func(*args, **kwargs)
+            if result is False:
+                event["failed"] = True
+            return result
+    return wrapper
+
+
+@contextmanager
+def timed_wait(name):
+    """Time a wait; its duration counts as wait time of the enclosing steps."""
+    with measure(name, "wait"):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            RECORDER.add_wait_time(time.perf_counter() - started)
+
+
+@contextmanager
+def test_span(test_id):
+    """Attribute everything recorded in the block to a test, and record the test itself."""
+    state = RECORDER._state()
+    previous, state.test_id = state.test_id, test_id
+    if threading.current_thread() is threading.main_thread():
+        RECORDER.test_id = test_id
+    try:
+        with measure(test_id, "test"):
+            yield
+    finally:
+        state.test_id = previous
+
+
+def start_test(test_id):
+    """Start attributing events to a test (called from setUp); returns the span to close in tearDown."""
+    span = test_span(test_id)
+    span.__enter__()
+    return span
+
+
+def instrument_driver(driver):
+    """Count every WebDriver command a session sends."""
+    if getattr(driver, "_instrumented", False):
+        return driver
+    execute = driver.execute
+
+    @functools.wraps(execute)
+    def counted_execute(*args, **kwargs):
+        RECORDER.count_command()
+        return execute(*args, **kwargs)
+
+    driver.execute = counted_execute
+    driver._instrumented = True
+    return driver
+
+
+def describe_condition(method):
+    """Readable name of an expected condition, e.g. "element_to_be_clickable(By.ID, 'send2')"."""
+    name = getattr(method, "__qualname__", type(method).__name__).split(".<locals>")[0]
+    closure = getattr(method, "__closure__", None) or ()
+    for cell in closure:
+        try:
+            value = cell.cell_contents
+        except ValueError:
+            continue
+        if isinstance(value, tuple) and len(value) == 2:
+            return f"{name}{value}"
+    return name
+
+
+class WebDriverWait(SeleniumWebDriverWait):
+    """Selenium's WebDriverWait, recording the time spent in until()/until_not()."""
+
+    def until(self, method, message=""):
+        with timed_wait(f"wait: {describe_condition(method)}"):
+            return super().until(method, message)
+
+    def until_not(self, method, message=""):
+        with timed_wait(f"wait not: {describe_condition(method)}"):
+            return super().until_not(method, message)
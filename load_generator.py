@@ -0,0 +1,338 @@
+"""
+Browserless load generator for the guest checkout.
+
+The flow of test_buy_item_no_login is replayed as plain HTTP requests, without a
+browser, by thousands of concurrent virtual customers on one asyncio event loop:
+
+- search: the search results page of every product of the order
+- create cart: a guest cart (POST guest-carts)
+- add to cart: every line item, size and color options included in the simple product's SKU
+- shipping information: the customer's address and the flat rate shipping method
+- apply discount code: when the customer has one (apply_discount_code's default is 20poff)
+- payment: the check / money order payment method and the customer's email
+- place order
+
+Customers are read from an order_details.csv style file (one address, every virtual
+customer gets its own email derived from it) or from the guest rows of an
+order_scenarios.csv style file (--scenarios), which also set their items and
+discount code. Requests share a bounded pool of keep-alive connections.
+
+The report gives the number of placed orders per second and the p50/p95/p99 latency
+of every step. By default it runs against the local stand-in storefront.
+
+Usage:
+    python load_generator.py --customers 2000 --concurrency 500
+    python load_generator.py --remote --customers 50 --concurrency 10
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import ssl
+import sys
+import time
+from collections import namedtuple
+from urllib.parse import quote, urlencode, urlsplit
+
+import config
+from cart_seeding import item_sku
+from scenarios import ORDER_DETAILS_FILE, iter_scenarios, load_order_details
+from stats import percentile
+
+# The order of test_buy_item_no_login, with the discount code of apply_discount_code.
+DEFAULT_ITEMS = [("Proteus Fitness Jackshirt", 3, "XL", "Orange"), ("Overnight Duffle", 3, None, None)]
+DEFAULT_DISCOUNT_CODE = "20poff"
+
+STEPS = ["search", "create cart", "add to cart", "shipping information", "apply discount code", "payment",
+         "place order"]
+
+Customer = namedtuple("Customer", "email address items discount_code")
+Response = namedtuple("Response", "status headers body elapsed")
+
+
+class LoadError(Exception):
+    """Raised when a request of a virtual customer fails."""
+
+
+class ConnectionPool:
+    """
+    A bounded pool of keep-alive HTTP/1.1 connections to the storefront, on asyncio streams.
+
+    At most `size` requests are in flight; a connection the server closed is reopened once.
+    """
+
+    def __init__(self, base_url, size=100, timeout=60):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.secure = parts.scheme == "https"
+        self.port = parts.port or (443 if self.secure else 80)
+        self.prefix = parts.path.rstrip("/")
+        self.netloc = parts.netloc
+        self.timeout = timeout
+        self.opened = 0
+        self._ssl = ssl.create_default_context() if self.secure else None
+        self._idle = []
+        self._slots = asyncio.Semaphore(size)
+
+    async def _open(self):
+        self.opened += 1
+        return await asyncio.open_connection(self.host, self.port, ssl=self._ssl)
+
+    async def _exchange(self, connection, method, path, body, headers):
+        reader, writer = connection
+        lines = [f"{method} {self.prefix}{path} HTTP/1.1", f"Host: {self.netloc}", "Connection: keep-alive",
+                 "Accept-Encoding: identity", f"Content-Length: {len(body)}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("The storefront closed the connection.")
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+
+        keep_alive = response_headers.get("connection", "").lower() != "close"
+        if response_headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            data = b"".join(chunks)
+        elif "content-length" in response_headers:
+            data = await reader.readexactly(int(response_headers["content-length"]))
+        elif method == "HEAD" or status in (204, 304):
+            data = b""
+        else:
+            data = await reader.read()
+            keep_alive = False
+        return Response(status, response_headers, data, None), keep_alive
+
+    async def request(self, method, path, body=b"", headers=None):
+        """
+        Send a request and read the whole response.
+
+        Returns:
+            Response: The status, the headers (lower-case names), the body and the seconds the
+            request took once it had a connection (time queued for a free slot left out).
+        """
+        async with self._slots:
+            started = time.perf_counter()
+            for attempt in range(2):
+                reused = bool(self._idle)
+                connection = self._idle.pop() if reused else await self._open()
+                try:
+                    response, keep_alive = await asyncio.wait_for(
+                        self._exchange(connection, method, path, body, headers or {}), self.timeout)
+                except (ConnectionResetError, BrokenPipeError, asyncio.IncompleteReadError):
+                    connection[1].close()
+                    if reused and attempt == 0:
+                        continue
+                    raise
+                except BaseException:
+                    connection[1].close()
+                    raise
+                if keep_alive:
+                    self._idle.append(connection)
+                else:
+                    connection[1].close()
+                return response._replace(elapsed=time.perf_counter() - started)
+
+    def close(self):
+        idle, self._idle = self._idle, []
+        for _, writer in idle:
+            writer.close()
+
+
+class LoadStats:
+    """Latencies and errors per step, and the placed orders."""
+
+    def __init__(self):
+        self.latencies = {step: [] for step in STEPS}
+        self.errors = {step: 0 for step in STEPS}
+        self.orders = 0
+        self.failed_customers = 0
+        self.first_errors = []
+
+    def add(self, step, seconds):
+        self.latencies.setdefault(step, []).append(seconds)
+
+    def fail(self, step, error):
+        self.errors[step] = self.errors.get(step, 0) + 1
+        self.failed_customers += 1
+        if len(self.first_errors) < 5:
+            self.first_errors.append(f"{step}: {error}")
+
+    def report(self, elapsed, stream=sys.stdout):
+        stream.write(f"{self.orders} orders placed in {elapsed:.2f}s: {self.orders / elapsed:.1f} orders/s, "
+                     f"{self.failed_customers} virtual customer(s) failed\n")
+        stream.write(f"{'step':<24} {'requests':>9} {'errors':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}\n")
+        for step, values in self.latencies.items():
+            if not values and not self.errors.get(step):
+                continue
+            if values:
+                timings = " ".join(f"{percentile(values, pct) * 1000:>7.1f}ms" for pct in (50, 95, 99))
+                timings += f" {max(values) * 1000:>7.1f}ms"
+            else:
+                timings = ""
+            stream.write(f"{step:<24} {len(values):>9} {self.errors.get(step, 0):>7} {timings}\n")
+        for error in self.first_errors:
+            stream.write(f"first errors: {error}\n")
+
+
+def rest_address(customer):
+    """The customer's address in the shape of Magento's REST API."""
+    details = customer.address
+    return {
+        "firstname": details.get("firstname", ""),
+        "lastname": details.get("lastname", ""),
+        "company": details.get("company", ""),
+        "street": [details.get(f"street[{index}]", "") for index in range(3) if details.get(f"street[{index}]")],
+        "city": details.get("city", ""),
+        "postcode": details.get("postcode", ""),
+        "telephone": details.get("telephone", ""),
+        "country_id": details.get("country_id", "RO"),
+        "region_id": details.get("region_id", "279"),
+        "email": customer.email,
+    }
+
+
+def unique_email(email, number):
+    """Give every virtual customer its own address: name+vc<n>@domain."""
+    name, _, domain = email.partition("@")
+    return f"{name}+vc{number}@{domain}"
+
+
+def load_customers(scenarios_path=None, details_path=ORDER_DETAILS_FILE):
+    """
+    The customer templates the virtual customers are made from.
+
+    Returns:
+        list: Customers from the guest rows of a scenario file, or the single order details customer.
+    """
+    if scenarios_path:
+        customers = [Customer(scenario.details.get("customer-email", ""),
+                              dict(scenario.details, country_id=scenario.country_id, region_id=scenario.region_id),
+                              scenario.items, scenario.discount_code)
+                     for scenario in iter_scenarios(scenarios_path) if scenario.login == "guest"]
+        if not customers:
+            raise ValueError(f"{scenarios_path} has no guest scenarios.")
+        return customers
+    details = load_order_details(details_path)
+    return [Customer(details.get("customer-email", ""), details, DEFAULT_ITEMS, DEFAULT_DISCOUNT_CODE)]
+
+
+async def timed(stats, step, pool, method, path, payload=None, expect_json=True):
+    """Send one request of a step, recording its latency; non-2xx responses raise LoadError."""
+    headers = {"Accept": "application/json" if expect_json else "text/html"}
+    body = b""
+    if payload is not None:
+        body = json.dumps(payload).encode("utf-8")
+        headers["Content-Type"] = "application/json"
+    response = await pool.request(method, path, body, headers)
+    stats.add(step, response.elapsed)
+    if not 200 <= response.status < 300:
+        raise LoadError(f"{method} {path} answered HTTP {response.status}: {response.body[:200]!r}")
+    return json.loads(response.body or b"null") if expect_json else response.body
+
+
+async def checkout(pool, stats, customer):
+    """Run the guest checkout of one virtual customer."""
+    step = "search"
+    try:
+        for item_name, *_ in customer.items:
+            await timed(stats, step, pool, "GET", f"/catalogsearch/result/?{urlencode({'q': item_name})}",
+                        expect_json=False)
+
+        step = "create cart"
+        cart_id = await timed(stats, step, pool, "POST", "/rest/V1/guest-carts")
+        cart_path = f"/rest/V1/guest-carts/{quote(cart_id)}"
+
+        step = "add to cart"
+        for item_name, quantity, *options in customer.items:
+            await timed(stats, step, pool, "POST", f"{cart_path}/items", {"cartItem": {
+                "sku": item_sku(item_name, *options), "qty": int(quantity), "quote_id": cart_id}})
+
+        step = "shipping information"
+        address = rest_address(customer)
+        await timed(stats, step, pool, "POST", f"{cart_path}/shipping-information", {"addressInformation": {
+            "shipping_address": address, "billing_address": address,
+            "shipping_carrier_code": "flatrate", "shipping_method_code": "flatrate"}})
+
+        if customer.discount_code:
+            step = "apply discount code"
+            await timed(stats, step, pool, "PUT", f"{cart_path}/coupons/{quote(customer.discount_code)}")
+
+        step = "payment"
+        await timed(stats, step, pool, "POST", f"{cart_path}/set-payment-information", {
+            "email": customer.email, "paymentMethod": {"method": "checkmo"}, "billingAddress": address})
+
+        step = "place order"
+        await timed(stats, step, pool, "PUT", f"{cart_path}/order", {"paymentMethod": {"method": "checkmo"}})
+        stats.orders += 1
+    except (LoadError, OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+        stats.fail(step, f"{type(e).__name__}: {e}")
+
+
+async def run_load(base_url, customers, count, concurrency, pool_size):
+    """
+    Run `count` virtual customers, at most `concurrency` at a time.
+
+    Returns:
+        tuple: The LoadStats and the elapsed seconds.
+    """
+    pool = ConnectionPool(base_url, pool_size)
+    stats = LoadStats()
+    numbers = itertools.count()
+    templates = itertools.cycle(customers)
+
+    async def virtual_customer():
+        for number in numbers:
+            if number >= count:
+                return
+            template = next(templates)
+            await checkout(pool, stats, template._replace(email=unique_email(template.email, number)))
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(virtual_customer() for _ in range(min(concurrency, count))))
+    finally:
+        pool.close()
+    elapsed = time.perf_counter() - started
+    logging.info(f"{pool.opened} connection(s) opened for {count} virtual customers.")
+    return stats, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Browserless load generator for the guest checkout.")
+    parser.add_argument("--customers", type=int, default=1000, help="Number of virtual customers (checkouts).")
+    parser.add_argument("--concurrency", type=int, default=200, help="Virtual customers running at the same time.")
+    parser.add_argument("--pool-size", type=int, default=100, help="Maximum number of open connections.")
+    parser.add_argument("--scenarios", help="Take the customers from the guest rows of this scenario file.")
+    parser.add_argument("--remote", action="store_true", help="Load MAGENTO_BASE_URL instead of the local stand-in.")
+    args = parser.parse_args(argv)
+
+    if not args.remote:
+        import storefront_stub
+        storefront_stub.start_local_storefront()
+
+    customers = load_customers(args.scenarios)
+    stats, elapsed = asyncio.run(run_load(config.BASE_URL, customers, args.customers, args.concurrency,
+                                          args.pool_size))
+    stats.report(elapsed)
+    return 0 if stats.orders and not stats.failed_customers else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,280 @@
+"""
+Storefront page performance, captured during the functional runs.
+
+Every page the suite opens already goes through the browser, so its own performance
+data is collected instead of thrown away: an observer registered for every new
+document keeps the largest contentful paint, the cumulative layout shift, the
+slowest interaction (an INP-style figure) and the long tasks, and one script call
+reads them together with the Navigation Timing and Resource Timing entries.
+
+The call is made after every driver.get() and at the end of every top-level step (the
+searches, adds to cart, checkout steps...), not after the steps nested in them, and
+no page is loaded for it. It goes through the session's unwrapped execute, so it is
+not counted among the WebDriver commands of the steps. The last
+reading of a document is kept: a document is counted once, when the session moves
+on to another one or when the test ends.
+
+Page views are grouped by page type (home, search, product, cart, checkout,
+success, account) and the p75 of every metric is checked against the budgets of
+page_budgets.json (ORDER_PAGE_BUDGETS). The figures and the exceeded budgets are
+logged and written to page_perf_report.worker<N>.json when the run ends.
+ORDER_PAGE_PERF=off turns the capture off.
+"""
+import atexit
+import functools
+import json
+import logging
+import os
+import re
+import threading
+from urllib.parse import urlsplit
+
+from selenium.webdriver.remote.command import Command
+
+import config
+from instrumentation import RECORDER
+from stats import percentile
+
+
+BUDGETS_FILE = os.environ.get("ORDER_PAGE_BUDGETS", "page_budgets.json")
+REPORT_FILE = f"page_perf_report.worker{config.WORKER_ID}.json"
+
+# Page types by storefront path (relative to the base URL), first match wins.
+PAGE_TYPES = [
+    ("success", r"^checkout/onepage/success"),
+    ("cart", r"^checkout/cart"),
+    ("checkout", r"^checkout"),
+    ("search", r"^catalogsearch/result"),
+    ("account", r"^customer/"),
+    ("product", r"\.html$"),
+    ("home", r"^$"),
+]
+
+# Metrics of a page view, in milliseconds except cls (unitless), resources (a count) and transfer_kb.
+METRICS = ("ttfb", "dom_content_loaded", "load", "lcp", "cls", "inp", "long_tasks", "blocking_time",
+           "resources", "transfer_kb")
+
+# Registered for every new document, before the page scripts run.
+OBSERVER_SCRIPT = """
+(function () {
+    if (window.__orderPerf) { return; }
+    var perf = window.__orderPerf = {lcp: null, cls: 0, inp: null, longTasks: []};
+    // Magento pages load more static files than the default buffer of 250 entries holds.
+    if (performance.setResourceTimingBufferSize) { performance.setResourceTimingBufferSize(2000); }
+    function observe(options, callback) {
+        try {
+            new PerformanceObserver(function (list) { list.getEntries().forEach(callback); }).observe(options);
+        } catch (e) {}
+    }
+    observe({type: 'largest-contentful-paint', buffered: true}, function (entry) {
+        perf.lcp = entry.renderTime || entry.loadTime || entry.startTime;
+    });
+    observe({type: 'layout-shift', buffered: true}, function (entry) {
+        if (!entry.hadRecentInput) { perf.cls += entry.value; }
+    });
+    observe({type: 'event', buffered: true, durationThreshold: 16}, function (entry) {
+        if (entry.interactionId) { perf.inp = Math.max(perf.inp || 0, entry.duration); }
+    });
+    observe({type: 'longtask', buffered: true}, function (entry) {
+        perf.longTasks.push(entry.duration);
+    });
+})();
+"""
+
+COLLECT_SCRIPT = """
+var perf = window.__orderPerf;
+var navigation = performance.getEntriesByType('navigation')[0];
+var resources = performance.getEntriesByType('resource');
+var transfer = navigation ? navigation.transferSize || 0 : 0;
+resources.forEach(function (entry) { transfer += entry.transferSize || 0; });
+var blocking = 0;
+(perf ? perf.longTasks : []).forEach(function (duration) { blocking += Math.max(0, duration - 50); });
+return {
+    url: location.href,
+    document: performance.timeOrigin,
+    ttfb: navigation ? navigation.responseStart : null,
+    dom_content_loaded: navigation && navigation.domContentLoadedEventEnd ? navigation.domContentLoadedEventEnd : null,
+    load: navigation && navigation.loadEventEnd ? navigation.loadEventEnd : null,
+    lcp: perf ? perf.lcp : null,
+    cls: perf ? perf.cls : null,
+    inp: perf ? perf.inp : null,
+    long_tasks: perf ? perf.longTasks.length : null,
+    blocking_time: perf ? blocking : null,
+    resources: resources.length,
+    transfer_kb: transfer / 1024
+};
+"""
+
+
+def page_type(url):
+    """The page type of a storefront URL, or None for pages outside the storefront."""
+    if not url.startswith(config.BASE_URL):
+        return None
+    path = urlsplit(url).path[len(urlsplit(config.BASE_URL).path):].strip("/")
+    return next((name for name, pattern in PAGE_TYPES if re.search(pattern, path)), "other")
+
+
+def load_budgets(path=BUDGETS_FILE):
+    """
+    Load the budgets: a "default" entry and optional per page type overrides.
+
+    Returns:
+        dict: Budget per metric, per page type.
+    """
+    try:
+        with open(path, "r") as budgets_file:
+            budgets = json.load(budgets_file)
+    except (OSError, ValueError) as e:
+        logging.warning(f"No page budgets loaded from {path}: {e}")
+        return {}
+    default = budgets.get("default", {})
+    return {name: {**default, **budgets.get(name, {})} for name, _ in PAGE_TYPES + [("other", None)]}
+
+
+class PageMonitor:
+    """The page views of the run, per page type, and the document each session is on."""
+
+    def __init__(self):
+        self.samples = {}
+        self.tests = {}
+        self._documents = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def capture(self, driver):
+        """Read the performance data of the session's current document, in one script call."""
+        try:
+            # The session's own execute, below the wrappers that count commands or capture pages.
+            reading = type(driver).execute(driver, Command.W3C_EXECUTE_SCRIPT,
+                                           {"script": COLLECT_SCRIPT, "args": []})["value"]
+        except Exception as e:
+            # The page was navigating or closed; the next capture reads the new document.
+            logging.debug(f"Could not read the page performance: {e}")
+            return None
+        kind = page_type(reading.get("url", ""))
+        if kind is None:
+            return None
+        reading["page_type"] = kind
+        reading["test"] = RECORDER.current_test()
+        with self._lock:
+            previous = self._documents.get(id(driver))
+            self._documents[id(driver)] = reading
+        if previous is not None and previous["document"] != reading["document"]:
+            self._count(previous)
+        return reading
+
+    def flush(self, driver):
+        """Count the session's current document, e.g. when its test ends."""
+        with self._lock:
+            reading = self._documents.pop(id(driver), None)
+        if reading is not None:
+            self._count(reading)
+
+    def _count(self, reading):
+        with self._lock:
+            samples = self.samples.setdefault(reading["page_type"], {metric: [] for metric in METRICS})
+            for metric in METRICS:
+                if reading.get(metric) is not None:
+                    samples[metric].append(reading[metric])
+            if reading["test"]:
+                self.tests[reading["test"]] = self.tests.get(reading["test"], 0) + 1
+
+    def step_finished(self, event):
+        """Recorder listener: read the page at the end of every top-level step, in the thread that ran it."""
+        driver = getattr(self._local, "driver", None)
+        if event["kind"] == "step" and event["depth"] == 0 and driver is not None:
+            self.capture(driver)
+
+    def report(self, budgets=None):
+        """
+        Summarize the page views per page type and check their p75 against the budgets.
+
+        Returns:
+            dict: {page_type: {"views", metric: {"p50", "p75", "p95"}, "over_budget": {metric: (p75, budget)}}}
+        """
+        budgets = load_budgets() if budgets is None else budgets
+        with self._lock:
+            documents = list(self._documents.values())
+            self._documents = {}
+        for reading in documents:
+            self._count(reading)
+        report = {}
+        with self._lock:
+            for kind, samples in sorted(self.samples.items()):
+                entry = {"views": max(len(values) for values in samples.values())}
+                over = {}
+                for metric, values in samples.items():
+                    if not values:
+                        continue
+                    entry[metric] = {f"p{pct}": round(percentile(values, pct), 3) for pct in (50, 75, 95)}
+                    budget = budgets.get(kind, {}).get(metric)
+                    if budget is not None and entry[metric]["p75"] > budget:
+                        over[metric] = (entry[metric]["p75"], budget)
+                entry["over_budget"] = over
+                report[kind] = entry
+        return report
+
+    def close(self):
+        """Write the report of the run and log the exceeded budgets."""
+        if not self.samples and not self._documents:
+            return
+        report = self.report()
+        for kind, entry in report.items():
+            for metric, (value, budget) in entry["over_budget"].items():
+                logging.warning(f"Page budget exceeded on {kind} pages: {metric} p75 {value} > {budget}")
+        logging.info("Page performance: " + ", ".join(
+            f"{kind} {entry['views']} views" + (f" lcp p75 {entry['lcp']['p75']:.0f}ms" if "lcp" in entry else "")
+            for kind, entry in report.items()))
+        try:
+            with open(REPORT_FILE, "w") as report_file:
+                json.dump(report, report_file, indent=2, sort_keys=True)
+        except OSError as e:
+            logging.warning(f"Failed to write {REPORT_FILE}: {e}")
+
+
+MONITOR = PageMonitor()
+
+
+def prepare_tab(driver):
+    """Register the performance observer in the session's current tab."""
+    if config.PAGE_PERF != "on":
+        return
+    try:
+        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": OBSERVER_SCRIPT})
+    except Exception as e:
+        logging.warning(f"Could not register the page performance observer: {e}")
+
+
+def attach(driver):
+    """Read the page after every navigation of the session, and let the step listener find it."""
+    if config.PAGE_PERF != "on" or getattr(driver, "_page_performance", False):
+        return driver
+    prepare_tab(driver)
+    execute = driver.execute
+
+    @functools.wraps(execute)
+    def monitored_execute(command, params=None):
+        MONITOR._local.driver = driver
+        response = execute(command, params)
+        if command == "get":
+            MONITOR.capture(driver)
+        return response
+
+    driver.execute = monitored_execute
+    driver._page_performance = True
+    return driver
+
+
+def report_test(test_id, driver):
+    """Take a last reading of the test's current page and count it."""
+    if config.PAGE_PERF != "on":
+        return None
+    MONITOR.capture(driver)
+    MONITOR.flush(driver)
+    MONITOR._local.driver = None
+    return MONITOR.tests.get(test_id, 0)
+
+
+if config.PAGE_PERF == "on":
+    RECORDER.listeners.append(MONITOR.step_finished)
+    atexit.register(MONITOR.close)
@@ -0,0 +1,272 @@
+"""
+Run the order-process suite sharded across worker processes.
+
+Every worker process imports the suite on its own, so it gets its own browser
+session pool and, through config.WORKER_ID, its own customer account and guest
+email. The results of all workers are merged into one unittest report.
+
+Tests are assigned to workers from the durations of earlier runs (see timing_db.py),
+longest first; --failing-first runs the recently failing tests first.
+
+Usage:
+    python parallel_runner.py --workers 4 [--failing-first]
+"""
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+import traceback
+import unittest
+
+import timing_db
+
+
+def flatten_suite(suite):
+    """Return the individual test cases of a (nested) TestSuite, in order."""
+    tests = []
+    for item in suite:
+        if isinstance(item, unittest.TestSuite):
+            tests.extend(flatten_suite(item))
+        else:
+            tests.append(item)
+    return tests
+
+
+def assign_shards(test_ids, workers):
+    """
+    Split the tests into one shard per worker, round robin.
+
+    Returns:
+        list: One list of test ids per worker.
+    """
+    return [test_ids[worker_id::workers] for worker_id in range(workers)]
+
+
+class RecordingResult(unittest.TestResult):
+    """A TestResult that records picklable outcomes to send back to the parent process."""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+        self._started = {}
+        self._failed_subtests = {}
+
+    def startTest(self, test):
+        super().startTest(test)
+        self._started[test.id()] = time.perf_counter()
+
+    def stopTest(self, test):
+        outcomes = self._failed_subtests.pop(test.id(), None)
+        if outcomes and test.id() in self._started:
+            # unittest reports no outcome of its own for a test that failed only through its
+            # subtests: record one, so the test gets its duration and failure history.
+            self._record(test, "error" if "error" in outcomes else "failure",
+                         f"{len(outcomes)} subtest(s) failed", subtest_failures=len(outcomes))
+        super().stopTest(test)
+
+    def _record(self, test, outcome, detail="", **extra):
+        started = self._started.pop(test.id(), time.perf_counter())
+        self.records.append({
+            "id": test.id(),
+            "description": str(test),
+            "outcome": outcome,
+            "detail": detail,
+            "duration": time.perf_counter() - started,
+            "worker": int(os.environ.get("ORDER_WORKER_ID", "0")),
+            **extra,
+        })
+
+    def addSuccess(self, test):
+        super().addSuccess(test)
+        self._record(test, "success")
+
+    def addFailure(self, test, err):
+        super().addFailure(test, err)
+        self._record(test, "failure", self.failures[-1][1])
+
+    def addError(self, test, err):
+        super().addError(test, err)
+        self._record(test, "error", self.errors[-1][1])
+
+    def addSkip(self, test, reason):
+        super().addSkip(test, reason)
+        self._record(test, "skip", reason)
+
+    def addExpectedFailure(self, test, err):
+        super().addExpectedFailure(test, err)
+        self._record(test, "expected_failure", self.expectedFailures[-1][1])
+
+    def addUnexpectedSuccess(self, test):
+        super().addUnexpectedSuccess(test)
+        self._record(test, "unexpected_success")
+
+    def addSubTest(self, test, subtest, err):
+        super().addSubTest(test, subtest, err)
+        if err is not None:
+            outcome = "failure" if issubclass(err[0], test.failureException) else "error"
+            self._failed_subtests.setdefault(test.id(), []).append(outcome)
+            self._record(subtest, outcome, self._exc_info_to_string(err, test), parent=test.id())
+
+
+def run_shard(worker_id, test_ids):
+    """
+    Run one shard of the suite inside a worker process.
+
+    Args:
+        worker_id (int): Index of the worker, exported as ORDER_WORKER_ID before the suite is imported.
+        test_ids (list): Ids of the tests assigned to this worker.
+
+    Returns:
+        list: The recorded outcome of every test of the shard.
+    """
+    os.environ["ORDER_WORKER_ID"] = str(worker_id)
+    import test_order_process
+
+    by_id = {test.id(): test for test in flatten_suite(test_order_process.build_suite())}
+    test_order_process.expect_tests(len(test_ids))
+    result = RecordingResult()
+    try:
+        unittest.TestSuite([by_id[test_id] for test_id in test_ids]).run(result)
+    except Exception:
+        result.records.append({
+            "id": f"worker-{worker_id}", "description": f"worker {worker_id}", "outcome": "error",
+            "detail": traceback.format_exc(), "duration": 0.0, "worker": worker_id,
+        })
+    return result.records
+
+
+class RecordedTest:
+    """Stand-in for a test case that ran in another process, used for reporting."""
+
+    def __init__(self, record):
+        self.record = record
+
+    def id(self):
+        return self.record["id"]
+
+    def shortDescription(self):
+        return None
+
+    def __str__(self):
+        return self.record["description"]
+
+
+def merge_results(records, stream, verbosity=2):
+    """
+    Merge worker records into a single TextTestResult.
+
+    Returns:
+        TextTestResult: A unittest-compatible result for the whole run.
+    """
+    result = unittest.TextTestResult(unittest.runner._WritelnDecorator(stream), True, verbosity)
+    outcome_lists = {
+        "failure": result.failures,
+        "error": result.errors,
+        "expected_failure": result.expectedFailures,
+    }
+    for record in records:
+        test = RecordedTest(record)
+        if "parent" not in record:
+            result.testsRun += 1
+        # A test that failed through its subtests is listed through the failed subtests.
+        if record["outcome"] in outcome_lists and not record.get("subtest_failures"):
+            outcome_lists[record["outcome"]].append((test, record["detail"]))
+        elif record["outcome"] == "skip":
+            result.skipped.append((test, record["detail"]))
+        elif record["outcome"] == "unexpected_success":
+            result.unexpectedSuccesses.append(test)
+        if verbosity > 1:
+            result.stream.writeln(f"{test} ... {record['outcome']} [worker {record['worker']}, {record['duration']:.1f}s]")
+    return result
+
+
+def provision_accounts(workers):
+    """
+    Give every worker its own customer account, so no two workers share a cart.
+
+    When ORDER_TEST_ACCOUNTS has fewer accounts than workers, the missing ones are
+    derived from the first account (config.worker_accounts) and exported to the workers.
+    The stand-in storefront creates them when it starts, a real storefront gets them
+    through its REST API.
+
+    Raises:
+        RuntimeError: If a missing account cannot be created.
+    """
+    import cart_seeding
+    import config
+
+    accounts = config.load_accounts()
+    if len(accounts) >= workers:
+        return
+    accounts = config.worker_accounts(workers)
+    if config.STOREFRONT != "local":
+        for email, password, name in accounts[len(config.load_accounts()):]:
+            try:
+                cart_seeding.ensure_customer(email, password, name)
+            except cart_seeding.CartSeedingError as e:
+                raise RuntimeError(f"Worker account {email} could not be created, add accounts to "
+                                   f"ORDER_TEST_ACCOUNTS or run fewer workers: {e}")
+    os.environ["ORDER_TEST_ACCOUNTS"] = ";".join(":".join(account) for account in accounts)
+
+
+def run_parallel(workers, stream=sys.stderr, verbosity=2, schedule="duration", failing_first=False):
+    """
+    Run the whole suite sharded across worker processes and print a merged report.
+
+    Args:
+        schedule (str): "duration" to balance the shards with the timing database,
+            "round-robin" to deal the tests out in order.
+        failing_first (bool): Run the tests that failed recently first in their shard.
+
+    Returns:
+        TextTestResult: The merged result.
+    """
+    import test_order_process
+
+    test_ids = [test.id() for test in flatten_suite(test_order_process.build_suite())]
+    if schedule == "duration":
+        shards = timing_db.plan(test_ids, workers, failing_first)
+    else:
+        shards = assign_shards(test_ids, workers)
+    shards = [shard for shard in shards if shard]
+
+    provision_accounts(len(shards))
+    started = time.perf_counter()
+    # The workers of a recording run store their responses in one generation (replay_proxy.py).
+    os.environ.setdefault("ORDER_REPLAY_GENERATION", time.strftime("%Y%m%d-%H%M%S"))
+    context = multiprocessing.get_context("spawn")
+    # One fresh process per shard, so each worker imports config with its own ORDER_WORKER_ID.
+    with context.Pool(len(shards), maxtasksperchild=1) as pool:
+        shard_records = pool.starmap(run_shard, enumerate(shards))
+    elapsed = time.perf_counter() - started
+
+    records = [record for shard in shard_records for record in shard]
+    try:
+        database = timing_db.TimingDatabase()
+        try:
+            database.record(records, set(test_ids))
+        finally:
+            database.close()
+    except sqlite3.Error as e:
+        stream.write(f"Failed to store the test durations: {e}\n")
+    result = merge_results(records, stream, verbosity)
+    result.printErrors()
+    result.stream.writeln(result.separator2)
+    result.stream.writeln(f"Ran {result.testsRun} tests in {elapsed:.3f}s across {len(shards)} workers")
+    result.stream.writeln()
+    result.stream.writeln("OK" if result.wasSuccessful() else "FAILED")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--schedule", choices=("duration", "round-robin"), default="duration",
+                        help="Balance the shards with the durations of earlier runs, or deal the tests out in order.")
+    parser.add_argument("--failing-first", action="store_true", help="Run the recently failing tests first.")
+    args = parser.parse_args()
+
+    result = run_parallel(args.workers, schedule=args.schedule, failing_first=args.failing_first)
+    sys.exit(0 if result.wasSuccessful() else 1)
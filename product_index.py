@@ -0,0 +1,264 @@
+"""
+Product catalog index for direct product navigation.
+
+add_item_to_cart used to find a product by typing its name into the search box and
+clicking the first result, then find the size and color swatches with XPath
+expressions built from their text. The index maps every product name the suite
+orders to its product page, SKU and swatch ids (attribute id and option id per
+label), so the helpers open the product page directly and click swatches by id.
+
+The index is built by a crawler that searches the storefront once per product, like
+a test would, and reads the product page. A product is only indexed when a search
+result carries exactly its name: when the first result is another product the
+crawler logs it and takes the exact match, instead of indexing the wrong product.
+search_item applies the same check.
+
+The index is stored in .product_index.json (ORDER_PRODUCT_INDEX_FILE) and loaded on
+first use. It is rebuilt when its format version, the storefront or its age
+(ORDER_PRODUCT_INDEX_MAX_AGE) no longer match, and a product whose page or swatch
+has gone is dropped and crawled again by the next run. Products missing from the
+index are crawled the first time a test orders them. A product that could not be
+crawled or opened is not tried again in the same run, its tests go through the search.
+
+Usage:
+    python product_index.py            # build the index against the local stand-in
+    python product_index.py --remote   # build it against MAGENTO_BASE_URL
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+from urllib.parse import urlencode
+
+import config
+from instrumentation import WebDriverWait
+
+
+INDEX_FILE = os.environ.get("ORDER_PRODUCT_INDEX_FILE", ".product_index.json")
+MAX_AGE_SECONDS = int(os.environ.get("ORDER_PRODUCT_INDEX_MAX_AGE", str(7 * 24 * 3600)))
+
+# Bumped whenever the layout of the entries changes; older files are rebuilt.
+INDEX_VERSION = 1
+
+Product = namedtuple("Product", "name path sku attributes")
+
+# Magento renders the swatches in the page's .swatch-opt container after the page loads.
+SWATCHES_RENDERED_SCRIPT = """
+var container = document.querySelector('.swatch-opt, [data-role^="swatch-options"]');
+return !container || container.querySelectorAll('.swatch-option').length > 0;
+"""
+
+READ_RESULTS_SCRIPT = """
+return Array.prototype.map.call(document.querySelectorAll('.product-item-info'), function (tile) {
+    var link = tile.querySelector('a.product-item-link') || tile.querySelector('a');
+    return {name: link ? link.textContent.trim() : '', href: link ? link.href : null};
+});
+"""
+
+# Swatch attributes and options carry their ids as attribute-id/option-id, or as
+# data-attribute-id/data-option-id in newer Magento releases.
+READ_PRODUCT_SCRIPT = """
+function attr(element, name) { return element.getAttribute(name) || element.getAttribute('data-' + name); }
+var sku = document.querySelector('.product-info-stock-sku [itemprop="sku"], .product.attribute.sku .value');
+var attributes = {};
+document.querySelectorAll('.swatch-attribute').forEach(function (attribute) {
+    var options = {};
+    attribute.querySelectorAll('.swatch-option').forEach(function (option) {
+        options[attr(option, 'option-label') || option.textContent.trim()] = attr(option, 'option-id');
+    });
+    attributes[attr(attribute, 'attribute-code')] = {attribute_id: attr(attribute, 'attribute-id'), options: options};
+});
+return {sku: sku ? sku.textContent.trim() : null, attributes: attributes};
+"""
+
+
+class ProductIndexError(Exception):
+    """Raised when a product cannot be found or indexed."""
+
+
+def pick_result(item_name, results):
+    """
+    Pick the search result of a product: the one named exactly like it.
+
+    Args:
+        item_name (str): The product searched for.
+        results (list): The {"name", "href"} results, in page order.
+
+    Returns:
+        dict: The matching result.
+
+    Raises:
+        ProductIndexError: If no result has the product's name.
+    """
+    wanted = item_name.strip().casefold()
+    match = next((result for result in results if result["name"].strip().casefold() == wanted), None)
+    if match is None:
+        raise ProductIndexError(f"No search result named '{item_name}' "
+                                f"(got {', '.join(repr(result['name']) for result in results[:5]) or 'none'}).")
+    if match is not results[0]:
+        logging.warning(f"The first search result for '{item_name}' is '{results[0]['name']}', "
+                        f"using result {results.index(match) + 1} instead.")
+    return match
+
+
+def option_selector(attribute_id, option_id):
+    """The CSS selector of a swatch option, by attribute id and option id."""
+    attributes = (f'.swatch-attribute[attribute-id="{attribute_id}"]',
+                  f'.swatch-attribute[data-attribute-id="{attribute_id}"]')
+    options = (f'.swatch-option[option-id="{option_id}"]', f'.swatch-option[data-option-id="{option_id}"]')
+    return ", ".join(f"{attribute} {option}" for attribute in attributes for option in options)
+
+
+class ProductIndex:
+    """The indexed products of one storefront, loaded from disk on first use."""
+
+    def __init__(self, path=INDEX_FILE):
+        self.path = path
+        self._products = None
+        self._lock = threading.Lock()
+        # Products that failed to be crawled or opened in this run.
+        self.failed = set()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as index_file:
+                data = json.load(index_file)
+        except (OSError, ValueError):
+            return {}
+        if (data.get("version") != INDEX_VERSION or data.get("base_url") != config.BASE_URL
+                or time.time() - data.get("built", 0) > MAX_AGE_SECONDS):
+            logging.info(f"The product index {self.path} is outdated, it will be rebuilt.")
+            return {}
+        return {name: Product(name, entry["path"], entry["sku"], entry["attributes"])
+                for name, entry in data.get("products", {}).items()}
+
+    @property
+    def products(self):
+        with self._lock:
+            if self._products is None:
+                self._products = self._load()
+            return self._products
+
+    def save(self):
+        """Write the index, through a temporary file so a parallel reader never sees half of it."""
+        data = {
+            "version": INDEX_VERSION,
+            "base_url": config.BASE_URL,
+            "built": time.time(),
+            "products": {product.name: {"path": product.path, "sku": product.sku, "attributes": product.attributes}
+                         for product in self.products.values()},
+        }
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary, "w") as index_file:
+                json.dump(data, index_file, indent=2, sort_keys=True)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            logging.warning(f"Failed to write the product index: {e}")
+
+    def get(self, item_name):
+        return self.products.get(item_name)
+
+    def invalidate(self, item_name):
+        """Drop a product whose page or swatches no longer match, so the next run crawls it again."""
+        self.failed.add(item_name)
+        if self.products.pop(item_name, None) is not None:
+            logging.info(f"Dropped '{item_name}' from the product index.")
+            self.save()
+
+    def crawl(self, driver, item_name):
+        """
+        Search the storefront for a product and index its page.
+
+        Returns:
+            Product: The indexed product.
+
+        Raises:
+            ProductIndexError: If the search has no result named like the product, or
+                its swatches don't render.
+        """
+        driver.get(config.url(f"catalogsearch/result/?{urlencode({'q': item_name})}"))
+        result = pick_result(item_name, driver.execute_script(READ_RESULTS_SCRIPT))
+        driver.get(result["href"])
+        try:
+            WebDriverWait(driver, 10).until(lambda driver: driver.execute_script(SWATCHES_RENDERED_SCRIPT))
+        except Exception as e:
+            raise ProductIndexError(f"The swatches of '{item_name}' did not render: {e}")
+        page = driver.execute_script(READ_PRODUCT_SCRIPT)
+        path = result["href"][len(config.BASE_URL):].lstrip("/") if result["href"].startswith(config.BASE_URL) \
+            else result["href"]
+        product = Product(item_name, path, page["sku"], page["attributes"])
+        self.products[item_name] = product
+        self.save()
+        logging.info(f"Indexed '{item_name}' ({product.sku}) at {path}.")
+        return product
+
+    def lookup(self, driver, item_name):
+        """
+        The indexed product, crawled now if the index doesn't have it yet.
+
+        Raises:
+            ProductIndexError: If the product failed earlier in the run, or cannot be crawled.
+        """
+        if item_name in self.failed:
+            raise ProductIndexError(f"'{item_name}' is not indexed in this run.")
+        product = self.get(item_name)
+        if product is not None:
+            return product
+        try:
+            return self.crawl(driver, item_name)
+        except ProductIndexError:
+            self.failed.add(item_name)
+            raise
+
+
+PRODUCT_INDEX = ProductIndex()
+
+
+def product_names(scenarios_path=None):
+    """The products the suite orders: the known SKUs and the items of a scenario file."""
+    from cart_seeding import PRODUCT_SKUS
+    from scenarios import iter_scenarios
+
+    names = list(PRODUCT_SKUS)
+    if scenarios_path:
+        for scenario in iter_scenarios(scenarios_path):
+            names.extend(item[0] for item in scenario.items if item[0] not in names)
+    return names
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the product catalog index.")
+    parser.add_argument("--remote", action="store_true", help="Crawl MAGENTO_BASE_URL instead of the local stand-in.")
+    parser.add_argument("--scenarios", default=config.SCENARIOS_FILE, help="Also index the items of this scenario file.")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if not args.remote:
+        import storefront_stub
+        storefront_stub.start_local_storefront()
+    from session_pool import quit_quietly, start_chrome
+
+    index = ProductIndex()
+    index.products.clear()
+    failed = 0
+    driver = start_chrome()
+    try:
+        for name in product_names(args.scenarios):
+            try:
+                index.crawl(driver, name)
+            except ProductIndexError as e:
+                logging.error(e)
+                failed += 1
+    finally:
+        quit_quietly(driver)
+    print(f"Indexed {len(index.products)} product(s) into {index.path}, {failed} failed.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,368 @@
+"""
+Record/replay proxy for the storefront.
+
+With ORDER_REPLAY=record or ORDER_REPLAY=replay the suite talks to a local proxy
+instead of the storefront: config.BASE_URL is pointed at the proxy, which stands in
+for the real storefront URL (a reverse proxy, so HTTPS stores need no certificate
+interception).
+
+- record: every request is forwarded to the storefront and the response is stored
+  under a normalized key of the request.
+- replay: responses are served from the store without touching the network.
+  Requests that were never recorded get a 504.
+
+The store (ORDER_REPLAY_STORE, default .replay/) holds one generation per record run.
+Every worker of the run appends to its own bodies file, memory-mapped when replaying,
+and its own index.jsonl with one line per response, so parallel workers never write
+to the same file. Replays answer from the newest generation that recorded a request,
+and only the ORDER_REPLAY_KEEP newest generations are kept. Keys
+leave out what changes from run to run (form keys, cache busters, masked cart ids in
+REST paths), see VOLATILE_PARAMS and KEY_REWRITE_RULES. A request made several times
+within a test is answered with the recorded responses in order, so stateful pages
+(the cart before and after an add) replay correctly. Hits and misses are counted per
+test and reported by report_test().
+"""
+import hashlib
+import http.client
+import json
+import logging
+import mmap
+import os
+import re
+import shutil
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import config
+from instrumentation import RECORDER
+
+
+STORE_DIR = os.environ.get("ORDER_REPLAY_STORE", ".replay")
+STATS_FILE = f"replay_stats.worker{config.WORKER_ID}.json"
+
+# The record run this process belongs to; parallel_runner.py gives all its workers the same one.
+GENERATION = os.environ.get("ORDER_REPLAY_GENERATION") or time.strftime("%Y%m%d-%H%M%S")
+KEEP_GENERATIONS = int(os.environ.get("ORDER_REPLAY_KEEP", "2"))
+
+# Query and form parameters that differ between runs and are left out of the keys.
+VOLATILE_PARAMS = {"_", "form_key", "SID", "uenc", "timestamp"}
+
+# Rewrites applied to request paths before they become keys: (pattern, replacement).
+KEY_REWRITE_RULES = [
+    (re.compile(r"/guest-carts/[A-Za-z0-9]{20,}"), "/guest-carts/{cart_id}"),
+    (re.compile(r"/static/version\d+/"), "/static/{version}/"),
+    (re.compile(r"/uenc/[A-Za-z0-9,_-]+"), "/uenc/{uenc}"),
+]
+
+# Headers that describe one connection, or the encoding of the original body.
+SKIPPED_HEADERS = {"connection", "keep-alive", "proxy-connection", "transfer-encoding", "content-length",
+                   "content-encoding", "upgrade", "te", "trailer", "host", "accept-encoding"}
+
+TEXT_TYPES = ("text/", "json", "javascript", "xml")
+
+
+def normalize_key(method, path, body=b"", content_type=""):
+    """
+    Build the store key of a request.
+
+    Returns:
+        str: "<METHOD> <normalized path>?<sorted stable query>[ body:<hash>]".
+    """
+    parts = urlsplit(path)
+    normalized = parts.path
+    for pattern, replacement in KEY_REWRITE_RULES:
+        normalized = pattern.sub(replacement, normalized)
+    query = sorted((name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if name not in VOLATILE_PARAMS)
+    key = f"{method} {normalized}" + (f"?{urlencode(query)}" if query else "")
+    if body:
+        if "application/x-www-form-urlencoded" in content_type:
+            fields = sorted((name, value) for name, value in parse_qsl(body.decode("utf-8", "replace"),
+                                                                         keep_blank_values=True)
+                            if name not in VOLATILE_PARAMS)
+            body = urlencode(fields).encode()
+        elif "json" in content_type:
+            try:
+                body = json.dumps(json.loads(body), sort_keys=True).encode()
+            except ValueError:
+                pass
+        key += f" body:{hashlib.sha1(body).hexdigest()[:16]}"
+    return key
+
+
+class ReplayStore:
+    """
+    Responses on disk, one segment per worker and record run.
+
+    A segment is <generation>/worker<N>.bin with the bodies and <generation>/worker<N>.jsonl
+    with the index entries locating them.
+    """
+
+    def __init__(self, directory=STORE_DIR):
+        self.directory = directory
+        self.index = {}
+        self._lock = threading.Lock()
+        self._bodies = None
+        self._segment = None
+        self._maps = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def generations(self):
+        """The recorded generations, oldest first."""
+        return sorted(name for name in os.listdir(self.directory)
+                      if os.path.isdir(os.path.join(self.directory, name)))
+
+    def _path(self, segment, extension):
+        return os.path.join(self.directory, f"{segment}.{extension}")
+
+    def open_for_replay(self):
+        """
+        Load the index of every generation, oldest first, and memory-map the bodies files;
+        bodies are sliced from the maps without reading the files.
+        """
+        for generation in self.generations():
+            for name in sorted(os.listdir(os.path.join(self.directory, generation))):
+                if not name.endswith(".jsonl"):
+                    continue
+                segment = f"{generation}/{name[:-len('.jsonl')]}"
+                with open(self._path(segment, "jsonl"), "r") as index_file:
+                    for line in index_file:
+                        if line.strip():
+                            entry = json.loads(line)
+                            entry["segment"] = segment
+                            self.index.setdefault(entry["key"], []).append(entry)
+                bodies_path = self._path(segment, "bin")
+                if os.path.exists(bodies_path) and os.path.getsize(bodies_path):
+                    with open(bodies_path, "rb") as bodies_file:
+                        self._maps[segment] = mmap.mmap(bodies_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self
+
+    def open_for_record(self, generation=GENERATION):
+        """Start this worker's segment of a generation and drop the generations beyond the newest ones kept."""
+        os.makedirs(os.path.join(self.directory, generation), exist_ok=True)
+        self._segment = f"{generation}/worker{config.WORKER_ID}"
+        self._bodies = open(self._path(self._segment, "bin"), "ab")
+        for old in self.generations()[:-KEEP_GENERATIONS or None]:
+            if old != generation:
+                shutil.rmtree(os.path.join(self.directory, old), ignore_errors=True)
+        return self
+
+    def add(self, key, test, status, headers, body):
+        with self._lock:
+            offset = self._bodies.seek(0, os.SEEK_END)
+            self._bodies.write(body)
+            self._bodies.flush()
+            entry = {"key": key, "test": test, "status": status, "headers": headers,
+                     "offset": offset, "length": len(body)}
+            with open(self._path(self._segment, "jsonl"), "a") as index_file:
+                index_file.write(json.dumps(entry) + "\n")
+            self.index.setdefault(key, []).append(dict(entry, segment=self._segment))
+
+    def find(self, key, test, occurrence):
+        """
+        The recorded response for the n-th occurrence of a request in a test.
+
+        Uses the newest segment in which the test made the request, falling back to the
+        last response recorded by the test, then to the newest response of any test
+        (static assets recorded by whichever test loaded them).
+        """
+        entries = self.index.get(key)
+        if not entries:
+            return None
+        own = [entry for entry in entries if entry["test"] == test]
+        if own:
+            own = [entry for entry in own if entry["segment"] == own[-1]["segment"]]
+            return own[min(occurrence, len(own) - 1)]
+        return entries[-1]
+
+    def body(self, entry):
+        segment_map = self._maps.get(entry["segment"])
+        if segment_map is None:
+            with open(self._path(entry["segment"], "bin"), "rb") as bodies_file:
+                bodies_file.seek(entry["offset"])
+                return bodies_file.read(entry["length"])
+        return segment_map[entry["offset"]:entry["offset"] + entry["length"]]
+
+    def close(self):
+        if self._bodies is not None:
+            self._bodies.close()
+        for segment_map in self._maps.values():
+            segment_map.close()
+
+
+class ReplayProxy:
+    """The proxy's state: mode, upstream, store, and the per-test counters."""
+
+    def __init__(self, mode, upstream, store):
+        self.mode = mode
+        self.upstream = urlsplit(upstream)
+        self.upstream_origin = f"{self.upstream.scheme}://{self.upstream.netloc}"
+        self.store = store
+        self.origin = None
+        self.server = None
+        self.stats = {}
+        self._occurrences = {}
+        self._lock = threading.Lock()
+
+    def next_occurrence(self, test, key):
+        with self._lock:
+            occurrence = self._occurrences.get((test, key), 0)
+            self._occurrences[(test, key)] = occurrence + 1
+        return occurrence
+
+    def count(self, test, outcome):
+        with self._lock:
+            stats = self.stats.setdefault(test or "(no test)", {"hits": 0, "misses": 0, "recorded": 0})
+            stats[outcome] += 1
+
+    def fetch(self, method, path, headers, body):
+        """Forward a request to the storefront, returning (status, headers, body)."""
+        connection_class = (http.client.HTTPSConnection if self.upstream.scheme == "https"
+                            else http.client.HTTPConnection)
+        connection = connection_class(self.upstream.netloc, timeout=60)
+        try:
+            connection.request(method, path, body=body or None, headers=headers)
+            response = connection.getresponse()
+            return response.status, response.getheaders(), response.read()
+        finally:
+            connection.close()
+
+    def to_upstream(self, value):
+        return value.replace(self.origin, self.upstream_origin)
+
+    def rewrite_body(self, body, content_type):
+        """Point the storefront's absolute URLs at the proxy, in plain and JSON-escaped form."""
+        if not any(kind in content_type for kind in TEXT_TYPES):
+            return body
+        escaped = self.upstream_origin.replace("/", "\\/").encode()
+        return (body.replace(self.upstream_origin.encode(), self.origin.encode())
+                .replace(escaped, self.origin.replace("/", "\\/").encode()))
+
+    def rewrite_headers(self, headers):
+        rewritten = []
+        for name, value in headers:
+            lower = name.lower()
+            if lower in SKIPPED_HEADERS:
+                continue
+            if lower == "location":
+                value = value.replace(self.upstream_origin, self.origin)
+            elif lower == "set-cookie":
+                # The proxy is plain HTTP on another host: drop the domain and the HTTPS-only attributes.
+                value = re.sub(r";\s*(Domain=[^;]*|Secure|SameSite=None)(?=;|$)", "", value, flags=re.IGNORECASE)
+            elif lower == "strict-transport-security":
+                continue
+            rewritten.append((name, value))
+        return rewritten
+
+
+class ReplayHandler(BaseHTTPRequestHandler):
+    proxy = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.debug(f"replay proxy: {format % args}")
+
+    def handle_request(self):
+        proxy = self.proxy
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        test = RECORDER.current_test()
+        key = normalize_key(self.command, self.path, body, self.headers.get("Content-Type", ""))
+        occurrence = proxy.next_occurrence(test, key)
+
+        if proxy.mode == "replay":
+            entry = proxy.store.find(key, test, occurrence)
+            if entry is None:
+                proxy.count(test, "misses")
+                logging.warning(f"Replay miss: {key}")
+                return self.respond(504, [("Content-Type", "text/plain")], f"Not recorded: {key}".encode())
+            proxy.count(test, "hits")
+            return self.respond(entry["status"], entry["headers"], proxy.store.body(entry))
+
+        headers = {name: proxy.to_upstream(value) for name, value in self.headers.items()
+                   if name.lower() not in SKIPPED_HEADERS}
+        headers["Host"] = proxy.upstream.netloc
+        headers["Accept-Encoding"] = "identity"
+        try:
+            status, response_headers, response_body = proxy.fetch(self.command, self.path, headers, body)
+        except OSError as e:
+            proxy.count(test, "misses")
+            return self.respond(502, [("Content-Type", "text/plain")], f"Storefront unreachable: {e}".encode())
+        stored_headers = [(name, value) for name, value in response_headers if name.lower() not in SKIPPED_HEADERS]
+        proxy.store.add(key, test, status, stored_headers, response_body)
+        proxy.count(test, "recorded")
+        self.respond(status, stored_headers, response_body)
+
+    def respond(self, status, headers, body):
+        proxy = self.proxy
+        content_type = next((value for name, value in headers if name.lower() == "content-type"), "")
+        body = proxy.rewrite_body(bytes(body), content_type)
+        self.send_response(status)
+        for name, value in proxy.rewrite_headers(headers):
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = do_OPTIONS = handle_request
+
+
+PROXY = None
+
+
+def start_replay_proxy(mode=None, upstream=None, host="127.0.0.1", port=0, store_dir=STORE_DIR):
+    """
+    Start the proxy in a background thread and point config.BASE_URL at it.
+
+    Args:
+        mode (str): "record" or "replay", defaults to config.REPLAY.
+        upstream (str): The storefront to record, defaults to the current config.BASE_URL.
+
+    Returns:
+        ReplayProxy: The running proxy.
+    """
+    global PROXY
+    mode = mode or config.REPLAY
+    if mode not in ("record", "replay"):
+        raise ValueError(f"Unknown replay mode '{mode}', expected 'record' or 'replay'.")
+    store = ReplayStore(store_dir)
+    store = store.open_for_replay() if mode == "replay" else store.open_for_record()
+    proxy = ReplayProxy(mode, upstream or config.BASE_URL, store)
+    handler = type("BoundReplayHandler", (ReplayHandler,), {"proxy": proxy})
+    proxy.server = ThreadingHTTPServer((host, port), handler)
+    proxy.server.daemon_threads = True
+    proxy.origin = f"http://{host}:{proxy.server.server_address[1]}"
+    threading.Thread(target=proxy.server.serve_forever, name="replay-proxy", daemon=True).start()
+    config.BASE_URL = proxy.origin
+    PROXY = proxy
+    logging.info(f"Replay proxy ({mode}) for {proxy.upstream_origin} listening on {proxy.origin}")
+    return proxy
+
+
+def report_test(test_id):
+    """Log and store the hit/miss counts of a finished test, when the proxy is running."""
+    if PROXY is None:
+        return None
+    with PROXY._lock:
+        stats = dict(PROXY.stats.get(test_id, {"hits": 0, "misses": 0, "recorded": 0}))
+    if PROXY.mode == "replay":
+        total = stats["hits"] + stats["misses"]
+        rate = f"{stats['hits'] / total * 100:.0f}%" if total else "n/a"
+        logging.info(f"{test_id}: {stats['hits']} replayed, {stats['misses']} missed (hit rate {rate})")
+    else:
+        logging.info(f"{test_id}: {stats['recorded']} responses recorded")
+    try:
+        with open(STATS_FILE, "r") as stats_file:
+            report = json.load(stats_file)
+    except (OSError, ValueError):
+        report = {}
+    report[test_id] = stats
+    try:
+        with open(STATS_FILE, "w") as stats_file:
+            json.dump(report, stats_file, indent=2, sort_keys=True)
+    except OSError as e:
+        logging.warning(f"Failed to write {STATS_FILE}: {e}")
+    return stats
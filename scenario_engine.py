@@ -0,0 +1,204 @@
+"""
+Shared-prefix execution of the scenario matrix.
+
+The checkouts of order_scenarios.csv repeat the same first steps: every scenario
+opens the storefront, the customer scenarios log in with the same account, and many
+scenarios start their cart with the same line items. The engine turns every scenario
+into a sequence of steps, merges the sequences into a prefix tree and walks the tree
+once: a shared prefix runs once, a snapshot is taken where the scenarios part ways,
+and every further branch starts from that snapshot instead of from scratch.
+
+A snapshot holds the browser state of step checkpoints (cookies, URL; the section
+cache is left out so Magento reloads it) and the cart the prefix built, which is put
+back on the storefront when the snapshot is restored: through the REST API for the
+customer's cart, and as a new adopted guest cart on the local stand-in. Guest carts
+of the remote store cannot be attached to a browser, so their branches replay the
+prefix instead.
+
+ORDER_SCENARIO_PREFIXES=shared runs the matrix this way, as one test with a subtest
+per scenario; the default runs every scenario as its own test.
+"""
+import logging
+from collections import namedtuple
+
+import config
+from cart_seeding import replace_customer_cart, seed_guest_cart
+from checkpoints import restore_checkpoint, take_checkpoint
+
+Step = namedtuple("Step", "name args")
+Snapshot = namedtuple("Snapshot", "checkpoint login items")
+
+
+def scenario_steps(scenario):
+    """
+    The steps of a scenario, as keys of the prefix tree.
+
+    Steps are equal when they do the same thing, so equal prefixes of different
+    scenarios merge. The final checkout step is specific to its scenario.
+
+    Returns:
+        list: Step tuples.
+    """
+    steps = [Step("open storefront", ())]
+    if scenario.login == "customer":
+        steps.append(Step("log in", ()))
+    steps += [Step("add to cart", (scenario.login,) + tuple(item)) for item in scenario.items]
+    steps.append(Step("checkout", (scenario.id,)))
+    return steps
+
+
+class PrefixNode:
+    """A step of the tree, with the steps that follow it and the scenarios that end with it."""
+
+    def __init__(self, step=None):
+        self.step = step
+        self.children = {}
+        self.scenarios = []
+
+    def scenario_ids(self):
+        ids = list(self.scenarios)
+        for child in self.children.values():
+            ids.extend(child.scenario_ids())
+        return ids
+
+
+def build_prefix_tree(sequences):
+    """
+    Merge step sequences into a prefix tree.
+
+    Args:
+        sequences (list): (scenario_id, steps) pairs; branches keep the order of the scenarios.
+
+    Returns:
+        PrefixNode: The root, which has no step of its own.
+    """
+    root = PrefixNode()
+    for scenario_id, steps in sequences:
+        node = root
+        for step in steps:
+            node = node.children.setdefault(step, PrefixNode(step))
+        node.scenarios.append(scenario_id)
+    return root
+
+
+def take_snapshot(driver, path):
+    """Snapshot the browser and the cart after the steps of `path`."""
+    login = "customer" if Step("log in", ()) in path else "guest"
+    items = [step.args[1:] for step in path if step.name == "add to cart"]
+    checkpoint = take_checkpoint(driver, path[-1].name if path else "start", 0.0)
+    if login == "guest":
+        # The guest cart lives in the session the cookies point to, a restore starts a new session.
+        checkpoint = checkpoint._replace(cookies=[])
+    return Snapshot(checkpoint._replace(storage={}), login, items)
+
+
+def restore_snapshot(driver, snapshot):
+    """
+    Put the browser and the cart back at a snapshot.
+
+    Returns:
+        bool: True if restored, False if the prefix has to be replayed instead.
+    """
+    checkpoint = snapshot.checkpoint
+    if snapshot.login == "customer":
+        # The cart is replaced before the page loads, so the page shows it.
+        replace_customer_cart(snapshot.items)
+        restore_checkpoint(driver, checkpoint)
+        return True
+    driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+    if snapshot.items:
+        if config.STOREFRONT != "local":
+            # Replayed in a new session, without the cart of the previous branch.
+            return False
+        seed_guest_cart(driver, snapshot.items)
+        checkpoint = checkpoint._replace(cookies=driver.get_cookies())
+    restore_checkpoint(driver, checkpoint)
+    return True
+
+
+class PrefixRunner:
+    """
+    Walks a prefix tree, running every step once per branch that needs it.
+
+    Args:
+        execute (callable): Runs a Step; a step fails by raising.
+        snapshot (callable): Takes a snapshot after the steps of a path.
+        restore (callable): Restores a snapshot, returning False when it cannot.
+    """
+
+    def __init__(self, execute, snapshot, restore):
+        self.execute = execute
+        self.snapshot = snapshot
+        self.restore = restore
+        self.executed = 0
+        self.replayed = 0
+        self.restored = 0
+        self.results = {}
+
+    def run(self, root):
+        """
+        Run every scenario of the tree.
+
+        Returns:
+            dict: The exception each scenario failed with, or None when it passed, by scenario id.
+        """
+        self._run_children(root, [])
+        return self.results
+
+    def _run_children(self, node, path):
+        children = list(node.children.values())
+        snapshot = None
+        if len(children) > 1:
+            try:
+                snapshot = self.snapshot(path)
+            except Exception as e:
+                logging.warning(f"Could not snapshot after {len(path)} step(s), branches replay the prefix: {e}")
+        for index, child in enumerate(children):
+            if index and not self._resume(snapshot, path, child):
+                continue
+            self._run(child, path + [child.step])
+
+    def _resume(self, snapshot, path, child):
+        try:
+            if snapshot is not None and self.restore(snapshot):
+                self.restored += 1
+                return True
+            for step in path:
+                self.execute(step)
+                self.executed += 1
+                self.replayed += 1
+            return True
+        except Exception as e:
+            self._fail(child, e)
+            return False
+
+    def _run(self, node, path):
+        try:
+            self.execute(node.step)
+            self.executed += 1
+        except Exception as e:
+            self._fail(node, e)
+            return
+        for scenario_id in node.scenarios:
+            self.results[scenario_id] = None
+        self._run_children(node, path)
+
+    def _fail(self, node, error):
+        for scenario_id in node.scenario_ids():
+            self.results[scenario_id] = error
+
+
+def run_shared(scenarios, execute, snapshot, restore):
+    """
+    Run scenarios with their shared prefixes executed once.
+
+    Returns:
+        dict: The exception each scenario failed with, or None when it passed, by scenario id.
+    """
+    sequences = [(scenario.id, scenario_steps(scenario)) for scenario in scenarios]
+    runner = PrefixRunner(execute, snapshot, restore)
+    results = runner.run(build_prefix_tree(sequences))
+    separate = sum(len(steps) for _, steps in sequences)
+    logging.info(f"Ran {len(sequences)} scenarios in {runner.executed} steps instead of {separate} "
+                 f"({runner.restored} snapshot restores, {runner.replayed} steps replayed).")
+    return results
@@ -0,0 +1,153 @@
+"""
+Order scenarios read from CSV files.
+
+order_details.csv holds the single guest address used by the checkout tests.
+order_scenarios.csv holds a matrix of checkouts, one per row: who checks out
+(guest or customer), the address, the country and region, the items and an
+optional discount code. The suite turns every row into its own test.
+
+The files are parsed once per process and cached until they change on disk. A
+scenario file is not loaded as a whole: rows are streamed, and single scenarios
+are read through a byte-offset index so a worker only parses the rows it runs.
+"""
+import csv
+import functools
+import io
+import os
+from collections import namedtuple
+
+
+ORDER_DETAILS_FILE = "order_details.csv"
+SCENARIOS_FILE = "order_scenarios.csv"
+
+# Columns of a scenario row that are not part of the address form.
+SCENARIO_COLUMNS = ("scenario_id", "login", "country_id", "region_id", "items", "discount_code")
+LOGINS = ("guest", "customer")
+
+Scenario = namedtuple("Scenario", "id login details country_id region_id items discount_code")
+
+
+class ScenarioError(Exception):
+    """Raised when a scenario file or row is invalid."""
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+@functools.lru_cache(maxsize=8)
+def _read_order_details(path, mtime):
+    with open(path, "r", newline="") as csvfile:
+        rows = csv.reader(csvfile)
+        next(rows, None)  # name,details header
+        return {row[0]: row[1] for row in rows if len(row) >= 2}
+
+
+def load_order_details(path=ORDER_DETAILS_FILE):
+    """
+    Load the "name,details" order details file.
+
+    The file is parsed once and cached until its modification time changes.
+
+    Returns:
+        dict: A copy of the field name -> value mapping, safe to modify.
+
+    Raises:
+        FileNotFoundError: If the file does not exist.
+    """
+    return dict(_read_order_details(path, _mtime(path)))
+
+
+def parse_items(spec):
+    """
+    Parse the items column of a scenario.
+
+    Args:
+        spec (str): Line items separated by ";", each "name|quantity|size|color" with
+            size and color optional, e.g. "Overnight Duffle|3;Radiant Tee|1|M|Blue".
+
+    Returns:
+        list: (item_name, quantity, size, color) tuples, as passed to add_item_to_cart.
+    """
+    items = []
+    for entry in spec.split(";"):
+        if not entry.strip():
+            continue
+        parts = [part.strip() for part in entry.split("|")] + [""] * 3
+        name, quantity, size, color = parts[:4]
+        if not name or not quantity.isdigit() or int(quantity) < 1:
+            raise ScenarioError(f"Invalid line item '{entry}', expected 'name|quantity|size|color'.")
+        items.append((name, int(quantity), size or None, color or None))
+    return items
+
+
+def to_scenario(row):
+    """
+    Build a Scenario from a CSV row.
+
+    Raises:
+        ScenarioError: If a required column is missing or has an invalid value.
+    """
+    scenario_id = (row.get("scenario_id") or "").strip()
+    if not scenario_id:
+        raise ScenarioError(f"Scenario row without a scenario_id: {row}")
+    login = (row.get("login") or "guest").strip()
+    if login not in LOGINS:
+        raise ScenarioError(f"{scenario_id}: login must be one of {LOGINS}, got '{login}'.")
+    items = parse_items(row.get("items") or "")
+    if not items:
+        raise ScenarioError(f"{scenario_id}: no items to order.")
+    details = {key: value for key, value in row.items() if key not in SCENARIO_COLUMNS and key is not None}
+    return Scenario(scenario_id, login, details, (row.get("country_id") or "").strip(),
+                    (row.get("region_id") or "").strip(), items, (row.get("discount_code") or "").strip() or None)
+
+
+def iter_scenarios(path=SCENARIOS_FILE):
+    """Stream the scenarios of a file one row at a time."""
+    with open(path, "r", newline="") as csvfile:
+        for row in csv.DictReader(csvfile):
+            yield to_scenario(row)
+
+
+@functools.lru_cache(maxsize=8)
+def _index_scenarios(path, mtime):
+    """Map every scenario id to the byte offset of its row, in a single pass over the file."""
+    index = {}
+    with open(path, "rb") as csvfile:
+        header = csvfile.readline()
+        offset = csvfile.tell()
+        for line in iter(csvfile.readline, b""):
+            scenario_id = line.split(b",", 1)[0].strip().decode()
+            if scenario_id:
+                if scenario_id in index:
+                    raise ScenarioError(f"Duplicate scenario id '{scenario_id}' in {path}.")
+                index[scenario_id] = offset
+            offset = csvfile.tell()
+    return header.decode(), index
+
+
+def scenario_ids(path=SCENARIOS_FILE):
+    """The ids of the scenarios of a file, in file order."""
+    return list(_index_scenarios(path, _mtime(path))[1])
+
+
+def load_scenario(path, scenario_id):
+    """
+    Read a single scenario without parsing the rest of the file.
+
+    Rows are located through a cached byte-offset index, so scenario rows must fit on
+    one line (no quoted line breaks).
+
+    Raises:
+        ScenarioError: If the file has no scenario with that id.
+    """
+    header, index = _index_scenarios(path, _mtime(path))
+    if scenario_id not in index:
+        raise ScenarioError(f"No scenario '{scenario_id}' in {path}.")
+    with open(path, "rb") as csvfile:
+        csvfile.seek(index[scenario_id])
+        line = csvfile.readline().decode()
+    return to_scenario(next(csv.DictReader(io.StringIO(header + line))))
@@ -0,0 +1,326 @@
+import atexit
+import logging
+import os
+import shutil
+import threading
+
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service
+
+import browser_resources
+import cart_seeding
+import config
+import fast_profile
+import forensics
+import page_performance
+from instrumentation import instrument_driver
+from waits import install_idle_observer
+
+
+def build_chrome_options():
+    """
+    Build the ChromeOptions shared by every browser session of the suite.
+
+    Returns:
+        ChromeOptions: The options used to start a Chrome WebDriver.
+    """
+    options = webdriver.ChromeOptions()
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-webusb")
+    options.add_argument("--log-level=1")
+    options.add_experimental_option('excludeSwitches', ['enable-logging', 'enable-automation'])
+    if config.FAST_PROFILE == "on":
+        fast_profile.add_fast_options(options)
+    return options
+
+
+def start_chrome(options_factory=build_chrome_options):
+    """Start a brand new Chrome WebDriver session."""
+    driver = webdriver.Chrome(service=Service(), options=options_factory())
+    driver = fast_profile.prepare_driver(page_performance.attach(forensics.attach(instrument_driver(driver))))
+    return browser_resources.attach(driver)
+
+
+def is_session_healthy(driver):
+    """
+    Check that a browser session still answers WebDriver commands.
+
+    Args:
+        driver (WebDriver): The session to check.
+
+    Returns:
+        bool: True if the browser responds and has at least one open window, False otherwise.
+    """
+    try:
+        return driver.execute_script("return 1") == 1 and len(driver.window_handles) > 0
+    except Exception as e:
+        logging.warning(f"Browser session is not healthy: {e}")
+        return False
+
+
+def reset_session(driver, origin=None):
+    """
+    Bring a used browser session back to a clean state.
+
+    Extra tabs are closed, all cookies are dropped (this also detaches the Magento
+    guest cart, which is bound to the session cookie) and the storefront's
+    localStorage/sessionStorage (Magento's minicart and customer section cache)
+    is cleared. The remaining tab is left on a blank page.
+
+    A logged-in customer's cart is not reset here: Magento keeps it on the server with
+    the account and loads it into the next session that logs in. SessionPool.release()
+    empties it through the REST API (empty_customer_cart()).
+
+    Args:
+        driver (WebDriver): The session to reset.
+        origin (str): The storefront origin whose storage should be cleared, defaults to config.BASE_URL.
+
+    Returns:
+        bool: True if the session was reset, False if it should be discarded.
+    """
+    try:
+        handles = driver.window_handles
+        for handle in handles[1:]:
+            driver.switch_to.window(handle)
+            driver.close()
+        driver.switch_to.window(handles[0])
+
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        driver.execute_cdp_cmd("Storage.clearDataForOrigin", {
+            "origin": origin or config.BASE_URL,
+            "storageTypes": "local_storage,session_storage,indexeddb,cache_storage,service_workers",
+        })
+        driver.get("about:blank")
+        return True
+    except Exception as e:
+        logging.error(f"Failed to reset browser session: {e}")
+        return False
+
+
+def empty_customer_cart(driver):
+    """
+    Empty the cart of the customer account the session logged in with, if any.
+
+    The account is the one log_in() stored as driver.customer_account.
+
+    Returns:
+        bool: False if the cart could not be emptied, True otherwise.
+    """
+    account = getattr(driver, "customer_account", None)
+    driver.customer_account = None
+    if account is None:
+        return True
+    try:
+        cart_seeding.replace_customer_cart([], account)
+        return True
+    except cart_seeding.CartSeedingError as e:
+        logging.warning(f"Failed to empty the cart of {account[0]}: {e}")
+        return False
+
+
+def open_context(driver):
+    """
+    Move a session into a fresh browser context.
+
+    The context is an incognito-style profile of the same Chrome with its own cookies,
+    cache and storage. It is opened as a new tab, which becomes the session's current
+    window; the session's original tab is left alone.
+
+    Args:
+        driver (WebDriver): The session to isolate.
+
+    Returns:
+        bool: True if the session now runs in a new context, False if contexts are unavailable.
+    """
+    try:
+        context_id = driver.execute_cdp_cmd("Target.createBrowserContext", {})["browserContextId"]
+        target_id = driver.execute_cdp_cmd("Target.createTarget", {
+            "url": "about:blank", "browserContextId": context_id,
+        })["targetId"]
+        # ChromeDriver's window handles are the DevTools target ids (formerly prefixed with "CDwindow-").
+        handle = next(handle for handle in driver.window_handles if handle.endswith(target_id))
+        driver.browser_context = (context_id, driver.current_window_handle)
+        driver.switch_to.window(handle)
+    except Exception as e:
+        logging.warning(f"Could not open a browser context, falling back to session resets: {e}")
+        return False
+
+    # Scripts registered for new documents belong to a tab, register them in the new one. The
+    # network filter (request blocking, traffic counts, forensics events) is attached to it too.
+    driver._magento_idle_observer = False
+    install_idle_observer(driver)
+    fast_profile.prepare_tab(driver, target_id)
+    page_performance.prepare_tab(driver)
+    return True
+
+
+def close_context(driver):
+    """
+    Dispose of the browser context opened by open_context(), with everything the test left in it.
+
+    Returns:
+        bool: True if the session is back on its original tab, False if it should be discarded.
+    """
+    context_id, base_handle = driver.browser_context
+    driver.browser_context = None
+    fast_profile.release_tab(driver)
+    try:
+        driver.execute_cdp_cmd("Target.disposeBrowserContext", {"browserContextId": context_id})
+        driver.switch_to.window(base_handle)
+        driver._magento_idle_observer = False
+        return True
+    except Exception as e:
+        logging.error(f"Failed to close browser context: {e}")
+        return False
+
+
+def new_session():
+    """Start a session for the pool, taken from the warm-start spares with ORDER_WARM_START=on."""
+    if config.WARM_START == "on":
+        import browser_warmup
+        return browser_warmup.WARMER.take()
+    return start_chrome()
+
+
+def expect_tests(count):
+    """Tell the warm-start spares how many tests are queued (no-op unless ORDER_WARM_START=on)."""
+    if config.WARM_START == "on":
+        import browser_warmup
+        browser_warmup.WARMER.expect(count)
+
+
+def session_acquired():
+    """Count a queued test down in the warm-start spares (no-op unless ORDER_WARM_START=on)."""
+    if config.WARM_START == "on":
+        import browser_warmup
+        browser_warmup.WARMER.acquired()
+
+
+def session_needed():
+    """Have a warm-start spare started for the pool's next acquire (no-op unless ORDER_WARM_START=on)."""
+    if config.WARM_START == "on":
+        import browser_warmup
+        browser_warmup.WARMER.need()
+
+
+def quit_quietly(driver):
+    """Quit a session, ignoring errors from browsers that already crashed."""
+    try:
+        fast_profile.release_tab(driver)
+        if getattr(driver, "network_filter", None) is not None:
+            driver.network_filter.stop()
+        driver.quit()
+    except Exception as e:
+        logging.warning(f"Failed to quit browser session cleanly: {e}")
+    browser_resources.detach(driver)
+    # Sessions started on a clone of the profile template own their profile directory.
+    if getattr(driver, "profile_dir", None):
+        shutil.rmtree(os.path.dirname(driver.profile_dir), ignore_errors=True)
+
+
+class SessionPool:
+    """
+    A pool of already-running Chrome sessions shared between the test classes.
+
+    Sessions are handed out with acquire() and given back with release(). A released
+    session is reset before it is kept for reuse, and every session is health-checked
+    before it is handed out again, so crashed browsers are replaced transparently.
+
+    With isolation="context" every acquire() also opens a fresh browser context in the
+    session and release() disposes of it, so each test gets its own cookies and storage
+    without a browser restart or a reset of the session.
+
+    A released session that crossed the resource thresholds of browser_resources.py
+    (memory, JS heap, DOM nodes, slowdown) is quit and replaced by a new one.
+    """
+
+    def __init__(self, max_idle=2, origin=None, driver_factory=new_session, isolation=None):
+        self.max_idle = max_idle
+        self.origin = origin
+        self.driver_factory = driver_factory
+        self.isolation = isolation or config.ISOLATION
+        self._idle = []
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.replaced = 0
+        self.contexts = 0
+        self.recycled = 0
+
+    def _hand_out(self, driver):
+        browser_resources.bind(driver)
+        if self.isolation == "context" and open_context(driver):
+            self.contexts += 1
+        return driver
+
+    def acquire(self):
+        """
+        Hand out a healthy browser session, starting a new one only if none is idle.
+
+        Returns:
+            WebDriver: A clean browser session.
+        """
+        session_acquired()
+        while True:
+            with self._lock:
+                driver = self._idle.pop() if self._idle else None
+            if driver is None:
+                break
+            if is_session_healthy(driver):
+                self.reused += 1
+                return self._hand_out(driver)
+            logging.warning("Replacing crashed browser session.")
+            self.replaced += 1
+            quit_quietly(driver)
+
+        self.created += 1
+        return self._hand_out(self.driver_factory())
+
+    def release(self, driver, discard=False):
+        """
+        Give a browser session back to the pool.
+
+        The cart of the customer account the session logged in with is emptied first.
+
+        Args:
+            driver (WebDriver): The session returned by acquire().
+            discard (bool): Quit the session instead of keeping it for reuse.
+        """
+        # The customer cart outlives the browser session, empty it whatever becomes of the session.
+        empty_customer_cart(driver)
+        reason = None if discard else browser_resources.recycle_reason(driver)
+        if reason is not None:
+            logging.info(f"Recycling browser session: {reason}.")
+            self.recycled += 1
+            discard = True
+        if getattr(driver, "browser_context", None) and not discard:
+            # Everything the test did lived in its context, the original tab is still clean.
+            clean = close_context(driver)
+        else:
+            clean = not discard and reset_session(driver, self.origin)
+        if not clean:
+            quit_quietly(driver)
+            with self._lock:
+                exhausted = not self._idle
+            if exhausted:
+                # The next acquire will start a session, have it started ahead.
+                session_needed()
+            return
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append(driver)
+                return
+        quit_quietly(driver)
+
+    def close(self):
+        """Quit every idle session held by the pool."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for driver in idle:
+            quit_quietly(driver)
+        logging.info(f"Session pool closed: {self.created} started, {self.reused} reused, {self.replaced} replaced, "
+                     f"{self.recycled} recycled, {self.contexts} browser contexts opened.")
+
+
+SESSION_POOL = SessionPool()
+atexit.register(SESSION_POOL.close)
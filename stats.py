@@ -0,0 +1,11 @@
+"""
+Statistics shared by the reports of the suite (benchmark, page performance, load generator).
+"""
+import math
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
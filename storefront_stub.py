@@ -0,0 +1,909 @@
+"""
+Local stand-in for the Magento demo storefront.
+
+It serves every page the suite touches (home, search results, product pages with
+size/color swatches, minicart, cart, checkout shipping/payment, login/logout and the
+discount code flow) with the same element ids, names and classes as the real store,
+and keeps customers, carts and orders in memory. Pages load in milliseconds and the
+suite runs offline.
+
+Usage:
+    python storefront_stub.py --port 8080
+    MAGENTO_BASE_URL=http://127.0.0.1:8080 python test_order_process.py
+
+or let the suite start it in-process with ORDER_STOREFRONT=local.
+"""
+import argparse
+import html
+import itertools
+import json
+import logging
+import re
+import secrets
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import config
+
+
+SIZE_ATTRIBUTE_ID = 143
+COLOR_ATTRIBUTE_ID = 93
+SIZE_OPTION_IDS = {"XS": 166, "S": 167, "M": 168, "L": 169, "XL": 170,
+                   "28": 171, "29": 172, "30": 173, "31": 174, "32": 175}
+COLOR_OPTION_IDS = {"Black": 49, "Blue": 50, "Gray": 52, "Green": 53, "Orange": 56, "Red": 58, "White": 59}
+
+PRODUCTS = [
+    {"id": 1, "sku": "MJ12", "name": "Proteus Fitness Jackshirt", "url_key": "proteus-fitness-jackshirt",
+     "price": 45.0, "sizes": ["XS", "S", "M", "L", "XL"], "colors": ["Black", "Blue", "Orange"]},
+    {"id": 2, "sku": "24-WB07", "name": "Overnight Duffle", "url_key": "overnight-duffle",
+     "price": 45.0, "sizes": [], "colors": []},
+    {"id": 3, "sku": "WSH11", "name": "Ina Compression Short", "url_key": "ina-compression-short",
+     "price": 49.0, "sizes": ["28", "29", "30", "31", "32"], "colors": ["Blue", "Orange", "Red"]},
+    {"id": 4, "sku": "MJ01", "name": "Beaumont Summit Kit", "url_key": "beaumont-summit-kit",
+     "price": 42.0, "sizes": ["XS", "S", "M", "L", "XL"], "colors": ["Orange", "Red", "Gray"]},
+    {"id": 5, "sku": "24-MB01", "name": "Joust Duffle Bag", "url_key": "joust-duffle-bag",
+     "price": 34.0, "sizes": [], "colors": []},
+    {"id": 6, "sku": "WS12", "name": "Radiant Tee", "url_key": "radiant-tee",
+     "price": 22.0, "sizes": ["XS", "S", "M", "L", "XL"], "colors": ["Blue", "Orange", "White"]},
+]
+
+COUNTRIES = {
+    "US": ("United States", {"1": "Alabama", "2": "Alaska", "12": "California", "43": "New York", "57": "Texas"}),
+    "RO": ("Romania", {"278": "Alba", "279": "Arad", "280": "Arges", "287": "Bucuresti", "300": "Iasi"}),
+    "DE": ("Germany", {"79": "Berlin", "80": "Brandenburg", "82": "Hamburg", "88": "Bayern"}),
+}
+
+SHIPPING_METHODS = {"flatrate_flatrate": ("Flat Rate", 5.0), "tablerate_bestway": ("Best Way", 15.0)}
+COUPONS = {"20poff": 0.20}
+
+ADDRESS_FIELDS = ["firstname", "lastname", "company", "street[0]", "street[1]", "street[2]",
+                  "city", "postcode", "telephone", "country_id", "region_id"]
+REQUIRED_ADDRESS_FIELDS = ["firstname", "lastname", "street[0]", "city", "postcode", "telephone", "country_id"]
+
+
+class StorefrontState:
+    """In-memory customers, sessions, carts and orders of the stand-in storefront."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.products = {product["id"]: product for product in PRODUCTS}
+        self.customers = {}
+        self.sessions = {}
+        self.carts = {}
+        self.customer_carts = {}
+        self.orders = []
+        self.tokens = {}
+        self._ids = itertools.count(1)
+        for email, password, name in config.load_accounts():
+            firstname, _, lastname = name.partition(" ")
+            self.add_customer(email, password, firstname, lastname)
+
+    def add_customer(self, email, password, firstname, lastname):
+        self.customers[email] = {
+            "email": email, "password": password, "firstname": firstname, "lastname": lastname,
+            "address": {"firstname": firstname, "lastname": lastname, "company": "", "street[0]": "Main Street 1",
+                        "street[1]": "", "street[2]": "", "city": "Bucuresti", "postcode": "010011",
+                        "telephone": "0700000000", "country_id": "RO", "region_id": "287"},
+        }
+
+    def next_id(self):
+        return next(self._ids)
+
+    def session(self, session_id):
+        """Return the session for a cookie value, creating a new one when it is unknown."""
+        with self.lock:
+            if session_id not in self.sessions:
+                session_id = secrets.token_hex(16)
+                self.sessions[session_id] = {"customer": None, "cart": None, "messages": []}
+            return session_id, self.sessions[session_id]
+
+    def new_cart(self, customer=None):
+        cart_id = secrets.token_hex(16)
+        self.carts[cart_id] = {"id": cart_id, "items": [], "coupon": None, "customer": customer,
+                               "email": customer, "address": None, "shipping_method": None, "payment_method": None}
+        return self.carts[cart_id]
+
+    def cart(self, session, create=False):
+        """Return the active cart of a session: the customer's cart when logged in, the guest cart otherwise."""
+        with self.lock:
+            if session["customer"]:
+                cart_id = self.customer_carts.get(session["customer"])
+                if cart_id is None and create:
+                    cart_id = self.new_cart(session["customer"])["id"]
+                    self.customer_carts[session["customer"]] = cart_id
+            else:
+                cart_id = session["cart"]
+                if cart_id is None and create:
+                    cart_id = session["cart"] = self.new_cart()["id"]
+            return self.carts.get(cart_id)
+
+    def log_in(self, session, email, password):
+        """Log a session in, merging its guest cart into the customer's cart like Magento does."""
+        with self.lock:
+            customer = self.customers.get(email)
+            if customer is None or customer["password"] != password:
+                return False
+            guest_cart = self.carts.get(session["cart"])
+            session["customer"] = email
+            session["cart"] = None
+            if guest_cart and guest_cart["items"]:
+                cart = self.cart(session, create=True)
+                for item in guest_cart["items"]:
+                    self.add_item(cart, self.products[item["product_id"]], item["qty"], item["size"], item["color"])
+            return True
+
+    def add_item(self, cart, product, qty, size=None, color=None):
+        """Add a product to a cart, increasing the quantity of an identical line if there is one."""
+        with self.lock:
+            for item in cart["items"]:
+                if (item["product_id"], item["size"], item["color"]) == (product["id"], size, color):
+                    item["qty"] += qty
+                    return item
+            sku = "-".join(part for part in (product["sku"], size, color) if part)
+            item = {"item_id": self.next_id(), "product_id": product["id"], "sku": sku, "name": product["name"],
+                    "qty": qty, "size": size, "color": color, "price": product["price"]}
+            cart["items"].append(item)
+            return item
+
+    def totals(self, cart):
+        subtotal = sum(item["price"] * item["qty"] for item in cart["items"])
+        discount = round(subtotal * COUPONS.get(cart["coupon"], 0), 2)
+        shipping = SHIPPING_METHODS[cart["shipping_method"]][1] * sum(i["qty"] for i in cart["items"]) \
+            if cart["shipping_method"] else 0.0
+        return {"subtotal": subtotal, "discount": discount, "shipping": shipping,
+                "grand_total": round(subtotal - discount + shipping, 2)}
+
+    def place_order(self, session, cart):
+        with self.lock:
+            order = {"increment_id": f"{len(self.orders) + 1:09d}", "email": cart["email"],
+                     "customer": cart["customer"], "items": [dict(item) for item in cart["items"]],
+                     "address": cart["address"], "shipping_method": cart["shipping_method"],
+                     "payment_method": cart["payment_method"], "coupon": cart["coupon"],
+                     "totals": self.totals(cart)}
+            self.orders.append(order)
+            if cart["customer"]:
+                self.customer_carts.pop(cart["customer"], None)
+            else:
+                session["cart"] = None
+            del self.carts[cart["id"]]
+            return order
+
+    def search(self, query):
+        words = query.lower().split()
+        return [product for product in PRODUCTS if all(word in product["name"].lower() for word in words)]
+
+    def product_by_url_key(self, url_key):
+        return next((product for product in PRODUCTS if product["url_key"] == url_key), None)
+
+    def product_by_sku(self, sku):
+        """
+        Resolve a simple product SKU such as "MJ12-XL-Orange" to its product and options.
+
+        Returns:
+            tuple: (product, size, color), or (None, None, None) if the SKU is unknown.
+        """
+        for product in PRODUCTS:
+            if sku == product["sku"] and not product["sizes"] and not product["colors"]:
+                return product, None, None
+            if sku.startswith(product["sku"] + "-"):
+                options = sku[len(product["sku"]) + 1:].split("-")
+                size = options[0] if product["sizes"] else None
+                color = options[-1] if product["colors"] else None
+                if size in product["sizes"] + [None] and color in product["colors"] + [None]:
+                    return product, size, color
+        return None, None, None
+
+
+SCRIPT = """
+function toggle(id) {
+    var element = document.getElementById(id);
+    element.style.display = element.style.display === 'none' ? 'block' : 'none';
+}
+document.addEventListener('click', function (event) {
+    if (event.target.closest('a.action.showcart')) { event.preventDefault(); toggle('minicart-content'); }
+    if (event.target.closest('.customer-name .action.switch')) { toggle('customer-menu'); }
+    var swatch = event.target.closest('.swatch-option');
+    if (swatch) {
+        var attribute = swatch.closest('.swatch-attribute');
+        attribute.querySelectorAll('.swatch-option.selected').forEach(function (s) { s.classList.remove('selected'); });
+        swatch.classList.add('selected');
+        attribute.querySelector('input.swatch-input').value = swatch.getAttribute('option-label');
+    }
+    var remove = event.target.closest('.action-delete');
+    if (remove) {
+        event.preventDefault();
+        var post = JSON.parse(remove.getAttribute('data-post'));
+        var form = document.createElement('form');
+        form.method = 'post';
+        form.action = post.action;
+        Object.keys(post.data).forEach(function (name) {
+            var input = document.createElement('input');
+            input.type = 'hidden'; input.name = name; input.value = post.data[name];
+            form.appendChild(input);
+        });
+        document.body.appendChild(form);
+        form.submit();
+    }
+});
+"""
+
+
+def e(value):
+    return html.escape(str(value), quote=True)
+
+
+class StorefrontHandler(BaseHTTPRequestHandler):
+    """Serves the stand-in storefront pages from the shared StorefrontState."""
+
+    state = None
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately; without TCP_NODELAY every keep-alive
+    # response waits for the client's delayed ACK (~40 ms).
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logging.debug("storefront: " + format % args)
+
+    # Request plumbing
+
+    def _begin(self):
+        parts = urlsplit(self.path)
+        self.route = "/" + parts.path.strip("/")
+        self.query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        cookies = dict(c.strip().split("=", 1) for c in self.headers.get("Cookie", "").split(";") if "=" in c)
+        self.session_id, self.session = self.state.session(cookies.get("PHPSESSID"))
+        self.form = {}
+        length = int(self.headers.get("Content-Length") or 0)
+        self.body = self.rfile.read(length) if length else b""
+
+    def _send(self, status, body, content_type="text/html; charset=UTF-8", headers=None):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Set-Cookie", f"PHPSESSID={self.session_id}; Path=/; HttpOnly")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def redirect(self, path):
+        self._send(302, "", headers={"Location": path})
+
+    def send_json(self, payload, status=200):
+        self._send(status, json.dumps(payload), "application/json")
+
+    def not_found(self):
+        self._send(404, self.page("404 Not Found", "<p>The page you requested was not found.</p>"))
+
+    def do_GET(self):
+        self._begin()
+        self.dispatch(GET_ROUTES)
+
+    def do_POST(self):
+        self._begin()
+        if "json" in self.headers.get("Content-Type", ""):
+            self.form = json.loads(self.body or b"{}")
+        else:
+            self.form = {key: values[0] for key, values in parse_qs(self.body.decode("utf-8")).items()}
+        self.dispatch(POST_ROUTES)
+
+    def do_PUT(self):
+        self._begin()
+        self.form = json.loads(self.body or b"{}")
+        self.dispatch({})
+
+    def do_DELETE(self):
+        self._begin()
+        self.dispatch({})
+
+    def dispatch(self, routes):
+        handler = routes.get(self.route)
+        if handler is not None:
+            return handler(self)
+        for (method, pattern), rest_handler in REST_ROUTES.items():
+            match = re.fullmatch(pattern, self.route)
+            if method == self.command and match:
+                return rest_handler(self, *match.groups())
+        if self.command == "GET" and self.route.endswith(".html"):
+            product = self.state.product_by_url_key(self.route[1:-len(".html")])
+            if product:
+                return self.product_page(product)
+        self.not_found()
+
+    # Page layout
+
+    def page(self, title, content):
+        customer = self.state.customers.get(self.session["customer"])
+        cart = self.state.cart(self.session)
+        count = sum(item["qty"] for item in cart["items"]) if cart else 0
+        messages = "".join(f'<div class="message {kind}"><div>{e(text)}</div></div>'
+                           for kind, text in self.session["messages"])
+        self.session["messages"] = []
+        if customer:
+            links = (f'<li class="greet welcome"><span class="logged-in">Welcome, '
+                     f'{e(customer["firstname"])} {e(customer["lastname"])}!</span></li>'
+                     '<li class="customer-welcome"><span class="customer-name">'
+                     '<button class="action switch" type="button">Change</button></span>'
+                     '<div id="customer-menu" class="customer-menu" style="display:none"><ul>'
+                     '<li class="authorization-link"><a href="/customer/account/logout/">Sign Out</a></li>'
+                     '</ul></div></li>')
+        else:
+            links = ('<li class="greet welcome"><span class="not-logged-in">Default welcome msg!</span></li>'
+                     '<li class="authorization-link"><a href="/customer/account/login/">Sign In</a></li>')
+        return f"""<!doctype html>
+<html><head><meta charset="utf-8"><title>{e(title)}</title></head>
+<body>
+<header class="page-header">
+  <div class="panel header"><ul class="header links">{links}</ul></div>
+  <div class="header content">
+    <a class="logo" href="/">Home</a>
+    <form id="search_mini_form" action="/catalogsearch/result/" method="get">
+      <input id="search" type="text" name="q" value="" placeholder="Search entire store here...">
+    </form>
+    <div class="minicart-wrapper">
+      <a class="action showcart" href="/checkout/cart/">
+        <span class="counter qty"><span class="counter-number">{count or ""}</span></span>
+      </a>
+      <div id="minicart-content" class="block block-minicart" style="display:none">
+        <span class="count">{count}</span>
+        <button id="top-cart-btn-checkout" type="button" class="action primary checkout"
+                onclick="location.href='/checkout/'">Proceed to Checkout</button>
+        <a class="action viewcart" href="/checkout/cart/">View and Edit Cart</a>
+      </div>
+    </div>
+  </div>
+</header>
+<main id="maincontent" class="page-main">
+  <h1 class="page-title"><span class="base" data-ui-id="page-title-wrapper">{e(title)}</span></h1>
+  <div class="page messages">{messages}</div>
+  {content}
+</main>
+<script>{SCRIPT}</script>
+</body></html>"""
+
+    # GET pages
+
+    def home_page(self):
+        items = "".join(self.product_tile(product) for product in PRODUCTS[:4])
+        self._send(200, self.page("Home Page", f'<ol class="product-items">{items}</ol>'))
+
+    def product_tile(self, product):
+        link = f"/{product['url_key']}.html"
+        return (f'<li class="item product product-item"><div class="product-item-info" '
+                f'onclick="location.href=\'{link}\'"><strong class="product name product-item-name">'
+                f'<a class="product-item-link" href="{link}">{e(product["name"])}</a></strong>'
+                f'<span class="price">${product["price"]:.2f}</span></div></li>')
+
+    def search_page(self):
+        query = self.query.get("q", "")
+        results = self.state.search(query)
+        if results:
+            content = f'<ol class="products list items product-items">{"".join(map(self.product_tile, results))}</ol>'
+        else:
+            content = '<div class="message notice"><div>Your search returned no results.</div></div>'
+        self._send(200, self.page(f"Search results for: '{query}'", content))
+
+    def product_page(self, product):
+        swatches = ""
+        for code, attribute_id, values, option_ids, kind in (
+                ("size", SIZE_ATTRIBUTE_ID, product["sizes"], SIZE_OPTION_IDS, "text"),
+                ("color", COLOR_ATTRIBUTE_ID, product["colors"], COLOR_OPTION_IDS, "color")):
+            if not values:
+                continue
+            options = "".join(
+                f'<div class="swatch-option {kind}" option-id="{option_ids[value]}" option-label="{e(value)}" '
+                f'aria-label="{e(value)}">{e(value) if kind == "text" else ""}</div>' for value in values)
+            swatches += (f'<div class="swatch-attribute {code}" attribute-code="{code}" attribute-id="{attribute_id}">'
+                         f'<span class="swatch-attribute-label">{code.title()}</span>'
+                         f'<div class="swatch-attribute-options clearfix">{options}</div>'
+                         f'<input class="swatch-input" type="hidden" name="{code}" value=""></div>')
+        content = f"""
+<div class="product-info-main">
+  <div class="product-info-price"><span class="price">${product["price"]:.2f}</span></div>
+  <div class="product-info-stock-sku"><div class="product attribute sku">
+    <strong class="type">SKU</strong><div class="value" itemprop="sku">{e(product["sku"])}</div>
+  </div></div>
+  <form id="product_addtocart_form" method="post" action="/checkout/cart/add/">
+    <input type="hidden" name="product" value="{product["id"]}">
+    <div class="swatch-opt">{swatches}</div>
+    <div class="field qty"><label for="qty">Qty</label>
+      <input type="number" name="qty" id="qty" value="1" min="0" title="Qty" class="input-text qty"></div>
+    <button type="submit" title="Add to Cart" class="action primary tocart" id="product-addtocart-button">
+      <span>Add to Cart</span></button>
+  </form>
+</div>"""
+        self._send(200, self.page(product["name"], content))
+
+    def cart_page(self):
+        cart = self.state.cart(self.session)
+        if not cart or not cart["items"]:
+            return self._send(200, self.page("Shopping Cart", '<div class="cart-empty">'
+                                             '<p>You have no items in your shopping cart.</p></div>'))
+        rows = ""
+        for item in cart["items"]:
+            options = "".join(f"<dt>{label}</dt><dd>{e(item[key])}</dd>"
+                              for label, key in (("Size", "size"), ("Color", "color")) if item[key])
+            post = json.dumps({"action": "/checkout/cart/delete/", "data": {"id": str(item["item_id"])}})
+            rows += f"""
+<tbody class="cart item">
+  <tr class="item-info" data-item-id="{item["item_id"]}" data-sku="{e(item["sku"])}">
+    <td class="col item"><strong class="product-item-name"><a href="#">{e(item["name"])}</a></strong>
+      <dl class="item-options">{options}</dl></td>
+    <td class="col price"><span class="price">${item["price"]:.2f}</span></td>
+    <td class="col qty"><input name="cart[{item["item_id"]}][qty]" value="{item["qty"]}" type="number"
+        class="input-text qty" data-role="cart-item-qty"></td>
+    <td class="col subtotal"><span class="price">${item["price"] * item["qty"]:.2f}</span></td>
+  </tr>
+  <tr class="item-actions"><td colspan="4"><div class="actions-toolbar">
+    <a href="#" title="Remove item" class="action action-delete" data-post='{e(post)}'><span>Remove item</span></a>
+  </div></td></tr>
+</tbody>"""
+        totals = self.state.totals(cart)
+        content = f"""
+<form action="/checkout/cart/updatePost/" method="post" id="form-validate" class="form form-cart">
+  <table id="shopping-cart-table" class="cart items data table">{rows}</table>
+  <div class="cart main actions">
+    <button type="submit" name="update_cart_action" value="empty_cart" class="action clear" id="empty_cart_button">
+      <span>Clear Shopping Cart</span></button>
+    <button type="submit" name="update_cart_action" value="update_qty" title="Update Shopping Cart"
+            class="action update"><span>Update Shopping Cart</span></button>
+  </div>
+</form>
+<div class="cart-summary"><span class="grand-total">${totals["grand_total"]:.2f}</span>
+  <button type="button" class="action primary checkout" onclick="location.href='/checkout/'">
+    <span>Proceed to Checkout</span></button></div>"""
+        self._send(200, self.page("Shopping Cart", content))
+
+    def checkout_page(self):
+        cart = self.state.cart(self.session)
+        if not cart or not cart["items"]:
+            return self.redirect("/checkout/cart/")
+        customer = self.state.customers.get(self.session["customer"])
+        if customer:
+            address = customer["address"]
+            shipping_address = (f'<div class="shipping-address-item selected-item">{e(address["firstname"])} '
+                                f'{e(address["lastname"])}<br>{e(address["street[0]"])}<br>{e(address["city"])}</div>')
+        else:
+            fields = '<div class="field required"><label for="customer-email">Email Address</label>' \
+                     '<input type="email" id="customer-email" name="username" form="co-shipping-method-form"></div>'
+            for name in ADDRESS_FIELDS:
+                if name in ("country_id", "region_id"):
+                    continue
+                fields += (f'<div class="field" name="shippingAddress.{name}"><label>{name}</label>'
+                           f'<input class="input-text" type="text" name="{name}" form="co-shipping-method-form"></div>')
+            countries = "".join(f'<option value="{code}">{e(name)}</option>' for code, (name, _) in COUNTRIES.items())
+            regions = json.dumps({code: regions for code, (_, regions) in COUNTRIES.items()})
+            fields += f"""
+<div class="field"><label>Country</label>
+  <select name="country_id" form="co-shipping-method-form" class="select">{countries}</select></div>
+<div class="field"><label>State/Province</label>
+  <select name="region_id" form="co-shipping-method-form" class="select"></select></div>
+<script>
+(function () {{
+    var regions = {regions};
+    var country = document.querySelector("select[name='country_id']");
+    var region = document.querySelector("select[name='region_id']");
+    function fill() {{
+        region.innerHTML = '<option value="">Please select a region, state or province.</option>';
+        Object.keys(regions[country.value] || {{}}).forEach(function (id) {{
+            var option = document.createElement('option');
+            option.value = id; option.textContent = regions[country.value][id];
+            region.appendChild(option);
+        }});
+    }}
+    country.addEventListener('change', fill);
+    fill();
+}})();
+</script>"""
+            shipping_address = f'<form class="form form-shipping-address" id="co-shipping-form">{fields}</form>'
+        methods = "".join(
+            f'<tr class="row"><td class="col col-method"><input type="radio" class="radio" name="shipping_method" '
+            f'value="{code}" form="co-shipping-method-form"></td><td class="col col-price">${price:.2f}</td>'
+            f'<td class="col col-carrier">{e(title)}</td></tr>' for code, (title, price) in SHIPPING_METHODS.items())
+        content = f"""
+<div id="checkout" class="checkout-container">
+  <div id="shipping" class="checkout-shipping-address">{shipping_address}</div>
+  <div id="opc-shipping_method" class="checkout-shipping-method">
+    <form id="co-shipping-method-form" class="form methods-shipping" method="post"
+          action="/checkout/shipping-information/" novalidate>
+      <table class="table-checkout-shipping-method"><tbody>{methods}</tbody></table>
+      <div class="actions-toolbar" id="shipping-method-buttons-container">
+        <button type="submit" class="button action continue primary"><span>Next</span></button></div>
+    </form>
+  </div>
+</div>"""
+        self._send(200, self.page("Checkout", content))
+
+    def payment_page(self):
+        cart = self.state.cart(self.session)
+        if not cart or not cart["items"] or not cart["address"]:
+            return self.redirect("/checkout/")
+        totals = self.state.totals(cart)
+        coupon = cart["coupon"] or ""
+        content = f"""
+<div id="checkout" class="checkout-container">
+  <div id="payment" class="checkout-payment-method">
+    <form id="co-payment-form" class="form payments" method="post" action="/checkout/payment-information/">
+      <div class="payment-method"><input type="radio" name="payment[method]" value="checkmo" id="checkmo" checked>
+        <label for="checkmo">Check / Money order</label></div>
+    </form>
+    <div class="payment-option discount-code">
+      <div class="payment-option-title field choice" id="block-discount-heading" role="heading"
+           onclick="toggle('discount-content')"><span class="action action-toggle">Apply Discount Code</span></div>
+      <div class="payment-option-content" id="discount-content" style="display:none">
+        <form class="form form-discount" id="discount-form" onsubmit="return applyCoupon(event)">
+          <input class="input-text" type="text" id="discount-code" name="discount_code" value="{e(coupon)}">
+          <div class="actions-toolbar">
+            <button class="action action-apply" type="submit" style="{'display:none' if coupon else ''}">
+              <span><span>Apply Discount</span></span></button>
+            <button class="action action-cancel" type="button" style="{'' if coupon else 'display:none'}"
+                    onclick="cancelCoupon()"><span><span>Cancel coupon</span></span></button>
+          </div>
+        </form>
+      </div>
+    </div>
+  </div>
+  <div class="opc-block-summary"><span class="price discount">-${totals["discount"]:.2f}</span>
+    <span class="grand-total">${totals["grand_total"]:.2f}</span></div>
+</div>
+<script>
+function setCoupon(code, remove) {{
+    return fetch('/checkout/coupon/', {{method: 'POST', headers: {{'Content-Type': 'application/json'}},
+        body: JSON.stringify({{code: code, remove: remove}})}}).then(function (r) {{ return r.json(); }})
+        .then(function (result) {{
+            document.querySelector('.action-apply').style.display = result.coupon ? 'none' : '';
+            document.querySelector('.action-cancel').style.display = result.coupon ? '' : 'none';
+            document.getElementById('discount-code').value = result.coupon || '';
+            document.querySelector('.price.discount').textContent = '-$' + result.totals.discount.toFixed(2);
+            document.querySelector('.grand-total').textContent = '$' + result.totals.grand_total.toFixed(2);
+        }});
+}}
+function applyCoupon(event) {{ event.preventDefault(); setCoupon(document.getElementById('discount-code').value, false); return false; }}
+function cancelCoupon() {{ setCoupon('', true); }}
+</script>"""
+        self._send(200, self.page("Checkout", content))
+
+    def review_page(self):
+        cart = self.state.cart(self.session)
+        if not cart or not cart["payment_method"]:
+            return self.redirect("/checkout/payment/")
+        content = """
+<form id="place-order-form" method="post" action="/checkout/place-order/">
+  <div class="actions-toolbar"><button type="submit" class="action primary checkout" title="Place Order">
+    <span>Place Order</span></button></div>
+</form>"""
+        self._send(200, self.page("Checkout", content))
+
+    def success_page(self):
+        order = self.session.get("last_order")
+        content = (f'<div class="checkout-success"><p>Your order # is: <span>{e(order)}</span>.</p></div>'
+                   if order else "")
+        self._send(200, self.page("Thank you for your purchase!", content))
+
+    def login_page(self):
+        content = """
+<form class="form form-login" action="/customer/account/loginPost/" method="post" id="login-form">
+  <div class="field email required"><label for="email">Email</label>
+    <input name="login[username]" type="email" id="email" class="input-text"></div>
+  <div class="field password required"><label for="pass">Password</label>
+    <input name="login[password]" type="password" id="pass" class="input-text"></div>
+  <div class="actions-toolbar"><button type="submit" class="action login primary" name="send" id="send2">
+    <span>Sign In</span></button></div>
+</form>"""
+        self._send(200, self.page("Customer Login", content))
+
+    def account_page(self):
+        if not self.session["customer"]:
+            return self.redirect("/customer/account/login/")
+        self._send(200, self.page("My Account", '<div class="block block-dashboard-info"></div>'))
+
+    def logout(self):
+        self.session["customer"] = None
+        self.session["cart"] = None
+        self.redirect("/customer/account/logoutSuccess/")
+
+    def logout_success_page(self):
+        self._send(200, self.page("You are signed out", "<p>You have signed out.</p>"))
+
+    # POST actions
+
+    def add_to_cart(self):
+        product = self.state.products.get(int(self.form.get("product", 0)))
+        if product is None:
+            return self.not_found()
+        back = f"/{product['url_key']}.html"
+        size, color = self.form.get("size") or None, self.form.get("color") or None
+        if (product["sizes"] and size not in product["sizes"]) or (product["colors"] and color not in product["colors"]):
+            self.session["messages"].append(("error", "You need to choose options for your item."))
+            return self.redirect(back)
+        qty = int(float(self.form.get("qty") or 1))
+        self.state.add_item(self.state.cart(self.session, create=True), product, qty, size, color)
+        self.session["messages"].append(("success", f"You added {product['name']} to your shopping cart."))
+        self.redirect(back)
+
+    def delete_from_cart(self):
+        cart = self.state.cart(self.session)
+        if cart:
+            with self.state.lock:
+                cart["items"] = [item for item in cart["items"] if str(item["item_id"]) != self.form.get("id")]
+        self.redirect("/checkout/cart/")
+
+    def update_cart(self):
+        cart = self.state.cart(self.session)
+        if cart:
+            with self.state.lock:
+                if self.form.get("update_cart_action") == "empty_cart":
+                    cart["items"] = []
+                for item in list(cart["items"]):
+                    qty = self.form.get(f"cart[{item['item_id']}][qty]")
+                    if qty is None:
+                        continue
+                    if float(qty) <= 0:
+                        cart["items"].remove(item)
+                    else:
+                        item["qty"] = int(float(qty))
+        self.redirect("/checkout/cart/")
+
+    def save_shipping_information(self):
+        cart = self.state.cart(self.session)
+        if not cart or not cart["items"]:
+            return self.redirect("/checkout/cart/")
+        customer = self.state.customers.get(self.session["customer"])
+        if customer:
+            address, email = customer["address"], customer["email"]
+        else:
+            address, email = {name: self.form.get(name, "") for name in ADDRESS_FIELDS}, self.form.get("username", "")
+            missing = [name for name in REQUIRED_ADDRESS_FIELDS if not address[name]] + ([] if email else ["email"])
+            if missing:
+                self.session["messages"].append(("error", f"Required fields are missing: {', '.join(missing)}."))
+                return self.redirect("/checkout/")
+        with self.state.lock:
+            cart["address"], cart["email"] = address, email
+            cart["shipping_method"] = self.form.get("shipping_method") or next(iter(SHIPPING_METHODS))
+        self.redirect("/checkout/payment/")
+
+    def save_payment_information(self):
+        cart = self.state.cart(self.session)
+        if not cart or not cart["address"]:
+            return self.redirect("/checkout/")
+        cart["payment_method"] = self.form.get("payment[method]", "checkmo")
+        self.redirect("/checkout/review/")
+
+    def place_order(self):
+        cart = self.state.cart(self.session)
+        if not cart or not cart["payment_method"]:
+            return self.redirect("/checkout/")
+        order = self.state.place_order(self.session, cart)
+        self.session["last_order"] = order["increment_id"]
+        self.redirect("/checkout/onepage/success/")
+
+    def coupon(self):
+        cart = self.state.cart(self.session)
+        if not cart:
+            return self.send_json({"message": "The cart is empty."}, 400)
+        if self.form.get("remove"):
+            cart["coupon"] = None
+        elif self.form.get("code") in COUPONS:
+            cart["coupon"] = self.form["code"]
+        else:
+            return self.send_json({"message": f"The coupon code \"{self.form.get('code')}\" is not valid.",
+                                   "coupon": cart["coupon"], "totals": self.state.totals(cart)}, 400)
+        self.send_json({"coupon": cart["coupon"], "totals": self.state.totals(cart)})
+
+    def login_post(self):
+        if self.state.log_in(self.session, self.form.get("login[username]"), self.form.get("login[password]")):
+            return self.redirect("/customer/account/")
+        self.session["messages"].append(("error", "The account sign-in was incorrect or your account is disabled "
+                                                  "temporarily. Please wait and try again later."))
+        self.redirect("/customer/account/login/")
+
+
+    # Magento-compatible REST API (the subset used for cart seeding and load_generator.py)
+
+    def rest_error(self, message, status=400):
+        self.send_json({"message": message}, status)
+
+    def rest_customer(self):
+        token = self.headers.get("Authorization", "").replace("Bearer ", "", 1)
+        return self.state.tokens.get(token)
+
+    def rest_customer_token(self):
+        customer = self.state.customers.get(self.form.get("username"))
+        if customer is None or customer["password"] != self.form.get("password"):
+            return self.rest_error("The account sign-in was incorrect or your account is disabled temporarily.", 401)
+        token = secrets.token_hex(16)
+        self.state.tokens[token] = customer["email"]
+        self.send_json(token)
+
+    def rest_cart(self, cart_id):
+        """Return the cart addressed by a REST route: "mine" for the token's customer, a masked id for guests."""
+        if cart_id == "mine":
+            email = self.rest_customer()
+            return self.state.cart({"customer": email, "cart": None}, create=True) if email else None
+        cart = self.state.carts.get(cart_id)
+        return cart if cart and not cart["customer"] else None
+
+    def rest_cart_not_found(self, cart_id):
+        if cart_id == "mine":
+            return self.rest_error("The consumer isn't authorized to access %resources.", 401)
+        self.rest_error(f"No such entity with cartId = {cart_id}", 404)
+
+    def rest_create_cart(self, cart_id=None):
+        if cart_id == "mine":
+            cart = self.rest_cart("mine")
+            if cart is None:
+                return self.rest_cart_not_found("mine")
+            return self.send_json(cart["id"])
+        self.send_json(self.state.new_cart()["id"])
+
+    def rest_cart_items(self, cart_id):
+        cart = self.rest_cart(cart_id)
+        if cart is None:
+            return self.rest_cart_not_found(cart_id)
+        self.send_json([{"item_id": item["item_id"], "sku": item["sku"], "qty": item["qty"], "name": item["name"],
+                         "price": item["price"], "quote_id": cart["id"]} for item in cart["items"]])
+
+    def rest_add_cart_item(self, cart_id):
+        cart = self.rest_cart(cart_id)
+        if cart is None:
+            return self.rest_cart_not_found(cart_id)
+        cart_item = self.form.get("cartItem", {})
+        product, size, color = self.state.product_by_sku(cart_item.get("sku", ""))
+        if product is None:
+            return self.rest_error("The product that was requested doesn't exist. Verify the product and try again.", 404)
+        item = self.state.add_item(cart, product, int(cart_item.get("qty", 1)), size, color)
+        self.send_json({"item_id": item["item_id"], "sku": item["sku"], "qty": item["qty"], "name": item["name"],
+                        "price": item["price"], "quote_id": cart["id"]})
+
+    def rest_delete_cart_item(self, cart_id, item_id):
+        cart = self.rest_cart(cart_id)
+        if cart is None:
+            return self.rest_cart_not_found(cart_id)
+        with self.state.lock:
+            remaining = [item for item in cart["items"] if str(item["item_id"]) != item_id]
+            if len(remaining) == len(cart["items"]):
+                return self.rest_error(f"The {cart_id} Cart doesn't contain the {item_id} item.", 404)
+            cart["items"] = remaining
+        self.send_json(True)
+
+    def rest_shipping_information(self, cart_id):
+        cart = self.rest_cart(cart_id)
+        if cart is None:
+            return self.rest_cart_not_found(cart_id)
+        information = self.form.get("addressInformation", {})
+        address = dict(information.get("shipping_address") or {})
+        street = address.pop("street", None) or []
+        for index in range(3):
+            address[f"street[{index}]"] = street[index] if index < len(street) else ""
+        address = {name: str(address.get(name) or "") for name in ADDRESS_FIELDS}
+        missing = [name for name in REQUIRED_ADDRESS_FIELDS if not address[name]]
+        if missing:
+            return self.rest_error(f"Required fields are missing: {', '.join(missing)}.")
+        method = f"{information.get('shipping_carrier_code')}_{information.get('shipping_method_code')}"
+        if method not in SHIPPING_METHODS:
+            return self.rest_error("The shipping method is missing. Select the shipping method and try again.")
+        with self.state.lock:
+            cart["address"], cart["shipping_method"] = address, method
+            cart["email"] = cart["email"] or (information.get("shipping_address") or {}).get("email")
+        self.send_json({"payment_methods": [{"code": "checkmo", "title": "Check / Money order"}],
+                        "totals": self.state.totals(cart)})
+
+    def rest_apply_coupon(self, cart_id, code):
+        cart = self.rest_cart(cart_id)
+        if cart is None:
+            return self.rest_cart_not_found(cart_id)
+        if code not in COUPONS:
+            return self.rest_error("The coupon code isn't valid. Verify the code and try again.", 404)
+        cart["coupon"] = code
+        self.send_json(True)
+
+    def rest_set_payment_information(self, cart_id):
+        cart = self.rest_cart(cart_id)
+        if cart is None:
+            return self.rest_cart_not_found(cart_id)
+        if not cart["address"]:
+            return self.rest_error("The shipping address is missing. Set the address and try again.")
+        with self.state.lock:
+            cart["email"] = self.form.get("email") or cart["email"]
+            cart["payment_method"] = (self.form.get("paymentMethod") or {}).get("method", "checkmo")
+        self.send_json(True)
+
+    def rest_place_order(self, cart_id):
+        cart = self.rest_cart(cart_id)
+        if cart is None:
+            return self.rest_cart_not_found(cart_id)
+        if not cart["items"] or not cart["payment_method"] or not cart["email"]:
+            return self.rest_error("The cart is not ready to be ordered: it needs items, an email and a payment method.")
+        order = self.state.place_order({"cart": None}, cart)
+        self.send_json(order["increment_id"])
+
+    def adopt_guest_cart(self):
+        """Stand-in only: make a guest cart created over REST the cart of this browser session."""
+        cart = self.state.carts.get(self.query.get("cart_id"))
+        if cart is None or cart["customer"]:
+            return self.not_found()
+        self.session["cart"] = cart["id"]
+        self.redirect(self.query.get("return", "/checkout/cart/"))
+
+
+GET_ROUTES = {
+    "/": StorefrontHandler.home_page,
+    "/catalogsearch/result": StorefrontHandler.search_page,
+    "/checkout/cart": StorefrontHandler.cart_page,
+    "/checkout": StorefrontHandler.checkout_page,
+    "/checkout/payment": StorefrontHandler.payment_page,
+    "/checkout/review": StorefrontHandler.review_page,
+    "/checkout/onepage/success": StorefrontHandler.success_page,
+    "/customer/account/login": StorefrontHandler.login_page,
+    "/customer/account": StorefrontHandler.account_page,
+    "/customer/account/logout": StorefrontHandler.logout,
+    "/customer/account/logoutSuccess": StorefrontHandler.logout_success_page,
+    "/stub/guest-cart/adopt": StorefrontHandler.adopt_guest_cart,
+}
+
+POST_ROUTES = {
+    "/checkout/cart/add": StorefrontHandler.add_to_cart,
+    "/checkout/cart/delete": StorefrontHandler.delete_from_cart,
+    "/checkout/cart/updatePost": StorefrontHandler.update_cart,
+    "/checkout/shipping-information": StorefrontHandler.save_shipping_information,
+    "/checkout/payment-information": StorefrontHandler.save_payment_information,
+    "/checkout/place-order": StorefrontHandler.place_order,
+    "/checkout/coupon": StorefrontHandler.coupon,
+    "/customer/account/loginPost": StorefrontHandler.login_post,
+    "/rest/V1/integration/customer/token": StorefrontHandler.rest_customer_token,
+}
+
+REST_ROUTES = {
+    ("POST", r"/rest/V1/guest-carts"): StorefrontHandler.rest_create_cart,
+    ("POST", r"/rest/V1/carts/(mine)"): StorefrontHandler.rest_create_cart,
+    ("GET", r"/rest/V1/(?:guest-carts|carts)/([\w]+)/items"): StorefrontHandler.rest_cart_items,
+    ("POST", r"/rest/V1/(?:guest-carts|carts)/([\w]+)/items"): StorefrontHandler.rest_add_cart_item,
+    ("DELETE", r"/rest/V1/(?:guest-carts|carts)/([\w]+)/items/(\d+)"): StorefrontHandler.rest_delete_cart_item,
+    ("POST", r"/rest/V1/(?:guest-carts|carts)/([\w]+)/shipping-information"): StorefrontHandler.rest_shipping_information,
+    ("PUT", r"/rest/V1/(?:guest-carts|carts)/([\w]+)/coupons/([\w-]+)"): StorefrontHandler.rest_apply_coupon,
+    ("POST", r"/rest/V1/(?:guest-carts|carts)/([\w]+)/set-payment-information"):
+        StorefrontHandler.rest_set_payment_information,
+    ("PUT", r"/rest/V1/(?:guest-carts|carts)/([\w]+)/order"): StorefrontHandler.rest_place_order,
+}
+
+
+class StorefrontServer(ThreadingHTTPServer):
+    # The default backlog of 5 drops the connections a load test opens at once.
+    request_queue_size = 256
+    daemon_threads = True
+
+
+def start_local_storefront(host="127.0.0.1", port=0):
+    """
+    Start the stand-in storefront in a background thread and point config.BASE_URL at it.
+
+    Args:
+        host (str): The interface to listen on.
+        port (int): The port to listen on, 0 picks a free port.
+
+    Returns:
+        ThreadingHTTPServer: The running server, its state is available as server.state.
+    """
+    state = StorefrontState()
+    handler = type("BoundStorefrontHandler", (StorefrontHandler,), {"state": state})
+    server = StorefrontServer((host, port), handler)
+    server.state = state
+    threading.Thread(target=server.serve_forever, name="storefront-stub", daemon=True).start()
+    config.BASE_URL = f"http://{host}:{server.server_address[1]}"
+    logging.info(f"Local storefront running at {config.BASE_URL}")
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Magento demo storefront.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    state = StorefrontState()
+    handler = type("BoundStorefrontHandler", (StorefrontHandler,), {"state": state})
+    print(f"Serving the stand-in storefront on http://{args.host}:{args.port}/")
+    StorefrontServer((args.host, args.port), handler).serve_forever()
@@ -1,34 +1,67 @@
 import unittest
-from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import Select
-from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.keys import Keys
-from selenium.webdriver.support.ui import WebDriverWait
 
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import NoSuchElementException
-import time 
-import csv
+from selenium.common.exceptions import NoSuchElementException, TimeoutException
+import functools
 import logging
+import time
+
+import async_flows
+import auth_cache
+import browser_resources
+import config
+import element_checks
+import fast_profile
+import forensics
+import page_performance
+import replay_proxy
+import scenario_engine
+from instrumentation import WebDriverWait, start_test, timed_step
+from form_fill import bulk_fill, verify_values
+from cart_page import CartPageError, clear_cart, read_cart, remove_items
+from cart_seeding import (CartSeedingError, refresh_minicart, replace_customer_cart, seed_customer_cart,
+                          seed_guest_cart)
+from checkpoints import StepFlow
+from product_index import PRODUCT_INDEX, ProductIndexError, option_selector, pick_result
+from scenarios import iter_scenarios, load_order_details, load_scenario, scenario_ids
+from session_pool import SESSION_POOL, expect_tests
+from waits import wait_for_magento_idle
 # logging.basicConfig(level=logging.DEBUG,format='%(asctime)s - %(levelname)s - %(message)s')
 
 
+def setUpModule():
+    """
+    Start the bundled stand-in storefront when the suite runs with ORDER_STOREFRONT=local,
+    and the record/replay proxy in front of the storefront with ORDER_REPLAY=record|replay.
+    """
+    if config.STOREFRONT == "local":
+        import storefront_stub
+        storefront_stub.start_local_storefront()
+    if config.REPLAY != "off" and replay_proxy.PROXY is None:
+        replay_proxy.start_replay_proxy()
+
+
 class ElementsExistenceTests(unittest.TestCase):
     @classmethod
     def setUpClass(cls):
         """
-        Set up the WebDriver for the test class. This method initializes the Chrome WebDriver
-        with specified options and navigates to the target URL.
+        Set up the WebDriver for the test class. This method takes a browser session
+        from the shared session pool and navigates to the target URL.
         """
-        cls.service = Service()
-        cls.options = webdriver.ChromeOptions()
-        cls.options.add_argument("--no-sandbox")
-        cls.options.add_argument("--disable-webusb")
-        cls.options.add_argument("--log-level=1")
-        cls.options.add_experimental_option('excludeSwitches', ['enable-logging', 'enable-automation'])
-        cls.driver = webdriver.Chrome(service=cls.service, options=cls.options)
-        cls.driver.get("https://magento.softwaretestingboard.com/")
+        cls.driver = SESSION_POOL.acquire()
+        cls.driver.get(config.url())
+
+    def setUp(self):
+        span = start_test(self.id())
+        self.addCleanup(span.__exit__, None, None, None)
+
+    def tearDown(self):
+        if forensics.has_failed(self):
+            forensics.dump(self.driver, self.id())
+        replay_proxy.report_test(self.id())
 
     def test_search_box(self):
         """Test if the search box is present on the page."""
@@ -38,14 +71,27 @@ class ElementsExistenceTests(unittest.TestCase):
         """Test if the cart button is present on the page."""
         self.assertTrue(self.is_element_present(By.CLASS_NAME, "showcart"), "Cart button is not present on the page.")
 
+    def test_locator_manifest(self):
+        """Test every locator of locator_manifest.json, one subtest per page and locator."""
+        for page, checks in element_checks.check_manifest(SESSION_POOL).items():
+            for entry, result in checks:
+                with self.subTest(page=page, locator=entry["name"]):
+                    passed, found = element_checks.evaluate(entry, result)
+                    self.assertTrue(passed, f"Expected '{entry['name']}' ({entry['by']}={entry['value']}) to be "
+                                            f"{entry.get('expect', 'present')} on the {page} page: {found}.")
+
     @classmethod
     def tearDownClass(cls):
         """
-        Tear down the WebDriver after all tests have been run. This method quits the WebDriver,
-        closing all associated windows.
+        Tear down the WebDriver after all tests have been run. This method hands the
+        browser session back to the shared session pool, which resets it for reuse.
         """
-        cls.driver.quit()
+        fast_profile.report_test(cls.__name__, cls.driver)
+        page_performance.report_test(cls.__name__, cls.driver)
+        browser_resources.report_test(cls.__name__, cls.driver)
+        SESSION_POOL.release(cls.driver)
 
+    @timed_step
     def is_element_present(self, how, what):
         """
         Check if an element is present on the page.
@@ -64,38 +110,87 @@ class ElementsExistenceTests(unittest.TestCase):
             return False
 
 class TestOrderPlacementProcess(unittest.TestCase):
-    @classmethod
     def setUp(self):
-        self.service = Service()
-        self.options = webdriver.ChromeOptions()
-        self.options.add_argument("--no-sandbox")
-        self.options.add_argument("--disable-webusb")
-        self.options.add_argument("--log-level=1")
-        self.options.add_experimental_option('excludeSwitches', ['enable-logging', 'enable-automation'])
-        self.driver = webdriver.Chrome(service=self.service, options=self.options)
-
-        self.driver.get("https://magento.softwaretestingboard.com/")
+        span = start_test(self.id())
+        self.addCleanup(span.__exit__, None, None, None)
+        self.driver = SESSION_POOL.acquire()
+
+        self.driver.get(config.url())
     
-    @classmethod
     def tearDown(self):
-        self.driver.quit()
-
+        if forensics.has_failed(self):
+            forensics.dump(self.driver, self.id())
+        fast_profile.report_test(self.id(), self.driver)
+        page_performance.report_test(self.id(), self.driver)
+        browser_resources.report_test(self.id(), self.driver)
+        replay_proxy.report_test(self.id())
+        SESSION_POOL.release(self.driver)
+
+    @timed_step
     def search_item(self, item_name):
         search_field = self.driver.find_element(By.ID, "search")
         search_field.send_keys(item_name,Keys.ENTER)
         items = self.driver.find_elements(By.CLASS_NAME, "product-item-info")
         if items:
-            first_item = items[0]
-            first_item.click()
+            # The first result is not always the product searched for, click the one named like it.
+            names = [{"name": item.find_element(By.CSS_SELECTOR, "a.product-item-link").text} for item in items]
+            try:
+                match = items[names.index(pick_result(item_name, names))]
+            except ProductIndexError as e:
+                logging.warning(e)
+                match = items[0]
+            match.click()
             logging.info("itemfound")
         else:
             logging.info("item not found")
 
+    def open_product(self, item_name, size=None, color=None):
+        """
+        Open a product page from the product index and select its swatches by id.
+
+        A product whose page or swatches no longer match the index is dropped from it,
+        and the caller goes through the search instead.
 
+        Returns:
+            bool: True if the product page is open with the swatches selected, False otherwise.
+        """
+        if item_name in PRODUCT_INDEX.failed:
+            return False
+        try:
+            product = PRODUCT_INDEX.lookup(self.driver, item_name)
+        except ProductIndexError as e:
+            logging.warning(e)
+            return False
+        self.driver.get(config.url(product.path))
+        skus = self.driver.find_elements(By.CSS_SELECTOR, '[itemprop="sku"]')
+        if not skus or skus[0].text.strip() != product.sku:
+            PRODUCT_INDEX.invalidate(item_name)
+            return False
+        for code, value in (("size", size), ("color", color)):
+            if not value:
+                continue
+            attribute = product.attributes.get(code, {})
+            option_id = attribute.get("options", {}).get(str(value))
+            if option_id is not None:
+                try:
+                    WebDriverWait(self.driver, 10).until(EC.element_to_be_clickable(
+                        (By.CSS_SELECTOR, option_selector(attribute["attribute_id"], option_id)))).click()
+                    continue
+                except TimeoutException:
+                    pass
+            PRODUCT_INDEX.invalidate(item_name)
+            return False
+        return True
+
+
+    @timed_step
     def add_item_to_cart(self, item_name, quantity, size = None, color = None ):
         
-        self.search_item(item_name)
-        
+        if config.PRODUCT_NAVIGATION == "index" and self.open_product(item_name, size, color):
+            size = color = None
+        else:
+            self.search_item(item_name)
+
         if size:
             size_xpath = f"//div[@class='swatch-option text' and .//text()='{size}']"
             size_locator = self.driver.find_element(By.XPATH,size_xpath)
@@ -113,6 +208,41 @@ class TestOrderPlacementProcess(unittest.TestCase):
         add_to_card_button.click()
 
 
+    @timed_step
+    def seed_cart(self, items, replace=True):
+        """
+        Fill the logged-in customer's cart for tests where the cart is only a precondition.
+
+        With ORDER_CART_SEEDING=api (the default) the items are added through the REST API
+        and the current page is refreshed to pick the cart up; the UI path through
+        add_item_to_cart is used with ORDER_CART_SEEDING=ui or when the API is unavailable.
+
+        The customer's cart lives on the server and outlasts the browser session, so by
+        default it is made to hold exactly the given items: what earlier tests left in it,
+        or what a failed API call added, is removed first.
+
+        Args:
+            items (list): (item_name, quantity, size, color) tuples, as passed to add_item_to_cart.
+            replace (bool): Remove the items already in the cart; False adds to them.
+        """
+        if config.CART_SEEDING == "api":
+            try:
+                if replace:
+                    replace_customer_cart(items)
+                else:
+                    seed_customer_cart(items)
+                refresh_minicart(self.driver)
+                wait_for_magento_idle(self.driver)
+                return
+            except CartSeedingError as e:
+                logging.warning(f"Seeding the cart through the API failed, adding items through the UI: {e}")
+        if replace and not self.delete_all_cart_items():
+            raise CartPageError("The cart could not be emptied before seeding it.")
+        for item in items:
+            self.add_item_to_cart(*item)
+
+
+    @timed_step
     def fill_text_fields(self, by_strategy, locator_value, text):
         
         try:
@@ -125,23 +255,74 @@ class TestOrderPlacementProcess(unittest.TestCase):
             return False
 
 
-    def fill_order_details_for_no_login_user(self):
+    @timed_step
+    def bulk_fill_order_details(self, field_mappings, csv_dict, country="RO", region="279"):
+        """
+        Fills the order details, country and region included, in a single script execution
+        and reads them back in a second one.
+
+        Args:
+            field_mappings (dict): CSV key -> locator of the field.
+            csv_dict (dict): CSV key -> value.
+            country (str): Value of the country to select.
+            region (str): Value of the region to select.
+
+        Returns:
+            bool: True if every field holds its value, False otherwise.
+        """
+        fields = {}
+        for csv_key, locator in field_mappings.items():
+            if csv_key in csv_dict:
+                fields[csv_key] = (locator, csv_dict[csv_key])
+            else:
+                logging.warning(f"CSV key '{csv_key}' not found in the CSV data.")
+        fields["country_id"] = ((By.NAME, "country_id"), country)
+        fields["region_id"] = ((By.NAME, "region_id"), region)
+
+        results = bulk_fill(self.driver, fields)
+        if not results["region_id"]["ok"] and results["country_id"]["ok"]:
+            # The regions of the new country may be loaded asynchronously
+            wait_for_magento_idle(self.driver)
+            results.update(bulk_fill(self.driver, {"region_id": fields["region_id"]}))
+
+        failed = {key: result for key, result in results.items() if not result["ok"]}
+        if failed:
+            logging.error(f"Failed to fill order details: {failed}")
+            return False
+
+        mismatches = verify_values(self.driver, fields)
+        if mismatches:
+            logging.error(f"Order details did not keep their values (expected, actual): {mismatches}")
+            return False
+
+        logging.info("Order details, country and region filled successfully.")
+        return True
+
+    @timed_step
+    def fill_order_details_for_no_login_user(self, typed=False, details=None, country="RO", region="279"):
         """
         Fills in the order details for a user who is not logged in.
 
         This function reads user details from a CSV file and fills out the order form fields on the page.
         It also selects the appropriate country and region from dropdown menus.
+
+        Args:
+            typed (bool): Type every field through WebDriver instead of filling the form in bulk,
+                for tests that specifically need real keystrokes.
+            details (dict): The order details to fill, defaults to the contents of order_details.csv.
+            country (str): Value of the country to select.
+            region (str): Value of the region to select.
         """
 
-        # Wait for the page to load
-        time.sleep(3)
+        # Wait for the checkout page to finish rendering
+        wait_for_magento_idle(self.driver)
 
-        # Load the order details from the CSV file into a dictionary
+        # Load the order details from the CSV file into a dictionary (parsed once per run)
         csv_dict = {}
         try:
-            with open('order_details.csv', 'r') as csvfile:
-                csv_reader = csv.reader(csvfile)
-                csv_dict = {row[0]: row[1] for row in csv_reader}
+            csv_dict = dict(details) if details is not None else load_order_details()
+            if "customer-email" in csv_dict:
+                csv_dict["customer-email"] = config.guest_email(csv_dict["customer-email"])
             logging.info(f"Loaded order details from CSV: {csv_dict}")
         except FileNotFoundError:
             logging.error("The order_details.csv file was not found.")
@@ -164,6 +345,9 @@ class TestOrderPlacementProcess(unittest.TestCase):
             "telephone": (By.NAME, "telephone"),
         }
 
+        if not typed:
+            return self.bulk_fill_order_details(field_mappings, csv_dict, country, region)
+
         # Fill in the form fields using the field mappings
         for csv_key, locator in field_mappings.items():
             if csv_key in csv_dict:
@@ -177,7 +361,7 @@ class TestOrderPlacementProcess(unittest.TestCase):
                 EC.element_to_be_clickable((By.XPATH, "//select[@name='country_id']"))
             )
             select = Select(country_dropdown)
-            select.select_by_value("RO")
+            select.select_by_value(country)
             logging.info("Country selected successfully.")
         except Exception as e:
             logging.error(f"Failed to select country: {e}")
@@ -189,7 +373,7 @@ class TestOrderPlacementProcess(unittest.TestCase):
                 EC.element_to_be_clickable((By.XPATH, "//select[@name='region_id']"))
             )
             select = Select(region_dropdown)
-            select.select_by_value("279")
+            select.select_by_value(region)
             logging.info("Region selected successfully.")
         except Exception as e:
             logging.error(f"Failed to select region: {e}")
@@ -197,23 +381,52 @@ class TestOrderPlacementProcess(unittest.TestCase):
 
         return True
 
+    @timed_step
     def log_in(self):
-        self.driver.get("https://magento.softwaretestingboard.com/customer/account/login")
+        """
+        Logs the worker's customer account in.
+
+        A session cached by an earlier login of this worker is injected when it is still
+        valid; otherwise the login form is submitted and the new session is cached.
+        """
+        email, password, name = config.customer_account()
+        # The session pool empties the account's cart when the session is released.
+        self.driver.customer_account = (email, password, name)
+        if auth_cache.restore_session(self.driver, email):
+            return True
+
+        self.driver.get(config.url("customer/account/login"))
 
         WebDriverWait(self.driver,20).until(EC.element_to_be_clickable((By.ID, "email")))
         username_field = self.driver.find_element(By.ID, "email")
         password_field = self.driver.find_element(By.ID, "pass")
         
-        username_field.send_keys("test123@yahoo.com")
-        password_field.send_keys("Test123!")
+        username_field.send_keys(email)
+        password_field.send_keys(password)
         
         login_button = self.driver.find_element(By.ID, "send2")
         login_button.click()
+
+        try:
+            WebDriverWait(self.driver, 20).until(lambda driver: "customer/account/login" not in driver.current_url)
+            auth_cache.save_session(self.driver, email)
+        except Exception as e:
+            logging.error(f"Login did not complete, the session is not cached: {e}")
         
         return True
     
 
     
+    def test_idle_wait_on_idle_page(self):
+        """
+        Test that waiting for idle returns after the quiet period on a page that is already idle,
+        instead of running into the timeout.
+        """
+        self.driver.get("data:text/html,<title>Idle</title><p>Nothing loads on this page.</p>")
+        started = time.monotonic()
+        wait_for_magento_idle(self.driver, timeout=5)
+        self.assertLess(time.monotonic() - started, 2, "The idle wait did not return on an idle page.")
+
     def test_log_in(self):
         """
         Test the login functionality on the Magento software testing board.
@@ -227,24 +440,27 @@ class TestOrderPlacementProcess(unittest.TestCase):
         - The welcome message does not appear after attempting to log in.
         - The welcome message does not match the expected text.
         """
-        self.driver.get("https://magento.softwaretestingboard.com/customer/account/login")
+        self.driver.get(config.url("customer/account/login"))
 
         WebDriverWait(self.driver,20).until(EC.element_to_be_clickable((By.ID, "email")))
         username_field = self.driver.find_element(By.ID, "email")
         password_field = self.driver.find_element(By.ID, "pass")
         
-        username_field.send_keys("test123@yahoo.com")
-        password_field.send_keys("Test123!")
+        email, password, _ = config.customer_account()
+        username_field.send_keys(email)
+        password_field.send_keys(password)
         
         login_button = self.driver.find_element(By.ID, "send2")
         login_button.click()
         
         try:
             email_display = WebDriverWait(self.driver,20).until(EC.element_to_be_clickable((By.CLASS_NAME, "logged-in")))
-            self.assertEqual(email_display.text, "Welcome, Test Testing!", "Name not valid")
+            _, _, name = config.customer_account()
+            self.assertEqual(email_display.text, f"Welcome, {name}!", "Name not valid")
         except NoSuchElementException:
             self.fail("Failed to validate the login by seeing the welcome prompt (logged-in text).")
 
+    @timed_step
     def log_out(self):
         """
         Logs the user out from the Magento software testing board.
@@ -256,7 +472,7 @@ class TestOrderPlacementProcess(unittest.TestCase):
         The function will fail silently if:
         - The logout action switch or sign-out button cannot be found.
         """
-        self.driver.get("https://magento.softwaretestingboard.com/")
+        self.driver.get(config.url())
         log_out_action_switch = self.driver.find_elements(By.XPATH,"//span[@class='customer-name']//button[@class='action switch']")
         log_out_action_switch[0].click()
 
@@ -264,6 +480,9 @@ class TestOrderPlacementProcess(unittest.TestCase):
         sign_out_button = sign_out_locators[0]
         sign_out_button.click()
 
+        # Logging out ends the server-side session, so the cached one can't be reused
+        auth_cache.invalidate(config.customer_account()[0])
+
         
     
     def test_log_out(self):
@@ -280,7 +499,7 @@ class TestOrderPlacementProcess(unittest.TestCase):
         - The "Sign In" button does not appear after logging out.
         """
         driver = self.driver
-        driver.get("https://magento.softwaretestingboard.com/")
+        driver.get(config.url())
 
         self.log_in()
         
@@ -298,11 +517,13 @@ class TestOrderPlacementProcess(unittest.TestCase):
             )
             # Click the sign-out button to log out
             sign_out_button.click()
+            auth_cache.invalidate(config.customer_account()[0])
 
         except (NoSuchElementException, TimeoutError) as e:
             self.fail(f"Logout failed: {e}")
 
 
+    @timed_step
     def go_to_view_and_edit_cart(self):
         """
         Navigates to the 'View and Edit Cart' page.
@@ -346,6 +567,7 @@ class TestOrderPlacementProcess(unittest.TestCase):
 
 
         
+    @timed_step
     def go_to_checkout(self):
         """
         Navigates to the checkout page.
@@ -353,11 +575,11 @@ class TestOrderPlacementProcess(unittest.TestCase):
         This function first verifies the presence of items in the cart, then interacts 
         with the 'Show Cart' button to display the cart dropdown, and finally clicks 
         the 'Go to Checkout' button to navigate to the checkout page.
+
+        Returns:
+            bool: True if the checkout page was opened, False otherwise.
         """
-        WebDriverWait(self.driver, 20).until(
-            EC.invisibility_of_element_located((By.CSS_SELECTOR, "div.loading-mask"))
-        )
-        time.sleep(3)
+        wait_for_magento_idle(self.driver)
         # Verify that the item counter is present and visible
         try:
             item_counter = WebDriverWait(self.driver, 10).until(
@@ -366,7 +588,7 @@ class TestOrderPlacementProcess(unittest.TestCase):
             logging.info("Item counter found!")
         except Exception as e:
             logging.error(f"Item counter not found: {e}")
-            return
+            return False
 
         # Find and click the 'Show Cart' button
         try:
@@ -380,7 +602,7 @@ class TestOrderPlacementProcess(unittest.TestCase):
             show_cart_button.click()
         except Exception as e:
             logging.error(f"Failed to find or click the Show Cart button: {e}")
-            return
+            return False
 
         # Wait for the 'Go to Checkout' button to be clickable
         try:
@@ -391,11 +613,11 @@ class TestOrderPlacementProcess(unittest.TestCase):
             go_to_checkout_button.click()
         except Exception as e:
             logging.error(f"Failed to find or click the Go to Checkout button: {e}")
-            return
-
-
+            return False
+        return True
 
-    def apply_discount_code(self):
+    @timed_step
+    def apply_discount_code(self, code="20poff"):
         """
         Applies a discount code during the checkout process.
 
@@ -403,16 +625,16 @@ class TestOrderPlacementProcess(unittest.TestCase):
         if present, and applies a new discount code. The function assumes that the user 
         is already on the checkout page or a relevant page where the discount can be applied.
 
+        Args:
+            code (str): The discount code to apply.
+
         The function will fail if:
         - The discount code section cannot be opened.
         - The discount code field or apply button is not interactable.
         """
 
         try:
-            WebDriverWait(self.driver, 20).until(
-                EC.invisibility_of_element_located((By.CSS_SELECTOR, "div.loading-mask"))
-            )
-            time.sleep(3)
+            wait_for_magento_idle(self.driver)
             # Wait for and click the discount code section to expand it
             discount_code_button = WebDriverWait(self.driver, 20).until(
                 EC.element_to_be_clickable((By.ID, "block-discount-heading"))
@@ -437,8 +659,8 @@ class TestOrderPlacementProcess(unittest.TestCase):
             discount_code_field = WebDriverWait(self.driver, 20).until(
                 EC.element_to_be_clickable((By.ID, "discount-code"))
             )
-            discount_code_field.send_keys("20poff")
-            logging.info("Discount code '20poff' entered.")
+            discount_code_field.send_keys(code)
+            logging.info(f"Discount code '{code}' entered.")
             
             # Wait for and click the apply button
             apply_button = self.driver.find_element(By.XPATH, "//button[@class='action action-apply']")
@@ -455,136 +677,55 @@ class TestOrderPlacementProcess(unittest.TestCase):
         return True
 
 
+    @timed_step
     def delete_all_cart_items(self):
         """
         Deletes all items from the shopping cart.
 
-        This function navigates to the cart page, iteratively removes each item by clicking
-        the delete button, and waits until all items are removed from the cart. The process
-        continues until no delete buttons are found, indicating an empty cart.
+        This function navigates to the cart page and empties the cart with a single submit
+        of the cart form, whatever the number of items, then confirms in one check that
+        the empty cart page is shown.
 
-        The function logs the number of items found and deleted, and handles exceptions if
-        issues are encountered during the process.
+        Returns:
+            bool: True if the cart is empty, False otherwise.
         """
 
         # Navigate to the cart page
-        self.driver.get("https://magento.softwaretestingboard.com/checkout/cart/")
-
-        while True:
-            try:
-                # Find all delete buttons currently on the page
-                delete_item_buttons = self.driver.find_elements(By.CLASS_NAME, "action-delete")
-                if not delete_item_buttons:
-                    logging.info("No more items to delete. The cart is empty.")
-                    break
-
-                logging.info(f"Found {len(delete_item_buttons)} delete item button(s).")
-
-                # Click the first delete button found
-                elem = WebDriverWait(self.driver, 20).until(
-                    EC.element_to_be_clickable(delete_item_buttons[0])
-                )
-                elem.click()
-                logging.info("Clicked delete button for an item.")
-
-                # Wait until the item is removed from the DOM (element becomes stale)
-                WebDriverWait(self.driver, 20).until(EC.staleness_of(elem))
-                logging.info("Item removed from the cart.")
-
-                # Optional: Short sleep to allow DOM to fully update before next iteration
-                time.sleep(2)
-
-            except Exception as e:
-                logging.error(f"Error encountered while trying to delete items: {e}")
-                break
-        
-
-    def delete_specific_item_from_cart_by_item_name(self, item_name):
-        self.go_to_view_and_edit_cart()
-    
-    def delete_specific_item_from_cart_by_index(self, index):
-        self.go_to_view_and_edit_cart()
+        self.driver.get(config.url("checkout/cart/"))
 
- 
-    def test_buy_item_no_login(self):
-        """
-        Tests purchasing items as a guest user without logging in.
-
-        This function:
-        - Adds specified items to the shopping cart.
-        - Verifies the item counter to confirm items were added.
-        - Proceeds to checkout.
-        - Fills in the order details as a guest user.
-        - Submits the order.
-
-        The function logs each step and handles any issues encountered during the process.
-        """
-
-        # Navigate to the homepage
-        self.driver.get("https://magento.softwaretestingboard.com")
-
-        # Add items to the cart
-        self.add_item_to_cart("Proteus Fitness Jackshirt", 3, "XL", "Orange")
-        self.add_item_to_cart("Overnight Duffle", 3)
-
-        # Check if the item counter exists and validate the cart contents
-        try:
-            item_counter = WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.CLASS_NAME, "counter-number"))
-            )
-            logging.info(f"Item counter found with {item_counter.text} item(s).")
-        except Exception as e:
-            logging.error(f"Item counter not found: {e}")
-            return False
-
-        # Proceed to checkout using the cart button
         try:
-            show_cart_button = WebDriverWait(self.driver, 20).until(
-                EC.element_to_be_clickable((By.CSS_SELECTOR, "a.action.showcart"))
-            )
-            logging.info("Show Cart button found and clicked.")
-            show_cart_button.click()
+            removed = clear_cart(self.driver)
+            logging.info(f"Cleared {removed} item(s) from the cart. The cart is empty.")
         except Exception as e:
-            logging.error(f"Show Cart button not found or not clickable: {e}")
+            logging.error(f"Error encountered while trying to clear the cart: {e}")
             return False
+        return True
 
-        try:
-            go_to_checkout_button = WebDriverWait(self.driver, 20).until(
-                EC.element_to_be_clickable((By.ID, "top-cart-btn-checkout"))
-            )
-            logging.info("Go to Checkout button found and clicked.")
-            go_to_checkout_button.click()
-        except Exception as e:
-            logging.error(f"Go to Checkout button not found or not clickable: {e}")
-            return False
-        self.driver.get("https://magento.softwaretestingboard.com/checkout/#shipping")
-        # Wait for the page to load completely before proceeding
-        WebDriverWait(self.driver, 100).until(
-            lambda driver: driver.execute_script('return document.readyState') == 'complete'
-        )
+    @timed_step
+    def submit_shipping_method(self, select_rate=True):
+        """
+        Submits the shipping method step of the checkout.
 
-        # Fill in the order details as a guest user
-        self.fill_order_details_for_no_login_user()
+        Args:
+            select_rate (bool): Select the first shipping rate before submitting. Logged-in
+                customers with a default shipping method can submit the form directly.
 
-        # Select shipping method
+        Returns:
+            bool: True if the form was submitted, False otherwise.
+        """
         try:
-            # Wait for any loading mask to disappear
-            WebDriverWait(self.driver, 20).until(
-                EC.invisibility_of_element_located((By.CSS_SELECTOR, "div.loading-mask"))
-            )
-            time.sleep(5)
+            # Wait for the shipping rates to load
+            wait_for_magento_idle(self.driver)
 
-            shipping_radio_button = WebDriverWait(self.driver, 20).until(
-                EC.element_to_be_clickable((By.CSS_SELECTOR, "input[type='radio']"))
-            )
-            shipping_radio_button.click()
-            logging.info("Shipping method selected.")
+            if select_rate:
+                shipping_radio_button = WebDriverWait(self.driver, 20).until(
+                    EC.element_to_be_clickable((By.CSS_SELECTOR, "input[type='radio']"))
+                )
+                shipping_radio_button.click()
+                logging.info("Shipping method selected.")
 
-            # Wait for any loading mask to disappear
-            WebDriverWait(self.driver, 20).until(
-                EC.invisibility_of_element_located((By.CSS_SELECTOR, "div.loading-mask"))
-            )
-            time.sleep(3)
+                # Wait for the shipping method to be saved
+                wait_for_magento_idle(self.driver)
 
             shipping_method_form = WebDriverWait(self.driver, 20).until(
                 EC.element_to_be_clickable((By.ID, "co-shipping-method-form"))
@@ -594,10 +735,17 @@ class TestOrderPlacementProcess(unittest.TestCase):
         except Exception as e:
             logging.error(f"Failed to select shipping method or submit form: {e}")
             return False
+        return True
+
+    @timed_step
+    def place_order(self):
+        """
+        Submits the payment step and places the order.
 
-        # Proceed to payment
+        Returns:
+            bool: True if the Place Order button was clicked, False otherwise.
+        """
         try:
-            
             payment_form = WebDriverWait(self.driver, 20).until(
                 EC.element_to_be_clickable((By.ID, "co-payment-form"))
             )
@@ -612,63 +760,171 @@ class TestOrderPlacementProcess(unittest.TestCase):
         except Exception as e:
             logging.error(f"Failed to submit payment or place order: {e}")
             return False
-
         return True
 
+    @timed_step
+    def delete_specific_item_from_cart_by_item_name(self, item_name):
+        """
+        Deletes every line item of a product from the shopping cart.
 
+        The cart page is read once into an index of its line items and the matching
+        items are removed with a single cart update.
 
-    def test_buy_item_login(self):
+        Args:
+            item_name (str): The product name, e.g. "Overnight Duffle".
+
+        Returns:
+            int: The number of line items removed, 0 if the product was not in the cart.
         """
-        Tests purchasing items while logged in.
+        self.driver.get(config.url("checkout/cart/"))
+        try:
+            return remove_items(self.driver, read_cart(self.driver).named(item_name))
+        except CartPageError as e:
+            logging.error(f"Failed to delete '{item_name}' from the cart: {e}")
+            return 0
+
+    @timed_step
+    def delete_specific_item_from_cart_by_index(self, index):
+        """
+        Deletes the line item at a position of the shopping cart table.
+
+        Args:
+            index (int): The 0-based position in the cart, negative positions count from the end.
+
+        Returns:
+            int: 1 if the item was removed, 0 otherwise.
+        """
+        self.driver.get(config.url("checkout/cart/"))
+        try:
+            return remove_items(self.driver, [read_cart(self.driver).at(index)])
+        except CartPageError as e:
+            logging.error(f"Failed to delete item {index} from the cart: {e}")
+            return 0
+
+ 
+    def test_buy_item_no_login(self):
+        """
+        Tests purchasing items as a guest user without logging in.
 
         This function:
-        - Logs into the user account.
         - Adds specified items to the shopping cart.
+        - Verifies the item counter to confirm items were added.
         - Proceeds to checkout.
-        - Applies a discount code.
-        - Completes the checkout process.
+        - Fills in the order details as a guest user.
+        - Submits the order.
 
-        The function logs each step and handles exceptions if any issues are encountered.
+        The steps run as a StepFlow: a step that fails is retried from the checkpoint
+        taken after the previous step, without adding the items to the cart again.
         """
 
-        # Navigate to the homepage
-        self.driver.get("https://magento.softwaretestingboard.com")
+        def add_items():
+            # Navigate to the homepage and add items to the cart
+            self.driver.get(config.url())
+            self.add_item_to_cart("Proteus Fitness Jackshirt", 3, "XL", "Orange")
+            self.add_item_to_cart("Overnight Duffle", 3)
 
-        # Log in
-        self.log_in()
-        logging.info("User logged in successfully.")
+        def open_checkout():
+            # Check if the item counter exists and validate the cart contents
+            try:
+                item_counter = WebDriverWait(self.driver, 10).until(
+                    EC.presence_of_element_located((By.CLASS_NAME, "counter-number"))
+                )
+                logging.info(f"Item counter found with {item_counter.text} item(s).")
+            except Exception as e:
+                logging.error(f"Item counter not found: {e}")
+                return False
 
-        # Add items to the cart
-        self.add_item_to_cart("Proteus Fitness Jackshirt", 3, "XL", "Orange")
-        self.add_item_to_cart("Overnight Duffle", 3)
-        self.add_item_to_cart("Ina Compression Short", 3, 28, "Red")
-        logging.info("Items added to cart.")
+            # Proceed to checkout using the cart button
+            try:
+                show_cart_button = WebDriverWait(self.driver, 20).until(
+                    EC.element_to_be_clickable((By.CSS_SELECTOR, "a.action.showcart"))
+                )
+                logging.info("Show Cart button found and clicked.")
+                show_cart_button.click()
+            except Exception as e:
+                logging.error(f"Show Cart button not found or not clickable: {e}")
+                return False
 
-        # Proceed to checkout
-        self.go_to_checkout()
-        logging.info("Navigated to checkout.")
+            try:
+                go_to_checkout_button = WebDriverWait(self.driver, 20).until(
+                    EC.element_to_be_clickable((By.ID, "top-cart-btn-checkout"))
+                )
+                logging.info("Go to Checkout button found and clicked.")
+                go_to_checkout_button.click()
+            except Exception as e:
+                logging.error(f"Go to Checkout button not found or not clickable: {e}")
+                return False
+            self.driver.get(config.url("checkout/#shipping"))
+            # Wait for the page to load completely before proceeding
+            WebDriverWait(self.driver, 100).until(
+                lambda driver: driver.execute_script('return document.readyState') == 'complete'
+            )
 
-        # Wait for the page to load fully
-        time.sleep(4)  # Replace with WebDriverWait if specific element presence is needed
+        StepFlow(self.driver, self.id()).run([
+            # Adding to the cart again would add the items twice, it is not retried.
+            ("add items to cart", add_items, 0),
+            ("open checkout", open_checkout),
+            # Fill in the order details as a guest user
+            ("fill order details", self.fill_order_details_for_no_login_user),
+            # Select shipping method
+            ("submit shipping method", self.submit_shipping_method),
+            # Proceed to payment
+            ("place order", self.place_order),
+        ])
 
-        try:
-            # Locate and submit the shipping method form
-            form_next_thing = WebDriverWait(self.driver, 20).until(
-                EC.element_to_be_clickable((By.ID, "co-shipping-method-form"))
-            )
-            form_next_thing.submit()
-            logging.info("Shipping method form submitted.")
-        except Exception as e:
-            logging.error(f"Error submitting shipping method form: {e}")
-            return False
 
-        # Apply a discount code
-        self.apply_discount_code()
-        logging.info("Discount code applied.")
 
-        return True
+    def test_buy_item_login(self):
+        """
+        Tests purchasing items while logged in.
+
+        This function:
+        - Logs into the user account.
+        - Adds specified items to the shopping cart.
+        - Proceeds to checkout.
+        - Applies a discount code.
+        - Completes the checkout process.
+
+        The steps run as a StepFlow: a step that fails is retried from the checkpoint
+        taken after the previous step, without logging in or filling the cart again.
+        """
+
+        def log_in():
+            # Navigate to the homepage and log in
+            self.driver.get(config.url())
+            self.log_in()
+            logging.info("User logged in successfully.")
+
+        def fill_cart():
+            self.seed_cart([
+                ("Proteus Fitness Jackshirt", 3, "XL", "Orange"),
+                ("Overnight Duffle", 3),
+                ("Ina Compression Short", 3, 28, "Red"),
+            ])
+            logging.info("Items added to cart.")
+
+        def open_checkout():
+            if not self.go_to_checkout():
+                return False
+            logging.info("Navigated to checkout.")
+            # Wait for the checkout page to finish rendering
+            wait_for_magento_idle(self.driver)
+
+        def apply_discount_code():
+            if self.apply_discount_code() is False:
+                return False
+            logging.info("Discount code applied.")
+
+        StepFlow(self.driver, self.id()).run([
+            ("log in", log_in),
+            # Adding to the cart again would add the items twice, it is not retried.
+            ("fill cart", fill_cart, 0),
+            ("open checkout", open_checkout),
+            # Submit the shipping method form with the customer's default shipping method
+            ("submit shipping method", functools.partial(self.submit_shipping_method, select_rate=False)),
+            ("apply discount code", apply_discount_code),
+        ])
 
-            
     def test_delete_cart_items(self):
         """
         Tests adding items to the cart, deleting them, and logging out.
@@ -684,7 +940,7 @@ class TestOrderPlacementProcess(unittest.TestCase):
 
         # Navigate to the homepage
         driver = self.driver
-        driver.get("https://magento.softwaretestingboard.com")
+        driver.get(config.url())
         logging.info("Navigated to homepage.")
 
         # Log in to the account
@@ -692,8 +948,10 @@ class TestOrderPlacementProcess(unittest.TestCase):
         logging.info("User logged in successfully.")
 
         # Add items to the cart
-        self.add_item_to_cart("Proteus Fitness Jackshirt", 3, "XL", "Orange")
-        self.add_item_to_cart("Overnight Duffle", 3)
+        self.seed_cart([
+            ("Proteus Fitness Jackshirt", 3, "XL", "Orange"),
+            ("Overnight Duffle", 3),
+        ])
         logging.info("Items added to cart.")
 
         # Delete all items from the cart
@@ -701,21 +959,218 @@ class TestOrderPlacementProcess(unittest.TestCase):
         logging.info("All items deleted from cart.")
 
         # Wait for the cart to update
-        time.sleep(10)  # Consider replacing with a more dynamic wait if needed
+        wait_for_magento_idle(self.driver)
 
         # Log out of the account
         self.log_out()
         logging.info("User logged out successfully.")
 
 
-if __name__ == "__main__":
-    # unittest.main()
+    def test_delete_specific_cart_items(self):
+        """
+        Tests deleting single cart items by product name and by position.
+        """
 
+        # Navigate to the homepage and log in
+        self.driver.get(config.url())
+        self.log_in()
+
+        # Fill the cart (the first item is added in two sizes, i.e. as two line items). The
+        # customer's cart outlasts the session, so it is replaced rather than added to.
+        self.seed_cart([
+            ("Proteus Fitness Jackshirt", 1, "XL", "Orange"),
+            ("Proteus Fitness Jackshirt", 1, "M", "Black"),
+            ("Overnight Duffle", 2),
+            ("Ina Compression Short", 1, 28, "Red"),
+        ], replace=True)
+        self.driver.get(config.url("checkout/cart/"))
+        self.assertCountEqual([item.name for item in read_cart(self.driver).items],
+                              ["Proteus Fitness Jackshirt", "Proteus Fitness Jackshirt", "Overnight Duffle",
+                               "Ina Compression Short"])
+
+        # Both lines of the jackshirt go with one delete by name
+        self.assertEqual(self.delete_specific_item_from_cart_by_item_name("Proteus Fitness Jackshirt"), 2)
+        self.assertEqual([item.name for item in read_cart(self.driver).items],
+                         ["Overnight Duffle", "Ina Compression Short"])
+
+        # Delete the first remaining line by position
+        self.assertEqual(self.delete_specific_item_from_cart_by_index(0), 1)
+        self.assertEqual([item.name for item in read_cart(self.driver).items], ["Ina Compression Short"])
+
+        self.assertTrue(self.delete_all_cart_items())
+
+
+    def test_concurrent_guest_checkouts(self):
+        """
+        Tests several guest checkouts running at the same time in tabs of one browser.
+
+        Each checkout runs as an async flow (async_flows.py) in its own browser context,
+        so every tab has its own guest cart, and under its own timeout.
+        """
+        flows = {
+            "guest-duffle": functools.partial(async_flows.guest_checkout, items=[("Overnight Duffle", 1)]),
+            "guest-jackshirt": functools.partial(async_flows.guest_checkout,
+                                                 items=[("Proteus Fitness Jackshirt", 2, "XL", "Orange")]),
+            "guest-coupon": functools.partial(async_flows.guest_checkout, items=[("Overnight Duffle", 3)],
+                                              discount_code="20poff"),
+        }
+        results = async_flows.run_concurrently(self.driver, flows, flow_timeout=90)
+        for name, result in results.items():
+            with self.subTest(flow=name):
+                self.assertEqual(result.outcome, "passed", result.error)
+
+
+class ScenarioCheckoutTest(TestOrderPlacementProcess):
+    """
+    One checkout of the scenario matrix (order_scenarios.csv), run as its own test.
+
+    The test only holds the scenario id; the row is read when the test runs, so a
+    parallel worker parses just the scenarios of its shard.
+    """
+
+    # Built per scenario by build_scenario_suite(), not collected by method name.
+    __test__ = False
+
+    def __init__(self, scenario_path, scenario_id, methodName="run_scenario"):
+        super().__init__(methodName)
+        self.scenario_path = scenario_path
+        self.scenario_id = scenario_id
 
+    def id(self):
+        return f"{super().id()}[{self.scenario_id}]"
+
+    def __str__(self):
+        return f"run_scenario[{self.scenario_id}] ({unittest.util.strclass(self.__class__)})"
+
+    def __eq__(self, other):
+        return super().__eq__(other) and self.scenario_id == other.scenario_id
+
+    def __hash__(self):
+        return hash((type(self), self.scenario_id))
+
+    @timed_step
+    def fill_scenario_cart(self, scenario):
+        """Fill the cart of the scenario, through the API where possible."""
+        if scenario.login == "customer":
+            self.seed_cart(scenario.items)
+            return
+        if config.CART_SEEDING == "api":
+            try:
+                seed_guest_cart(self.driver, scenario.items)
+                wait_for_magento_idle(self.driver)
+                return
+            except CartSeedingError as e:
+                logging.info(f"Adding the guest items through the UI: {e}")
+        for item in scenario.items:
+            self.add_item_to_cart(*item)
+
+    def run_scenario(self):
+        scenario = load_scenario(self.scenario_path, self.scenario_id)
+        logging.info(f"Running order scenario {scenario.id} ({scenario.login}, {len(scenario.items)} line item(s)).")
+
+        if scenario.login == "customer":
+            self.log_in()
+        self.fill_scenario_cart(scenario)
+        self.checkout_scenario(scenario)
+
+    def checkout_scenario(self, scenario):
+        """Check the filled cart of a scenario out and confirm the order was placed."""
+        self.assertTrue(self.go_to_checkout(), "The checkout page could not be opened.")
+        if scenario.login == "guest":
+            self.assertTrue(
+                self.fill_order_details_for_no_login_user(details=scenario.details, country=scenario.country_id,
+                                                          region=scenario.region_id),
+                "The order details could not be filled in.")
+        else:
+            wait_for_magento_idle(self.driver)
+
+        self.assertTrue(self.submit_shipping_method(select_rate=scenario.login == "guest"),
+                        "The shipping method could not be submitted.")
+        if scenario.discount_code:
+            self.assertTrue(self.apply_discount_code(scenario.discount_code), "The discount code was not applied.")
+            wait_for_magento_idle(self.driver)
+        self.assertTrue(self.place_order(), "The order could not be placed.")
+
+        WebDriverWait(self.driver, 20).until(EC.url_contains("checkout/onepage/success"))
+        logging.info(f"Order scenario {scenario.id} placed.")
+
+
+class ScenarioMatrixTest(ScenarioCheckoutTest):
+    """
+    Every scenario of a file in one test, the steps they share run once (ORDER_SCENARIO_PREFIXES=shared).
+
+    Each scenario is reported as a subtest.
+    """
+
+    __test__ = False
+
+    def __init__(self, scenario_path):
+        super().__init__(scenario_path, "shared-prefixes", "run_matrix")
+
+    @timed_step
+    def run_scenario_step(self, step):
+        """Run one step of scenario_engine, failing by raising."""
+        if step.name == "open storefront":
+            self.driver.get(config.url())
+        elif step.name == "log in":
+            self.log_in()
+            # The customer's cart outlasts the session: empty what earlier tests left in it,
+            # the "add to cart" steps below build the scenario's cart on top of it.
+            self.seed_cart([])
+        elif step.name == "add to cart":
+            login, *item = step.args
+            if login == "customer":
+                # The cart of the scenario is built one line item per step.
+                self.seed_cart([item], replace=False)
+            else:
+                self.add_item_to_cart(*item)
+        elif step.name == "checkout":
+            self.checkout_scenario(load_scenario(self.scenario_path, step.args[0]))
+        else:
+            raise ValueError(f"Unknown scenario step '{step.name}'.")
+
+    def run_matrix(self):
+        results = scenario_engine.run_shared(
+            iter_scenarios(self.scenario_path), self.run_scenario_step,
+            functools.partial(scenario_engine.take_snapshot, self.driver),
+            functools.partial(scenario_engine.restore_snapshot, self.driver),
+        )
+        for scenario_id, error in results.items():
+            with self.subTest(scenario=scenario_id):
+                if error is not None:
+                    raise error
+
+
+def build_scenario_suite(path=config.SCENARIOS_FILE):
+    """
+    One ScenarioCheckoutTest per row of the scenario file (or a single ScenarioMatrixTest
+    with ORDER_SCENARIO_PREFIXES=shared), or an empty suite when none is configured.
+    """
+    if not path:
+        return unittest.TestSuite()
+    if config.SCENARIO_PREFIXES == "shared":
+        return unittest.TestSuite([ScenarioMatrixTest(path)])
+    return unittest.TestSuite(ScenarioCheckoutTest(path, scenario_id) for scenario_id in scenario_ids(path))
+
+
+def build_suite():
+    """Build the suite run by the __main__ block and sharded by parallel_runner.py."""
     elements_checking = unittest.TestLoader().loadTestsFromTestCase(ElementsExistenceTests)
     order_process_checking = unittest.TestLoader().loadTestsFromTestCase(TestOrderPlacementProcess)
-    test_suite = unittest.TestSuite([order_process_checking, elements_checking])
+    return unittest.TestSuite([order_process_checking, elements_checking, build_scenario_suite()])
+
 
+def load_tests(loader, tests, pattern):
+    """Let `python -m unittest` run the same suite, scenarios included."""
+    suite = build_suite()
+    expect_tests(suite.countTestCases())
+    return suite
+
+
+if __name__ == "__main__":
+    # unittest.main()
 
-    # run the suite
-    unittest.TextTestRunner(verbosity=2).run(test_suite)
+    # run the suite (use parallel_runner.py to run it across worker processes)
+    suite = build_suite()
+    expect_tests(suite.countTestCases())
+    unittest.TextTestRunner(verbosity=2).run(suite)
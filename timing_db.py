@@ -0,0 +1,141 @@
+"""
+Test durations across runs, and a schedule built from them.
+
+Every run of parallel_runner.py stores the duration and outcome of each test in a
+local SQLite database (ORDER_TIMING_DB, default .test_timings.sqlite3). The next run
+estimates each test from its recent runs and assigns the tests to workers
+longest first, always to the worker with the least estimated work so far (the LPT
+rule), so one worker doesn't end up running the slow checkouts back to back while
+the others sit idle. Tests that failed recently can be put at the front of their
+worker's shard, so their outcome is known early in the run.
+"""
+import heapq
+import logging
+import os
+import sqlite3
+import statistics
+import time
+
+DATABASE = os.environ.get("ORDER_TIMING_DB", ".test_timings.sqlite3")
+
+# Runs considered when estimating a test or checking whether it is failing.
+HISTORY = 5
+
+# Estimate of a test that never ran, when no test has history either.
+DEFAULT_DURATION = 10.0
+
+FAILED_OUTCOMES = ("failure", "error")
+
+
+class TimingDatabase:
+    """The durations and outcomes of past test runs."""
+
+    def __init__(self, path=DATABASE):
+        self.path = path
+        self._connection = sqlite3.connect(path)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS runs ("
+            "test_id TEXT NOT NULL, outcome TEXT NOT NULL, duration REAL, "
+            "finished_at REAL NOT NULL, worker INTEGER)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS runs_by_test ON runs (test_id, finished_at)")
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+    def record(self, records, test_ids=None):
+        """
+        Store the outcomes recorded by the workers.
+
+        Failed subtests are not stored: RecordingResult also records their test, with its
+        duration and the failure.
+
+        Args:
+            records (list): Records of parallel_runner.RecordingResult.
+            test_ids (list): The tests of the run; records of anything else are not stored.
+        """
+        rows = []
+        now = time.time()
+        for record in records:
+            if "parent" in record or (test_ids is not None and record["id"] not in test_ids):
+                continue
+            rows.append((record["id"], record["outcome"], record["duration"], now, record.get("worker")))
+        with self._connection:
+            self._connection.executemany(
+                "INSERT INTO runs (test_id, outcome, duration, finished_at, worker) VALUES (?, ?, ?, ?, ?)", rows
+            )
+
+    def _recent(self, test_id, history):
+        return self._connection.execute(
+            "SELECT outcome, duration FROM runs WHERE test_id = ? ORDER BY finished_at DESC LIMIT ?",
+            (test_id, history),
+        ).fetchall()
+
+    def estimates(self, test_ids, history=HISTORY):
+        """
+        Estimate the duration of each test: the median of its recent runs that were not skipped.
+
+        Tests without history get the median estimate of the others.
+
+        Returns:
+            dict: Estimated seconds per test id.
+        """
+        known = {}
+        for test_id in test_ids:
+            durations = [duration for outcome, duration in self._recent(test_id, history)
+                         if outcome != "skip" and duration is not None]
+            if durations:
+                known[test_id] = statistics.median(durations)
+        default = statistics.median(known.values()) if known else DEFAULT_DURATION
+        return {test_id: known.get(test_id, default) for test_id in test_ids}
+
+    def failing(self, test_ids, history=HISTORY):
+        """The tests that failed in at least one of their recent runs."""
+        return {test_id for test_id in test_ids
+                if any(outcome in FAILED_OUTCOMES for outcome, _ in self._recent(test_id, history))}
+
+
+def schedule(test_ids, workers, estimates, failing=()):
+    """
+    Assign tests to workers, longest first, each to the worker with the least work so far.
+
+    Args:
+        test_ids (list): The tests to run.
+        workers (int): The number of workers.
+        estimates (dict): Estimated seconds per test id.
+        failing (set): Tests to run first within their shard.
+
+    Returns:
+        tuple: One list of test ids per worker, and the estimated seconds of work of each worker.
+    """
+    loads = [(0.0, worker_id) for worker_id in range(workers)]
+    shards = [[] for _ in range(workers)]
+    for test_id in sorted(test_ids, key=lambda test_id: estimates[test_id], reverse=True):
+        load, worker_id = heapq.heappop(loads)
+        shards[worker_id].append(test_id)
+        heapq.heappush(loads, (load + estimates[test_id], worker_id))
+    for shard in shards:
+        # Stable sort: the failing tests move to the front, the rest stay longest first.
+        shard.sort(key=lambda test_id: test_id not in failing)
+    totals = [sum(estimates[test_id] for test_id in shard) for shard in shards]
+    return shards, totals
+
+
+def plan(test_ids, workers, failing_first=False, path=DATABASE):
+    """
+    Build the shards of a run from the timing database.
+
+    Returns:
+        list: One list of test ids per worker.
+    """
+    database = TimingDatabase(path)
+    try:
+        estimates = database.estimates(test_ids)
+        failing = database.failing(test_ids) if failing_first else set()
+    finally:
+        database.close()
+    shards, totals = schedule(test_ids, workers, estimates, failing)
+    logging.info(f"Scheduled {len(test_ids)} tests on {workers} workers, estimated "
+                 f"{max(totals, default=0.0):.1f}s ({len(failing)} recently failing test(s) first).")
+    return shards
@@ -0,0 +1,163 @@
+import logging
+import time
+
+from selenium.common.exceptions import JavascriptException, TimeoutException
+
+from instrumentation import timed_wait
+
+
+# Installed in every document of the session. It counts pending XHR/fetch requests
+# and re-checks Magento's idle state whenever the DOM, the network or the ready
+# state changes, so a waiting test is called back as soon as the page settles.
+IDLE_OBSERVER_SCRIPT = """
+(function () {
+    if (window.__magentoIdle) { return; }
+    var state = window.__magentoIdle = {pending: 0, waiters: [], timer: null, idleSince: null};
+
+    var send = XMLHttpRequest.prototype.send;
+    XMLHttpRequest.prototype.send = function () {
+        state.pending++;
+        this.addEventListener('loadend', function () { state.pending--; state.check(); });
+        return send.apply(this, arguments);
+    };
+    if (window.fetch) {
+        var originalFetch = window.fetch;
+        window.fetch = function () {
+            state.pending++;
+            return originalFetch.apply(this, arguments).finally(function () { state.pending--; state.check(); });
+        };
+    }
+
+    function isVisible(element) {
+        var style = window.getComputedStyle(element);
+        return style.display !== 'none' && style.visibility !== 'hidden' && element.getClientRects().length > 0;
+    }
+
+    state.isIdle = function () {
+        if (document.readyState !== 'complete' || state.pending > 0) { return false; }
+        if (window.jQuery && window.jQuery.active > 0) { return false; }
+        // RequireJS keeps modules that are still loading (including Knockout templates) in its registry.
+        if (window.require && window.require.s) {
+            var context = window.require.s.contexts._;
+            if (context && Object.keys(context.registry).length > 0) { return false; }
+        }
+        var masks = document.querySelectorAll('div.loading-mask, #checkout-loader, [data-role="spinner"]');
+        for (var i = 0; i < masks.length; i++) {
+            if (isVisible(masks[i])) { return false; }
+        }
+        return true;
+    };
+
+    // The quiet period runs from the moment the page was last seen becoming idle. An armed
+    // timer is left alone while the page stays idle and is only cleared when it gets busy,
+    // so the re-checks below (DOM changes, the interval) cannot keep postponing it.
+    state.check = function () {
+        if (!state.waiters.length) { return; }
+        if (!state.isIdle()) {
+            state.idleSince = null;
+            clearTimeout(state.timer);
+            state.timer = null;
+            return;
+        }
+        if (state.idleSince === null) { state.idleSince = Date.now(); }
+        if (state.timer !== null) { return; }
+        var quietMs = Math.min.apply(null, state.waiters.map(function (w) { return w.quietMs; }));
+        state.timer = setTimeout(state.release, Math.max(0, state.idleSince + quietMs - Date.now()));
+    };
+
+    state.release = function () {
+        state.timer = null;
+        if (!state.isIdle()) {
+            state.idleSince = null;
+            return;
+        }
+        var quiet = Date.now() - state.idleSince;
+        var ready = state.waiters.filter(function (w) { return w.quietMs <= quiet; });
+        state.waiters = state.waiters.filter(function (w) { return w.quietMs > quiet; });
+        if (!state.waiters.length) { state.idleSince = null; }
+        ready.forEach(function (w) { w.callback(true); });
+        // Waiters that need a longer quiet period get a timer for the rest of it.
+        state.check();
+    };
+
+    state.whenIdle = function (quietMs, callback) {
+        state.waiters.push({quietMs: quietMs, callback: callback});
+        state.check();
+    };
+
+    var start = function () {
+        new MutationObserver(state.check).observe(document.documentElement, {
+            subtree: true, childList: true, attributes: true, attributeFilter: ['style', 'class']
+        });
+    };
+    if (document.documentElement) { start(); } else { document.addEventListener('DOMContentLoaded', start); }
+    document.addEventListener('readystatechange', state.check);
+    window.addEventListener('load', state.check);
+    // Safety net for changes that raise no event (e.g. RequireJS finishing a define), checked in the browser.
+    setInterval(state.check, 100);
+})();
+"""
+
+WAIT_FOR_IDLE_SCRIPT = IDLE_OBSERVER_SCRIPT + """
+window.__magentoIdle.whenIdle(arguments[0], arguments[arguments.length - 1]);
+"""
+
+
+def install_idle_observer(driver):
+    """
+    Register the idle observer so it runs before the page scripts of every new document.
+
+    Installing it ahead of the page lets it see the XHR/fetch requests Magento starts
+    while loading. Registration is kept by the browser, so it is done once per session.
+    """
+    if getattr(driver, "_magento_idle_observer", False):
+        return
+    try:
+        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": IDLE_OBSERVER_SCRIPT})
+    except Exception as e:
+        logging.warning(f"Could not register the idle observer for new documents: {e}")
+    driver._magento_idle_observer = True
+
+
+def wait_for_magento_idle(driver, timeout=20, quiet_ms=150):
+    """
+    Wait until the storefront is idle: the document is loaded, no XHR/fetch or jQuery
+    request is pending, RequireJS has no module left to load and no loading mask is shown.
+
+    The browser calls back as soon as the page has stayed idle for quiet_ms, so the
+    wait lasts exactly as long as the page needs. Navigations that happen while
+    waiting are followed until the timeout.
+
+    Args:
+        driver (WebDriver): The browser session.
+        timeout (float): Maximum number of seconds to wait.
+        quiet_ms (int): How long the page must stay idle to be considered settled.
+
+    Raises:
+        TimeoutException: If the page is still busy after the timeout.
+    """
+    with timed_wait("wait: magento_idle"):
+        _wait_until_idle(driver, timeout, quiet_ms)
+
+
+def _wait_until_idle(driver, timeout, quiet_ms):
+    install_idle_observer(driver)
+    # The script timeout is a session setting, put back the one the session had.
+    previous_timeout = driver.timeouts.script
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutException(f"Storefront was still busy after {timeout} seconds.")
+            driver.set_script_timeout(remaining)
+            try:
+                driver.execute_async_script(WAIT_FOR_IDLE_SCRIPT, quiet_ms)
+                return
+            except TimeoutException:
+                raise TimeoutException(f"Storefront was still busy after {timeout} seconds.")
+            except JavascriptException as e:
+                # The document was replaced by a navigation while waiting, wait on the new one.
+                logging.debug(f"Page changed while waiting for idle: {e}")
+    finally:
+        driver.set_script_timeout(previous_timeout)